@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+from typing import Optional
+
+from ambramelin.util import agent
+from ambramelin.util.agent import AgentServer
+from ambramelin.util.errors import AgentAlreadyRunningError, AgentNotRunningError
+
+
+def _request(op: str) -> dict:
+    response = agent.request(op)
+
+    if response is None:
+        raise AgentNotRunningError()
+
+    return response
+
+
+def cmd_clear(_: argparse.Namespace) -> None:
+    _request("clear")
+
+
+def cmd_start(args: argparse.Namespace) -> Optional[str]:
+    if agent.request("status") is not None:
+        raise AgentAlreadyRunningError()
+
+    path = agent.get_socket_path()
+    server = AgentServer(path, args.ttl)
+
+    if not args.foreground:
+        if os.fork() != 0:
+            server.socket.close()
+            return f"Agent listening on {path}"
+
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+
+        for fd in (sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()):
+            os.dup2(devnull, fd)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+
+    if not args.foreground:
+        os._exit(0)
+
+    return None
+
+
+def cmd_status(_: argparse.Namespace) -> dict:
+    response = _request("status")
+    return {
+        "socket": str(agent.get_socket_path()),
+        "ttl": response["ttl"],
+        "accounts": response["accounts"],
+    }
+
+
+def cmd_stop(_: argparse.Namespace) -> None:
+    _request("stop")
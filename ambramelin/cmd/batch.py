@@ -0,0 +1,164 @@
+import argparse
+import contextlib
+import io
+import json
+import shlex
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import partial
+from typing import TextIO
+
+from ambramelin.parser import build_parser, get_cmd
+from ambramelin.util.config import load_config
+from ambramelin.util.input import set_interactive
+from ambramelin.util.sdk import shared_apis
+
+# commands that may change the config, which later commands are parsed (and run)
+# against, and so that run once the commands before them have finished, and before
+# the commands after them start
+CONFIG_CMDS = {"env", "user"}
+
+# commands that write to stdout themselves, which would be interleaved with the
+# batch's results, or that never finish
+STDOUT_CMDS = {"study diff", "study watch"}
+
+
+@contextlib.contextmanager
+def _open_commands(file: str) -> Iterator[TextIO]:
+    if file == "-":
+        yield sys.stdin
+    else:
+        with open(file, "r") as f:
+            yield f
+
+
+def _iter_commands(f: TextIO) -> Iterator[tuple[int, str]]:
+    for line_num, line in enumerate(f, start=1):
+        line = line.strip()
+
+        if line and not line.startswith("#"):
+            yield line_num, line
+
+
+def _parse(parser: argparse.ArgumentParser, command: str) -> argparse.Namespace:
+    stderr = io.StringIO()
+
+    try:
+        with contextlib.redirect_stderr(stderr):
+            args = parser.parse_args(shlex.split(command))
+    except SystemExit:
+        # argparse's error message is the last line it writes
+        message = stderr.getvalue().strip()
+        raise ValueError(message.splitlines()[-1] if message else "Invalid command.")
+
+    if args.cmd is None or args.subcmd is None:
+        raise ValueError("No command given.")
+
+    if args.cmd == "batch":
+        raise ValueError("Batches cannot be nested.")
+
+    if args.envs is not None or args.all_envs:
+        raise ValueError("'envs' and 'all-envs' are not supported in batches.")
+
+    if args.yes:
+        raise ValueError("'yes' applies to whole batches ('ambra --yes batch run').")
+
+    command = f"{args.cmd} {args.subcmd}"
+    to_stdout = command == "study download" and args.dest.format(uuid=args.uuid) == "-"
+
+    if command in STDOUT_CMDS or to_stdout:
+        raise ValueError(
+            f"'{command}' cannot write to stdout in batches, which "
+            "lists their results."
+        )
+
+    return args
+
+
+def _run(args: argparse.Namespace) -> dict:
+    start = time.monotonic()
+
+    try:
+        result = get_cmd(args)(args)
+    except (Exception, SystemExit) as e:
+        # a failing command must not take the rest of the batch down with it
+        outcome = {"status": "error", "error": repr(e)}
+    else:
+        outcome = {"status": "ok", "result": result}
+
+    return {**outcome, "seconds": round(time.monotonic() - start, 3)}
+
+
+def cmd_run(args: argparse.Namespace) -> None:
+    # commands may be read from stdin, and nobody is around to answer prompts anyway,
+    # so commands that would prompt fail (unless the batch is run with '--yes')
+    set_interactive(False)
+    # parsers offer the environments and users as choices, which earlier commands
+    # may have added (or deleted)
+    parsers: dict[tuple[tuple[str, ...], tuple[str, ...]], argparse.ArgumentParser] = {}
+    lock = threading.Lock()
+    failed = False
+
+    def get_parser() -> argparse.ArgumentParser:
+        config = load_config()
+        key = tuple(config.envs), tuple(config.users)
+
+        if key not in parsers:
+            parsers[key] = build_parser(config)[0]
+
+        return parsers[key]
+
+    def report(line_num: int, command: str, outcome: dict) -> None:
+        nonlocal failed
+
+        with lock:
+            failed = failed or outcome["status"] == "error"
+            print(
+                json.dumps({"line": line_num, "command": command, **outcome}),
+                flush=True,
+            )
+
+    def report_future(line_num: int, command: str, future: Future) -> None:
+        report(line_num, command, future.result())
+
+    with _open_commands(args.file) as f, shared_apis(), ThreadPoolExecutor(
+        args.workers
+    ) as executor:
+        pending: set[Future] = set()
+        # whether the next command must wait for those before it to finish
+        barrier = False
+
+        def finish_pending() -> None:
+            wait(pending)
+            pending.clear()
+
+        for line_num, command in _iter_commands(f):
+            if barrier or args.workers == 1:
+                # parsed against the config the commands before it left
+                finish_pending()
+
+            try:
+                cmd_args = _parse(get_parser(), command)
+            except ValueError as e:
+                report(
+                    line_num,
+                    command,
+                    {"status": "error", "error": str(e), "seconds": 0},
+                )
+            else:
+                barrier = cmd_args.cmd in CONFIG_CMDS
+
+                if barrier:
+                    finish_pending()
+
+                future = executor.submit(_run, cmd_args)
+                # results are reported as soon as each command completes
+                future.add_done_callback(partial(report_future, line_num, command))
+                pending.difference_update([p for p in pending if p.done()])
+                pending.add(future)
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,93 @@
+import argparse
+from pathlib import Path
+from typing import Optional
+
+from ambramelin.util import bundle
+from ambramelin.util.bundle import Entry
+from ambramelin.util.errors import InvalidArgumentsError
+
+
+def _load_index(path: str) -> bundle.Index:
+    if not Path(path).is_file():
+        raise InvalidArgumentsError(f"'{path}' does not exist.")
+
+    return bundle.load_index(Path(path))
+
+
+def _matches(
+    entry: Entry, series: Optional[list[str]], images: Optional[list[str]]
+) -> bool:
+    if entry.sop_instance_uid is None:
+        return False
+
+    if series and entry.series_uid not in series:
+        return False
+
+    return not images or entry.sop_instance_uid in images
+
+
+def _select(
+    entries: list[Entry], series: Optional[list[str]], images: Optional[list[str]]
+) -> list[Entry]:
+    return [entry for entry in entries if _matches(entry, series, images)]
+
+
+def cmd_extract(args: argparse.Namespace) -> dict:
+    path = Path(args.path)
+    entries = _select(_load_index(args.path).entries, args.series, args.images)
+
+    if not entries:
+        raise InvalidArgumentsError("No instances match 'series' and 'images'.")
+
+    dest = Path(args.dest).resolve()
+    extracted = 0
+
+    for entry, data in bundle.iter_entries(path, entries):
+        file = (dest / entry.name).resolve()
+
+        if not file.is_relative_to(dest):
+            raise InvalidArgumentsError(f"'{entry.name}' is outside of 'dest'.")
+
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(data)
+        extracted += len(data)
+
+    return {"instances": len(entries), "bytes": extracted}
+
+
+def cmd_inspect(args: argparse.Namespace) -> dict:
+    entries = _load_index(args.path).entries
+    series: dict[str, dict] = {}
+    other_files = 0
+
+    for entry in entries:
+        if entry.sop_instance_uid is None:
+            other_files += 1
+            continue
+
+        summary = series.setdefault(
+            entry.series_uid or "",
+            {
+                "modality": entry.modality,
+                "description": entry.series_description,
+                "instances": 0,
+                "bytes": 0,
+            },
+        )
+        summary["instances"] += 1
+        summary["bytes"] += entry.size
+
+    result: dict = {"series": series, "other_files": other_files}
+
+    if args.series:
+        result["instances"] = [
+            {
+                "name": entry.name,
+                "sop_instance_uid": entry.sop_instance_uid,
+                "instance_number": entry.instance_number,
+                "bytes": entry.size,
+            }
+            for entry in _select(entries, args.series, None)
+        ]
+
+    return result
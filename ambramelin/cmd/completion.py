@@ -0,0 +1,376 @@
+import argparse
+from collections.abc import Iterator, Sequence
+
+from ambramelin.parser import build_parser
+from ambramelin.util.config import get_completion_cache_path, load_config
+
+# Values offered for an argument are either static words (e.g. from `choices`) or come
+# from a "source": "@files", or a key of the completion cache (see
+# `ambramelin.util.completion`), where "@filters" is built from fields and conditions.
+# Environment and user choices are deliberately not baked into the generated script,
+# since they change.
+_SOURCES = {
+    "envs": "@envs",
+    "source": "@envs",
+    "target": "@envs",
+    "user": "@users",
+    "uuid": "@uuids",
+    "fields": "@fields",
+    "filters": "@filters",
+    "dest": "@files",
+    "file": "@files",
+    "path": "@files",
+    "manifest": "@files",
+    "deidentify": "@files",
+}
+
+_NAME_SOURCES = {"env": "@envs", "user": "@users"}
+
+# (option strings, nargs, source); nargs is "0" for flags, "1" or "+"
+_Option = tuple[Sequence[str], str, str]
+# command -> subcommand ("-" if the command has none) -> (options, positionals)
+_Spec = dict[str, dict[str, tuple[list[_Option], list[str]]]]
+
+
+def _get_source(cmd: str, subcmd: str, action: argparse.Action) -> str:
+    if action.dest == "name" and subcmd != "add":
+        return _NAME_SOURCES.get(cmd, "")
+
+    if action.dest in _SOURCES:
+        return _SOURCES[action.dest]
+
+    if action.choices is not None:
+        return " ".join(map(str, action.choices))
+
+    return ""
+
+
+def _get_nargs(action: argparse.Action) -> str:
+    if action.nargs == 0:
+        return "0"
+
+    if action.nargs in ("+", "*"):
+        return "+"
+
+    return "1"
+
+
+def _get_args(
+    cmd: str, subcmd: str, parser: argparse.ArgumentParser
+) -> tuple[list[_Option], list[str]]:
+    options = []
+    positionals = []
+
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            continue
+
+        source = _get_source(cmd, subcmd, action)
+
+        if action.option_strings:
+            options.append((action.option_strings, _get_nargs(action), source))
+        else:
+            positionals.append(source)
+
+    return options, positionals
+
+
+def _get_spec() -> tuple[list[_Option], _Spec]:
+    parser, cmd_parsers = build_parser(load_config())
+    spec: _Spec = {}
+
+    for cmd, cmd_parser in cmd_parsers.items():
+        subparsers = [
+            action
+            for action in cmd_parser._actions
+            if isinstance(action, argparse._SubParsersAction)
+        ]
+
+        if subparsers:
+            spec[cmd] = {
+                subcmd: _get_args(cmd, subcmd, subcmd_parser)
+                for subcmd, subcmd_parser in subparsers[0].choices.items()
+            }
+        else:
+            spec[cmd] = {"-": _get_args(cmd, "-", cmd_parser)}
+
+    global_options, _ = _get_args("", "", parser)
+    return global_options, spec
+
+
+def _bash_key(cmd: str, subcmd: str) -> str:
+    """Mirrors `"${cmd:- } ${subcmd:- }"` in the generated script."""
+    return f"{cmd or ' '} {subcmd or ' '}"
+
+
+def _bash_cases(
+    global_options: list[_Option], spec: _Spec
+) -> dict[str, list[tuple[str, str]]]:
+    """Returns the `case` patterns and values of each generated bash function."""
+    cases: dict[str, list[tuple[str, str]]] = {
+        "subcmds": [
+            ("", " ".join(spec)),
+            *((cmd, " ".join(subcmds)) for cmd, subcmds in spec.items()),
+        ],
+        "options": [
+            (
+                _bash_key("", ""),
+                " ".join(o for opts, _, _ in global_options for o in opts),
+            )
+        ],
+        "option_source": [],
+        "positional_source": [],
+    }
+
+    def add_options(key: str, options: list[_Option]) -> None:
+        for option_strings, nargs, source in options:
+            for option in option_strings:
+                if nargs != "0":
+                    cases["option_source"].append(
+                        (f"{key} {option}", f"{nargs} {source}")
+                    )
+
+    add_options(_bash_key("", ""), global_options)
+
+    for cmd, subcmds in spec.items():
+        for subcmd, (options, positionals) in subcmds.items():
+            key = _bash_key(cmd, subcmd)
+            cases["options"].append(
+                (key, " ".join(o for opts, _, _ in options for o in opts))
+            )
+            add_options(key, options)
+
+            for index, source in enumerate(positionals):
+                cases["positional_source"].append((f"{key} {index}", source))
+
+    return cases
+
+
+_BASH = r"""# Generated by `ambra completion bash` (regenerate on upgrade).
+# Values such as environment names are read from the completion cache, which
+# is kept up to date by ambra itself.
+
+_ambra_cache() {
+    local key rest
+    while read -r key rest; do
+        if [[ $key == "$1" ]]; then
+            echo "$rest"
+            return
+        fi
+    done < "${AMBRAMELIN_COMPLETION_CACHE:-%(cache)s}" 2>/dev/null
+}
+
+%(functions)s
+_ambra_reply() {
+    local source=$1 cur=$2 values
+    case $source in
+        @files)
+            COMPREPLY=($(compgen -f -- "$cur")) ;;
+        @filters)
+            if [[ $cur == *.*.* ]]; then
+                return
+            elif [[ $cur == *.* ]]; then
+                values=$(_ambra_cache conditions)
+                values=${values:+$(printf "${cur%%%%.*}.%%s. " $values)}
+            else
+                values=$(_ambra_cache fields)
+                values=${values:+$(printf "%%s. " $values)}
+            fi
+            COMPREPLY=($(compgen -W "$values" -- "$cur"))
+            compopt -o nospace 2>/dev/null ;;
+        @*)
+            COMPREPLY=($(compgen -W "$(_ambra_cache "${source#@}")" -- "$cur")) ;;
+        *)
+            COMPREPLY=($(compgen -W "$source" -- "$cur")) ;;
+    esac
+}
+
+# prints the nargs and source of an option of the command being completed
+_ambra_option() {
+    _ambra_option_source "${cmd:- }" "${subcmd:- }" "$1"
+}
+
+_ambra() {
+    local cur=${COMP_WORDS[COMP_CWORD]} cmd="" subcmd="" opt="" nargs source word
+    local i positional=0
+    COMPREPLY=()
+
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        word=${COMP_WORDS[i]}
+
+        if [[ $word == -* ]]; then
+            read -r nargs source <<< "$(_ambra_option "$word")"
+            opt=${nargs:+$word}
+        elif [[ -n $opt ]]; then
+            read -r nargs source <<< "$(_ambra_option "$opt")"
+            [[ $nargs == 1 ]] && opt=""
+        elif [[ -z $cmd ]]; then
+            cmd=$word
+            [[ $(_ambra_subcmds "$cmd") == "-" ]] && subcmd="-"
+        elif [[ -z $subcmd ]]; then
+            subcmd=$word
+        else
+            ((positional++))
+        fi
+    done
+
+    if [[ $cur == -* ]]; then
+        _ambra_reply "$(_ambra_options "${cmd:- }" "${subcmd:- }")" "$cur"
+    elif [[ -n $opt ]]; then
+        read -r nargs source <<< "$(_ambra_option "$opt")"
+        _ambra_reply "$source" "$cur"
+    elif [[ -z $cmd ]]; then
+        _ambra_reply "$(_ambra_subcmds)" "$cur"
+    elif [[ -z $subcmd ]]; then
+        _ambra_reply "$(_ambra_subcmds "$cmd")" "$cur"
+    else
+        source=$(_ambra_positional_source "$cmd" "$subcmd" "$positional")
+        _ambra_reply "$source" "$cur"
+    fi
+}
+
+complete -F _ambra ambra
+"""
+
+_FISH = r"""# Generated by `ambra completion fish` (regenerate on upgrade).
+# Values such as environment names are read from the completion cache, which
+# is kept up to date by ambra itself.
+
+function __ambra_cache
+    set -l file $AMBRAMELIN_COMPLETION_CACHE
+    test -n "$file"; or set file '%(cache)s'
+    test -r $file; or return
+    while read -l key rest
+        if test "$key" = $argv[1]
+            string split ' ' -- $rest
+            return
+        end
+    end < $file
+end
+
+function __ambra_filters
+    set -l parts (string split . -- (commandline -ct))
+    if test (count $parts) -ge 2
+        for condition in (__ambra_cache conditions)
+            echo $parts[1].$condition.
+        end
+    else
+        for field in (__ambra_cache fields)
+            echo $field.
+        end
+    end
+end
+
+function __ambra_using
+    set -l words
+    for token in (commandline -opc)[2..-1]
+        string match -q -- '-*' $token; or set -a words $token
+    end
+    test "$words[1]" = $argv[1]; or return 1
+    test (count $argv) -lt 2; or test "$words[2]" = $argv[2]
+end
+
+complete -c ambra -f
+%(completions)s
+"""
+
+
+def _shell_quote(value: str) -> str:
+    return "'" + value.replace("'", "'\"'\"'") + "'"
+
+
+def _fish_args(source: str) -> str:
+    if source == "@files":
+        return "-F"
+
+    if source == "@filters":
+        return "-x -a '(__ambra_filters)'"
+
+    if source.startswith("@"):
+        return f"-x -a '(__ambra_cache {source[1:]})'"
+
+    if source:
+        return f"-x -a {_shell_quote(source)}"
+
+    return "-x"
+
+
+def _fish_complete(condition: str, args: str) -> str:
+    return f"complete -c ambra -n {_shell_quote(condition)} {args}"
+
+
+def _fish_option(
+    condition: str, option_strings: Sequence[str], nargs: str, source: str
+) -> str:
+    flags = " ".join(
+        f"-l {o[2:]}" if o.startswith("--") else f"-s {o[1:]}" for o in option_strings
+    )
+    args = "" if nargs == "0" else f" {_fish_args(source)}"
+    return _fish_complete(condition, f"{flags}{args}")
+
+
+def _iter_fish_completions(global_options: list[_Option], spec: _Spec) -> Iterator[str]:
+    yield _fish_complete("__fish_use_subcommand", f"-a {_shell_quote(' '.join(spec))}")
+
+    for option_strings, nargs, source in global_options:
+        yield _fish_option("__fish_use_subcommand", option_strings, nargs, source)
+
+    for cmd, subcmds in spec.items():
+        if "-" not in subcmds:
+            subcmd_words = " ".join(subcmds)
+            yield _fish_complete(
+                f"__ambra_using {cmd}; "
+                f"and not __fish_seen_subcommand_from {subcmd_words}",
+                f"-a {_shell_quote(subcmd_words)}",
+            )
+
+        for subcmd, (options, positionals) in subcmds.items():
+            condition = f"__ambra_using {cmd}" + ("" if subcmd == "-" else f" {subcmd}")
+
+            for option_strings, nargs, source in options:
+                yield _fish_option(condition, option_strings, nargs, source)
+
+            for source in dict.fromkeys(positionals):
+                if source:
+                    yield _fish_complete(condition, _fish_args(source))
+
+
+def _bash_script() -> str:
+    cases = _bash_cases(*_get_spec())
+    functions = []
+
+    for name, arguments in (
+        ("subcmds", '"${1:-}"'),
+        ("options", '"$1 $2"'),
+        ("option_source", '"$1 $2 $3"'),
+        ("positional_source", '"$1 $2 $3"'),
+    ):
+        lines = [f"_ambra_{name}() {{", f"    case {arguments} in"]
+
+        for pattern, value in cases[name]:
+            lines.append(
+                f"        {_shell_quote(pattern)}) echo {_shell_quote(value)} ;;"
+            )
+
+        lines += ["    esac", "}", ""]
+        functions.append("\n".join(lines))
+
+    return _BASH % {
+        "cache": get_completion_cache_path().resolve(),
+        "functions": "\n".join(functions),
+    }
+
+
+def cmd_bash(_: argparse.Namespace) -> str:
+    return _bash_script()
+
+
+def cmd_fish(_: argparse.Namespace) -> str:
+    return _FISH % {
+        "cache": get_completion_cache_path().resolve(),
+        "completions": "\n".join(_iter_fish_completions(*_get_spec())),
+    }
+
+
+def cmd_zsh(_: argparse.Namespace) -> str:
+    return "autoload -U +X bashcompinit && bashcompinit\n\n" + _bash_script()
@@ -44,7 +44,9 @@ def cmd_add(args: argparse.Namespace) -> dict:
             if not user_exists(config, args.user):
                 raise UserNotFoundError(args.user, config)
 
-        config.envs[args.name] = Environment(args.url, args.user)
+        config.envs[args.name] = Environment(
+            args.url, args.user, args.limit_rate or None
+        )
 
     return {args.name: cattr.unstructure(config.envs[args.name])}
 
@@ -85,6 +87,19 @@ def cmd_list(_: argparse.Namespace) -> str:
         return MSG_NO_ENVS_ADDED
 
 
+def cmd_preset(args: argparse.Namespace) -> dict:
+    with update_config() as config:
+
+        _check_envs_added_and_env_exists(config, args.name)
+
+        if args.fields:
+            config.envs[args.name].presets[args.preset] = args.fields
+        else:
+            config.envs[args.name].presets.pop(args.preset, None)
+
+    return {args.name: cattr.unstructure(config.envs[args.name])}
+
+
 def cmd_set(args: argparse.Namespace) -> dict:
     with update_config() as config:
 
@@ -102,6 +117,14 @@ def cmd_set(args: argparse.Namespace) -> dict:
 
             config.envs[args.name].user = args.user
 
+        if args.limit_rate is not None:
+            # 0 removes the limit
+            config.envs[args.name].limit_rate = args.limit_rate or None
+
+        if args.dicomweb_url is not None:
+            # "" removes the path
+            config.envs[args.name].dicomweb_url = args.dicomweb_url or None
+
     return {args.name: cattr.unstructure(config.envs[args.name])}
 
 
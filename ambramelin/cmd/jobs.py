@@ -0,0 +1,131 @@
+import argparse
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TextIO
+
+import requests
+from ambra_sdk.exceptions.base import AmbraException
+
+from ambramelin.cmd.study import cmd_download, parse_download_args
+from ambramelin.util.config import get_jobs_path
+from ambramelin.util.errors import AmbramelinError, InvalidArgumentsError
+from ambramelin.util.jobs import LEASE, JobQueue, Task
+from ambramelin.util.sdk import get_env_name, shared_apis, using_env
+
+
+def _get_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _run_task(queue: JobQueue, task: Task, max_attempts: int) -> None:
+    dest = task.dest.format(uuid=task.uuid)
+    args = parse_download_args(
+        task.uuid,
+        f"--dest={dest}",
+        f"--bundle={task.bundle}",
+        "--workers=1",
+        "--hash=sha256",
+        # a download that completed before its task could be marked as done (e.g.
+        # because of a crash) is recognised by its manifest rather than downloaded
+        # again
+        "--skip-existing",
+    )
+
+    try:
+        with using_env(task.env):
+            cmd_download(args)
+    except (AmbramelinError, AmbraException, requests.RequestException, OSError) as e:
+        print(f"Failed to download {task.uuid}: {e}", file=sys.stderr)
+        queue.fail(task, _get_size(Path(dest)), str(e), max_attempts)
+    else:
+        queue.complete(task, _get_size(Path(dest)))
+
+
+def _run(queue: JobQueue, args: argparse.Namespace) -> dict:
+    recovered = queue.recover()
+
+    if recovered:
+        print(f"Recovered {recovered} interrupted task(s)", file=sys.stderr)
+
+    stop = threading.Event()
+    done = threading.Event()
+
+    def renew() -> None:
+        # well within the lease, so that a slow renewal does not let it expire
+        while not done.wait(LEASE / 4):
+            queue.renew()
+
+    def work() -> None:
+        while not stop.is_set():
+            task = queue.claim()
+
+            if task is None:
+                return
+
+            _run_task(queue, task, args.max_attempts)
+
+    renewer = threading.Thread(target=renew, daemon=True)
+    renewer.start()
+
+    try:
+        with shared_apis(), ThreadPoolExecutor(args.workers) as executor:
+            futures = [executor.submit(work) for _ in range(args.workers)]
+
+            try:
+                for future in futures:
+                    future.result()
+            except KeyboardInterrupt:
+                stop.set()
+                print(
+                    "Finishing the downloads in progress; interrupt again to abandon "
+                    "them, and 'ambra jobs resume' to continue",
+                    file=sys.stderr,
+                )
+    finally:
+        done.set()
+        renewer.join()
+
+    return queue.get_status()
+
+
+def _read_uuids(f: TextIO) -> list[str]:
+    return [line.strip() for line in f if line.strip()]
+
+
+def cmd_add(args: argparse.Namespace) -> dict:
+    uuids = list(args.uuid)
+
+    if args.file == "-":
+        uuids += _read_uuids(sys.stdin)
+    elif args.file is not None:
+        with open(args.file, "r") as f:
+            uuids += _read_uuids(f)
+
+    if not uuids:
+        raise InvalidArgumentsError("No studies given.")
+
+    added = JobQueue(get_jobs_path()).add(get_env_name(), uuids, args.dest, args.bundle)
+    return {"added": added, "skipped": len(uuids) - added}
+
+
+def cmd_resume(args: argparse.Namespace) -> dict:
+    queue = JobQueue(get_jobs_path())
+    retried = queue.retry_failed()
+
+    if retried:
+        print(f"Retrying {retried} failed task(s)", file=sys.stderr)
+
+    return _run(queue, args)
+
+
+def cmd_run(args: argparse.Namespace) -> dict:
+    return _run(JobQueue(get_jobs_path()), args)
+
+
+def cmd_status(_: argparse.Namespace) -> dict:
+    return JobQueue(get_jobs_path()).get_status()
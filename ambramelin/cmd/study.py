@@ -1,25 +1,112 @@
 import argparse
+import base64
+import contextlib
+import contextvars
+import functools
+import hashlib
+import itertools
 import json
 import sys
+import threading
+import time
+import zipfile
+from collections.abc import Callable, Generator, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
+from typing import Any, BinaryIO, Optional, cast
 
+import requests
 from ambra_sdk.api import Api
+from ambra_sdk.exceptions.base import AmbraException, AmbraResponseException
 from ambra_sdk.service.filtering import Filter, FilterCondition
 from ambra_sdk.service.query import QueryOF
+from ambra_sdk.service.sorting import Sorter, SortingOrder
+from ambra_sdk.storage.request import PreparedRequest, StorageMethod
 
-from ambramelin.util.errors import InvalidArgumentsError, InvalidFilterConditionError
+from ambramelin.parser import build_parser
+from ambramelin.util import cache, deidentify, integrity, metrics, multipart, stats
+from ambramelin.util.config import load_config
+from ambramelin.util.dicom import iter_files, read_sop_instance_uid
+from ambramelin.util.errors import (
+    AmbramelinError,
+    InvalidArgumentsError,
+    InvalidFilterConditionError,
+)
 from ambramelin.util.input import bool_prompt
-from ambramelin.util.sdk import get_api
+from ambramelin.util.ratelimit import RateLimiter, get_limiter
+from ambramelin.util.sdk import (
+    get_api,
+    get_env_name,
+    set_storage_pool_size,
+    using_env,
+)
 
+# 'in' and 'in_or_null' filters with more values than this are split into several
+# queries, as the server rejects (or is very slow to process) long value lists
+IN_FILTER_CHUNK_SIZE = 200
+# number of split queries run concurrently
+IN_FILTER_WORKERS = 8
+# rows requested per page of a keyset scan
+KEYSET_PAGE_SIZE = 1000
+# named field projections, which environments can add to or override (see `ambra env
+# preset`); "default" is used unless fields are specified
+FIELD_PRESETS = {
+    "default": ["uuid", "study_uid", "study_date", "modality", "created"],
+    "storage": ["engine_fqdn", "storage_namespace", "study_uid"],
+}
+DICOMWEB_ACCEPT = 'multipart/related; type="application/dicom"; transfer-syntax=*'
 
-def _get_storage_args(api: Api, uuid: str) -> tuple[str, str, str]:
+
+def _get_study(
+    api: Api,
+    uuid: str,
+    fields: Optional[list[str]],
+    max_age: Optional[float] = None,
+    refresh: bool = False,
+) -> dict:
+    def fetch(_: Optional[cache.Entry]) -> cache.Entry:
+        # revalidation is not possible, as study/get responses carry no validators
+        return cache.Entry(
+            api.Study.get(uuid=uuid, fields=fields and json.dumps(fields)).get()
+        )
+
+    return cache.read_through(
+        "study/get", {"uuid": uuid, "fields": fields}, fetch, max_age, refresh
+    )
+
+
+def _get_storage_args(
+    api: Api, uuid: str, max_age: Optional[float] = None, refresh: bool = False
+) -> tuple[str, str, str]:
     """Returns arguments necessary for performing Storage API requests."""
-    study = api.Study.get(
-        uuid=uuid, fields=json.dumps(["engine_fqdn", "storage_namespace", "study_uid"])
-    ).get()
+    study = _get_study(api, uuid, FIELD_PRESETS["storage"], max_age, refresh)
     return study["engine_fqdn"], study["storage_namespace"], study["study_uid"]
 
 
+def _iter_schema_images(
+    schema: dict, series_uids: Optional[list[str]], image_uids: Optional[list[str]]
+) -> Iterator[tuple[str, str, str]]:
+    """
+    Yields the (archive path, image uid, image version) of every image in a study's
+    schema that matches the given series/image selectors.
+
+    Archive paths mirror the SERxxxx/IMGxxxx layout of a "dicom" bundle.
+    """
+    for series_num, series in enumerate(schema["series"], start=1):
+        if series_uids and series["series_uid"] not in series_uids:
+            continue
+
+        for image_num, image in enumerate(series["images"], start=1):
+            if image_uids and image["id"] not in image_uids:
+                continue
+
+            yield (
+                f"SER{series_num:04d}/IMG{image_num:04d}.dcm",
+                image["id"],
+                image["version"],
+            )
+
+
 def _augment_query_with_filters(query: QueryOF, query_filters: list[str]) -> QueryOF:
     for query_filter in query_filters:
         field, cond, val = query_filter.split(".", 2)
@@ -37,47 +124,513 @@ def _augment_query_with_filters(query: QueryOF, query_filters: list[str]) -> Que
     return query
 
 
+def _split_filters(query_filters: list[str]) -> list[list[str]]:
+    """
+    Splits filters into several lists of filters, none of which has an 'in' or
+    'in_or_null' filter with more than `IN_FILTER_CHUNK_SIZE` values.
+
+    The lists match disjoint sets of studies, which together are the studies matched
+    by the original filters: values are de-duplicated, and 'in_or_null' only matches
+    null in the first chunk of its values, the other chunks being turned into 'in'
+    filters.
+    """
+    in_conditions = {
+        FilterCondition.in_condition.value,
+        FilterCondition.in_or_null.value,
+    }
+    splits = []
+
+    for query_filter in query_filters:
+        field, cond, val = query_filter.split(".", 2)
+        # a value repeated in two chunks would match its studies in both, which
+        # counting them would count twice
+        values = list(dict.fromkeys(val.split(",")))
+
+        if cond not in in_conditions or len(values) <= IN_FILTER_CHUNK_SIZE:
+            splits.append([query_filter])
+            continue
+
+        chunks = [
+            ",".join(values[start : start + IN_FILTER_CHUNK_SIZE])
+            for start in range(0, len(values), IN_FILTER_CHUNK_SIZE)
+        ]
+        splits.append(
+            [
+                f"{field}.{cond if num == 0 else 'in'}.{chunk}"
+                for num, chunk in enumerate(chunks)
+            ]
+        )
+
+    return [list(filters) for filters in itertools.product(*splits)]
+
+
+def _map_split_filters(
+    fn: Callable[[list[str]], Any], split_filters: list[list[str]]
+) -> Iterator[Any]:
+    """
+    Yields the result of `fn` for each list of split filters, in order, running up to
+    `IN_FILTER_WORKERS` of them concurrently; results that are not consumed are
+    cancelled.
+    """
+    # in the caller's environment (e.g. one of '--envs'), each call in a copy of the
+    # context, as one cannot be entered by several threads at once
+    context = contextvars.copy_context()
+
+    with ThreadPoolExecutor(IN_FILTER_WORKERS) as executor:
+        # a generator, which cancels its pending calls when closed
+        results = cast(
+            Generator[Any, None, None],
+            executor.map(
+                lambda filters: context.copy().run(fn, filters), split_filters
+            ),
+        )
+
+        try:
+            yield from results
+        finally:
+            results.close()
+
+
+def _unique_rows(rows: Iterable[dict]) -> Iterator[dict]:
+    seen = set()
+
+    for row in rows:
+        key = row.get("uuid") or json.dumps(row, sort_keys=True)
+
+        if key not in seen:
+            seen.add(key)
+            yield row
+
+
 def cmd_count(args: argparse.Namespace) -> str:
     api = get_api()
 
-    query = api.Study.count()
-
     if args.filters is None:
         if not bool_prompt("Count *all* studies?"):
             sys.exit(0)
 
+        return str(api.Study.count().get()["count"])
+
+    def count(filters: list[str]) -> int:
+        return _augment_query_with_filters(api.Study.count(), filters).get()["count"]
+
+    split_filters = _split_filters(args.filters)
+
+    if len(split_filters) == 1:
+        return str(count(args.filters))
+
+    # split filters match disjoint sets of studies
+    return str(sum(_map_split_filters(count, split_filters)))
+
+
+@contextlib.contextmanager
+def _open_dest(dest: str) -> Iterator[BinaryIO]:
+    """Opens a download destination, where '-' refers to stdout."""
+    if dest == "-":
+        print("Downloading study to stdout", file=sys.stderr)
+        # chunks larger than the buffer are written straight through to the file
+        # descriptor, without an intermediate copy
+        yield sys.stdout.buffer
+        sys.stdout.buffer.flush()
     else:
-        query = _augment_query_with_filters(query, args.filters)
+        path = Path(dest)
+        print(f"Downloading study to {path.resolve()}", file=sys.stderr)
+
+        with open(path, mode="wb") as f:
+            yield f
+
+
+def _get_rate_limiter(args: argparse.Namespace) -> Optional[RateLimiter]:
+    env_name = get_env_name()
+    rate = args.limit_rate
+
+    if rate is None:
+        rate = load_config().envs[env_name].limit_rate
+
+    return get_limiter(env_name, rate) if rate else None
+
+
+def _download_bundle(
+    api: Api, args: argparse.Namespace, f: BinaryIO, limiter: Optional[RateLimiter]
+) -> None:
+    bytes_downloaded = 0
+    for chunk in api.Storage.Study.download(
+        *_get_storage_args(api, args.uuid), bundle=args.bundle
+    ).iter_content(args.chunk_size):
+        if limiter is not None:
+            # not reading from the connection in the meantime slows the sender down
+            limiter.consume(len(chunk))
+
+        f.write(chunk)
+        # a progress bar would be nice, but (1) the response does not contain the
+        # size of the bundle (no Content-Length header or similar) and (2) a study's
+        # 'size', as it exists in a /study/get response, refers to the uncompressed
+        # size :(
+        bytes_downloaded += len(chunk)
+        metrics.inc("ambra_downloaded_bytes", len(chunk))
+        print(f"{bytes_downloaded:,} bytes downloaded", end="\r", file=sys.stderr)
+
+
+def _download_images(
+    api: Api,
+    args: argparse.Namespace,
+    f: BinaryIO,
+    limiter: Optional[RateLimiter],
+    profile: Optional[deidentify.Profile] = None,
+) -> None:
+    engine_fqdn, namespace, study_uid = _get_storage_args(api, args.uuid)
+    images = list(
+        _iter_schema_images(
+            api.Storage.Study.schema(engine_fqdn, namespace, study_uid),
+            args.series,
+            args.images,
+        )
+    )
+
+    if not images:
+        raise InvalidArgumentsError("No images match 'series' and 'images'.")
+
+    set_storage_pool_size(api, args.workers)
+
+    def fetch(image: tuple[str, str, str]) -> tuple[str, bytes]:
+        arcname, image_uid, image_version = image
+        payload = api.Storage.Image.dicom_payload(
+            engine_fqdn, namespace, study_uid, image_uid, image_version
+        ).content
+
+        if limiter is not None:
+            limiter.consume(len(payload))
+
+        metrics.inc("ambra_downloaded_bytes", len(payload))
+        if profile is not None:
+            # in the workers, so that instances are de-identified in parallel
+            payload = deidentify.deidentify(payload, profile)
+
+        return arcname, payload
+
+    # DICOM payloads are already compressed (or not worth compressing), so entries
+    # are stored as-is, like they are in a bundle
+    with zipfile.ZipFile(f, mode="w") as zf, ThreadPoolExecutor(
+        args.workers
+    ) as executor:
+        num = 0
+
+        def write(futures: set[Future]) -> None:
+            nonlocal num
+
+            for future in futures:
+                arcname, payload = future.result()
+                zf.writestr(arcname, payload)
+                num += 1
+                print(
+                    f"{num}/{len(images)} images downloaded", end="\r", file=sys.stderr
+                )
+
+        pending: set[Future] = set()
+
+        # payloads are written as they arrive (so in no particular order), with at
+        # most one extra download per worker held in memory, like uploads
+        for image in images:
+            if len(pending) >= args.workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write(done)
+
+            pending.add(executor.submit(fetch, image))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            write(done)
+
+
+def _retrieve_series(
+    api: Api,
+    series_url: str,
+    engine_fqdn: str,
+    namespace: str,
+    study_uid: str,
+    series_uid: str,
+) -> requests.Response:
+    url = api.Storage.format_url(
+        series_url,
+        engine_fqdn=engine_fqdn,
+        namespace=namespace,
+        study_uid=study_uid,
+        series_uid=series_uid,
+    )
+    return PreparedRequest(
+        storage=api.Storage,
+        url=url,
+        method=StorageMethod.get,
+        headers={"Accept": DICOMWEB_ACCEPT},
+        stream=True,
+    ).execute()
+
+
+def _download_dicomweb(
+    api: Api,
+    args: argparse.Namespace,
+    f: BinaryIO,
+    limiter: Optional[RateLimiter],
+    series_url: str,
+    profile: Optional[deidentify.Profile] = None,
+) -> None:
+    """
+    Retrieves instances with DICOMweb, a series per worker, writing each as soon as it
+    is read. Experimental: `series_url` is configured per environment, as ambra_sdk
+    does not expose DICOMweb.
+    """
+    engine_fqdn, namespace, study_uid = _get_storage_args(api, args.uuid)
+    schema = api.Storage.Study.schema(engine_fqdn, namespace, study_uid)
+    # numbered like a bundle's SERxxxx directories, whether selected or not
+    series = [
+        (series_num, s["series_uid"], len(s["images"]))
+        for series_num, s in enumerate(schema["series"], start=1)
+        if not args.series or s["series_uid"] in args.series
+    ]
+
+    if not series:
+        raise InvalidArgumentsError("No series match 'series'.")
+
+    set_storage_pool_size(api, args.workers)
+
+    total = sum(images for _, _, images in series)
+    downloaded = 0
+    lock = threading.Lock()
+
+    def iter_chunks(response: requests.Response) -> Iterator[bytes]:
+        for chunk in response.iter_content(args.chunk_size):
+            if limiter is not None:
+                limiter.consume(len(chunk))
+
+            yield chunk
+
+    def fetch(series: tuple[int, str, int]) -> None:
+        nonlocal downloaded
+        series_num, series_uid, _ = series
+        response = _retrieve_series(
+            api, series_url, engine_fqdn, namespace, study_uid, series_uid
+        )
+        boundary = multipart.get_boundary(response.headers.get("Content-Type", ""))
+        parts = multipart.iter_parts(iter_chunks(response), boundary)
+
+        for image_num, (_, payload) in enumerate(parts, start=1):
+            metrics.inc("ambra_downloaded_bytes", len(payload))
+
+            if profile is not None:
+                payload = deidentify.deidentify(payload, profile)
+
+            # entries of different series are interleaved, in order of arrival
+            with lock:
+                zf.writestr(f"SER{series_num:04d}/IMG{image_num:04d}.dcm", payload)
+                downloaded += 1
+                print(
+                    f"{downloaded}/{total} images downloaded", end="\r", file=sys.stderr
+                )
+
+    with zipfile.ZipFile(f, mode="w") as zf, ThreadPoolExecutor(
+        args.workers
+    ) as executor:
+        list(executor.map(fetch, series))
+
+
+def cmd_download(args: argparse.Namespace, api: Optional[Api] = None) -> None:
+    profile = None
+    download: Callable[
+        [Api, argparse.Namespace, BinaryIO, Optional[RateLimiter]], None
+    ] = _download_bundle
+
+    if args.deidentify is not None:
+        profile = deidentify.load_profile(Path(args.deidentify))
+
+    selective = args.series or args.images or profile is not None
+    method = args.method or ("images" if selective else "bundle")
+
+    if method == "dicomweb":
+        if args.bundle != "dicom" or args.images:
+            raise InvalidArgumentsError(
+                "'dicomweb' may only be used with the 'dicom' bundle and 'series'."
+            )
+
+        series_url = load_config().envs[get_env_name()].dicomweb_url
+
+        if series_url is None:
+            raise InvalidArgumentsError(
+                "'dicomweb' needs the environment's DICOMweb path (see 'ambra env set "
+                "--dicomweb-url')."
+            )
+
+        download = functools.partial(
+            _download_dicomweb, series_url=series_url, profile=profile
+        )
+    elif method == "images":
+        if args.bundle != "dicom":
+            raise InvalidArgumentsError(
+                "'images' may only be used with the 'dicom' bundle."
+            )
+
+        download = functools.partial(_download_images, profile=profile)
+    elif selective:
+        # rather than switching methods behind the user's back
+        raise InvalidArgumentsError(
+            "'series', 'images' and 'deidentify' cannot be used with the 'bundle' "
+            "method, which downloads the whole study as the server archived it; use "
+            "'images' or 'dicomweb'."
+        )
+
+    dest = args.dest.format(uuid=args.uuid)
+    # a destination can only be skipped if it has a manifest to be verified against
+    algorithm = args.hash or ("sha256" if args.skip_existing else None)
+
+    if args.skip_existing:
+        if dest == "-":
+            raise InvalidArgumentsError("'skip-existing' cannot be used with stdout.")
+
+        # by default, an unchanged size and modification time are trusted to mean
+        # unchanged contents; rehashing takes a separate pass over the destination
+        if args.rehash_existing:
+            matches = integrity.verify(Path(dest))
+        else:
+            matches = integrity.is_unchanged(Path(dest))
 
-    return str(query.get()["count"])
+        if matches:
+            print(f"{Path(dest).resolve()} matches its manifest", file=sys.stderr)
+            return
 
+    if api is None:
+        api = get_api()
 
-def cmd_download(args: argparse.Namespace) -> None:
+    limiter = _get_rate_limiter(args)
+
+    with _open_dest(dest) as f:
+        writer = None
+
+        if algorithm is not None:
+            # hashed as it is written, rather than by reading it back afterwards
+            writer = integrity.HashingWriter(f, algorithm)
+            f = cast(BinaryIO, writer)
+
+        download(api, args, f, limiter)
+
+    # ensure download progress shown after loop completion
+    print(file=sys.stderr)
+
+    if writer is not None:
+        manifest = writer.get_manifest(dest)
+
+        if dest == "-":
+            print(json.dumps(manifest), file=sys.stderr)
+        else:
+            integrity.write_manifest(Path(dest), manifest)
+
+
+def _fetch_rendering(
+    api: Api,
+    args: argparse.Namespace,
+    storage_args: tuple[str, str, str],
+    image_uid: str,
+    image_version: str,
+) -> bytes:
+    if args.kind == "thumbnail":
+        response = api.Storage.Study.thumbnail(
+            *storage_args, image_uid, image_version, args.frame
+        )
+    else:
+        response = api.Storage.Study.frame(
+            *storage_args, image_uid, image_version, str(args.frame), size=args.size
+        )
+
+    metrics.inc("ambra_downloaded_bytes", len(response.content))
+    return response.content
+
+
+def cmd_frames(args: argparse.Namespace) -> dict:
     api = get_api()
-    path = Path(args.dest.format(uuid=args.uuid))
-    print(f"Downloading study to {path.resolve()}")
+    storage_args = _get_storage_args(api, args.uuid, args.max_age, args.no_cache)
+    schema = _get_schema(
+        api,
+        storage_args,
+        {"extended": 0, "attachments_only": 0},
+        args.max_age,
+        args.no_cache,
+    )
+    images = list(_iter_schema_images(schema, args.series, args.images))
 
-    with open(path, mode="wb") as f:
-        bytes_downloaded = 0
-        for chunk in api.Storage.Study.download(
-            *_get_storage_args(api, args.uuid), bundle=args.bundle
-        ).iter_content(args.chunk_size):
-            f.write(chunk)
-            # a progress bar would be nice, but (1) the response does not contain the
-            # size of the bundle (no Content-Length header or similar) and (2) a study's
-            # 'size', as it exists in a /study/get response, refers to the uncompressed
-            # size :(
-            bytes_downloaded += len(chunk)
-            print(f"{bytes_downloaded:,} bytes downloaded", end="\r")
+    if not images:
+        raise InvalidArgumentsError("No images match 'series' and 'images'.")
 
-    print()  # ensure 'bytes downloaded' shown after loop completion
+    dest = Path(args.dest.format(uuid=args.uuid))
+    # renderings come from a single storage engine, so keep-alive connections to it
+    # are reused by the workers rather than opened for each image
+    set_storage_pool_size(api, args.workers)
+    lock = threading.Lock()
+    stats = {"images": 0, "fetched": 0, "bytes": 0}
+
+    def fetch(image: tuple[str, str, str]) -> None:
+        arcname, image_uid, image_version = image
+        fetched = False
+
+        def fetch_rendering() -> bytes:
+            nonlocal fetched
+            fetched = True
+            return _fetch_rendering(api, args, storage_args, image_uid, image_version)
+
+        # an image version's renderings never change, so they are cached by its UID
+        # rather than by study
+        content = cache.read_through_image(
+            f"storage/study/{args.kind}",
+            {
+                "image_uid": image_uid,
+                "image_version": image_version,
+                "frame": args.frame,
+                "size": args.size if args.kind == "frame" else None,
+            },
+            fetch_rendering,
+            args.no_cache,
+        )
+        path = dest / Path(arcname).with_suffix(".jpg")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+        with lock:
+            stats["images"] += 1
+            stats["fetched"] += fetched
+            stats["bytes"] += len(content)
+            print(f"{stats['images']}/{len(images)} images", end="\r", file=sys.stderr)
+
+    try:
+        with ThreadPoolExecutor(args.workers) as executor:
+            # results are only collected to re-raise errors
+            list(executor.map(fetch, images))
+    finally:
+        print(file=sys.stderr)
+        cache.evict_images()
+
+    return {"dest": str(dest), **stats}
+
+
+def _get_fields(args: argparse.Namespace) -> Optional[list[str]]:
+    """Returns the fields to request (None for all of them)."""
+    if args.all_fields:
+        return None
+
+    if args.fields is not None:
+        return args.fields
+
+    presets = {**FIELD_PRESETS, **load_config().envs[get_env_name()].presets}
+    name = args.preset or "default"
+
+    if name not in presets:
+        raise InvalidArgumentsError(
+            f"'{name}' is not a preset. Must be one of {sorted(presets)}."
+        )
+
+    return presets[name]
 
 
 def cmd_get(args: argparse.Namespace) -> dict:
     api = get_api()
-    return api.Study.get(
-        uuid=args.uuid, fields=args.fields and json.dumps(args.fields)
-    ).get()
+    fields = _get_fields(args)
+    return _get_study(api, args.uuid, fields, args.max_age, args.no_cache)
 
 
 def cmd_list(args: argparse.Namespace) -> list:
@@ -90,30 +643,744 @@ def cmd_list(args: argparse.Namespace) -> list:
     if (args.filters or args.max_row) is None:
         print(
             "Not specifying 'filters' or 'max-row' will result in the fetching of "
-            "*all* studies."
+            "*all* studies.",
+            file=sys.stderr,
         )
 
         if not bool_prompt("Do you wish to proceed?"):
             sys.exit(0)
 
-    if args.fields is None:
-        print("Not specifying 'fields' may produce a lot of output.")
+    fields = _get_fields(args)
+
+    if fields is None:
+        print("Requesting all fields may produce a lot of output.", file=sys.stderr)
 
         if not bool_prompt("Do you wish to proceed?"):
             sys.exit(0)
 
-    query = api.Study.list(fields=args.fields and json.dumps(args.fields))
+    split_filters = _split_filters(args.filters or [])
 
-    if args.filters is not None:
-        query = _augment_query_with_filters(query, args.filters)
+    if args.keyset or args.cursor is not None:
+        if len(split_filters) > 1:
+            raise InvalidArgumentsError(
+                "'keyset' cannot be used with 'in' filters of more than "
+                f"{IN_FILTER_CHUNK_SIZE} values."
+            )
+
+        return _list_keyset(api, args, fields)
+
+    if len(split_filters) == 1:
+        query = api.Study.list(fields=fields and json.dumps(fields))
+
+        if args.filters is not None:
+            query = _augment_query_with_filters(query, args.filters)
+
+        return list(query.all()[args.min_row : args.max_row])
+
+    def list_(filters: list[str]) -> list:
+        query = _augment_query_with_filters(
+            api.Study.list(fields=fields and json.dumps(fields)), filters
+        )
+        # no single query contributes more than `max_row` rows to the merged rows
+        return list(itertools.islice(query.all(), args.max_row))
+
+    rows = itertools.chain.from_iterable(_map_split_filters(list_, split_filters))
+    return list(itertools.islice(_unique_rows(rows), args.min_row, args.max_row))
+
+
+def _encode_cursor(key: tuple[str, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        key = None
+
+    # rather than unpacking anything of two values, e.g. a string of two characters
+    if not (
+        isinstance(key, list) and len(key) == 2 and all(isinstance(k, str) for k in key)
+    ):
+        raise InvalidArgumentsError(f"'{cursor}' is not a valid cursor.")
+
+    return key[0], key[1]
+
+
+def _iter_keyset(
+    api: Api,
+    fields: Optional[list[str]],
+    filters: Optional[list[str]],
+    key: Optional[tuple[str, str]],
+    order: str = "created",
+) -> Iterator[dict]:
+    """
+    Yields the studies after `key` (if given) in (`order`, uuid) order.
+
+    Rather than paging with an offset, each page is the first page of a query for the
+    studies after the last one seen, so that pages cost the same however deep into a
+    scan they are, and studies created during a scan do not shift rows between pages.
+    As the API cannot express "(created, uuid) > key", pages are queried with
+    "created >= key's", skipping the (few) studies created at the same time as the
+    key that were already seen, or, when a whole page of them was, with "created =
+    key's and uuid > key's" until there are no more (likewise for another `order`).
+    """
+    # None, "ge", "gt" or "same-created"
+    mode = None if key is None else "ge"
+
+    while True:
+        query = api.Study.list(fields=fields and json.dumps(fields))
+
+        if filters is not None:
+            query = _augment_query_with_filters(query, filters)
+
+        if key is None:
+            pass
+        elif mode == "same-created":
+            query = query.filter_by(Filter(order, FilterCondition.equals, key[0]))
+            query = query.filter_by(Filter("uuid", FilterCondition.gt, key[1]))
+        else:
+            cond = FilterCondition.gt if mode == "gt" else FilterCondition.ge
+            query = query.filter_by(Filter(order, cond, key[0]))
+
+        if mode != "same-created":
+            query = query.sort_by(Sorter(order, SortingOrder.ascending))
+
+        query = query.sort_by(Sorter("uuid", SortingOrder.ascending))
+        rows = list(
+            itertools.islice(
+                query.set_rows_in_page(KEYSET_PAGE_SIZE).all(), KEYSET_PAGE_SIZE
+            )
+        )
+        new_rows = 0
+
+        for row in rows:
+            if key is None or (row[order], row["uuid"]) > key:
+                key = row[order], row["uuid"]
+                new_rows += 1
+                yield row
+
+        if len(rows) < KEYSET_PAGE_SIZE:
+            if mode != "same-created":
+                return
 
-    return list(query.all()[args.min_row : args.max_row])
+            # all studies created at the same time as the key have been seen
+            mode = "gt"
+        elif mode != "same-created":
+            mode = "ge" if new_rows else "same-created"
+
+
+def _list_keyset(
+    api: Api, args: argparse.Namespace, fields: Optional[list[str]]
+) -> list:
+    key = args.cursor and _decode_cursor(args.cursor)
+    # the cursor's fields are always fetched, but only listed if asked for
+    scan_fields = fields and list(dict.fromkeys([*fields, "created", "uuid"]))
+    extra_fields = set(scan_fields or []) - set(fields or [])
+    rows = []
+    # whether the scan stopped before reaching the last study
+    stopped = False
+
+    try:
+        for row in itertools.islice(
+            _iter_keyset(api, scan_fields, args.filters, key),
+            args.min_row,
+            args.max_row,
+        ):
+            key = row["created"], row["uuid"]
+            rows.append({k: v for k, v in row.items() if k not in extra_fields})
+    except KeyboardInterrupt:
+        stopped = True
+    else:
+        stopped = args.max_row is not None and len(rows) == args.max_row - (
+            args.min_row or 0
+        )
+
+    if stopped and key is not None:
+        # listed on stderr, so as not to spoil the JSON of the studies listed so far
+        print(f"To continue, use '--cursor {_encode_cursor(key)}'", file=sys.stderr)
+
+    return rows
+
+
+def _get_schema(
+    api: Api,
+    storage_args: tuple[str, str, str],
+    params: dict,
+    max_age: Optional[float] = None,
+    refresh: bool = False,
+) -> dict:
+    if max_age is None:
+        return api.Storage.Study.schema(*storage_args, **params)
+
+    def fetch(entry: Optional[cache.Entry]) -> cache.Entry:
+        request = api.Storage.Study.schema(*storage_args, **params, only_prepare=True)
+
+        if entry is not None:
+            request.headers = {
+                **(request.headers or {}),
+                **entry.get_conditional_headers(),
+            }
+
+        try:
+            response = request.execute()
+        except AmbraResponseException as e:
+            if e.code == 304 and entry is not None:
+                # not modified since it was cached
+                return entry
+
+            raise
+
+        return cache.Entry(
+            response.json(),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+
+    return cache.read_through(
+        "storage/study/schema",
+        {"storage_args": storage_args, **params},
+        fetch,
+        max_age,
+        refresh,
+    )
 
 
 def cmd_schema(args: argparse.Namespace) -> dict:
     api = get_api()
-    return api.Storage.Study.schema(
-        *_get_storage_args(api, args.uuid),
-        extended=int(args.extended),
-        attachments_only=int(args.attachments_only),
+    storage_args = _get_storage_args(api, args.uuid, args.max_age, args.no_cache)
+    params = {
+        "extended": int(args.extended),
+        "attachments_only": int(args.attachments_only),
+    }
+    return _get_schema(api, storage_args, params, args.max_age, args.no_cache)
+
+
+def _to_number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return value
+
+    for type_ in (int, float):
+        try:
+            return type_(value)
+        except (TypeError, ValueError):
+            pass
+
+    return None
+
+
+def cmd_stats(args: argparse.Namespace) -> dict:
+    api = get_api()
+
+    if len(_split_filters(args.filters or [])) > 1:
+        raise InvalidArgumentsError(
+            f"'in' filters of more than {IN_FILTER_CHUNK_SIZE} values are not "
+            "supported."
+        )
+
+    aggregates: dict[str, dict[str, Any]] = {
+        "sum": {field: stats.Summary() for field in args.sum or []},
+        "histogram": {field: stats.Histogram() for field in args.histogram or []},
+        # few enough days (tens of thousands over a century) to count every one
+        "per_day": {
+            field: stats.Histogram(max_buckets=None) for field in args.per_day or []
+        },
+        "distinct": {field: stats.HyperLogLog() for field in args.distinct or []},
+        "quantiles": {field: stats.Quantiles() for field in args.quantiles or []},
+    }
+
+    if not any(aggregates.values()):
+        raise InvalidArgumentsError(
+            "At least one of 'sum', 'histogram', 'per-day', 'distinct' or "
+            "'quantiles' must be specified."
+        )
+
+    # only the aggregated fields (and those the scan pages on) are fetched
+    fields = [field for by_field in aggregates.values() for field in by_field]
+    fields = list(dict.fromkeys([*fields, "created", "uuid"]))
+    count = 0
+    stopped = False
+
+    try:
+        for row in _iter_keyset(api, fields, args.filters, None):
+            count += 1
+
+            for kind, by_field in aggregates.items():
+                for field, aggregate in by_field.items():
+                    value = row.get(field)
+
+                    if kind in ("sum", "quantiles"):
+                        value = _to_number(value)
+                    elif kind == "per_day" and value is not None:
+                        value = str(value)[:10]
+
+                    if value is not None:
+                        aggregate.add(value)
+    except KeyboardInterrupt:
+        stopped = True
+        print(f"Stopped after {count} studies.", file=sys.stderr)
+
+    result: dict[str, Any] = {"studies": count}
+
+    if stopped:
+        result["partial"] = True
+
+    for kind, by_field in aggregates.items():
+        if by_field:
+            result[kind] = {
+                field: aggregate.result() for field, aggregate in by_field.items()
+            }
+
+    return result
+
+
+def _get_engine_fqdn(api: Api, namespace: str) -> str:
+    return api.Namespace.engine_fqdn(namespace_id=namespace).get()["engine_fqdn"]
+
+
+def _mirror_study(
+    source: Api, target: Api, args: argparse.Namespace, engine_fqdn: str, uuid: str
+) -> tuple[bool, int, int]:
+    """
+    Copies a study's images from `source` to the target namespace, unless the study
+    (by study UID) is already there with as many images. Returns whether it was
+    copied, along with the number of images and bytes copied.
+    """
+    # each call is made in its environment, which its metrics are labelled with
+    with using_env(args.source):
+        source_fqdn, source_namespace, study_uid = _get_storage_args(source, uuid)
+        schema = source.Storage.Study.schema(source_fqdn, source_namespace, study_uid)
+
+    images = list(_iter_schema_images(schema, None, None))
+
+    with using_env(args.target):
+        existing = (
+            target.Study.list(fields=json.dumps(["uuid", "image_count"]))
+            .filter_by(Filter("study_uid", FilterCondition.equals, study_uid))
+            .filter_by(
+                Filter("storage_namespace", FilterCondition.equals, args.namespace)
+            )
+            .first()
+        )
+
+    # a study that is there with fewer images is one whose copy was interrupted (or
+    # failed), and is copied again
+    if existing is not None and existing.get("image_count") == len(images):
+        return False, 0, 0
+
+    bytes_copied = 0
+
+    # images are held in memory one at a time per study, rather than the whole bundle
+    for _, image_uid, image_version in images:
+        with using_env(args.source):
+            payload = source.Storage.Image.dicom_payload(
+                source_fqdn, source_namespace, study_uid, image_uid, image_version
+            ).content
+
+        with using_env(args.target):
+            target.Storage.Image.upload(
+                engine_fqdn, args.namespace, opened_file=payload, study_uid=study_uid
+            )
+
+        bytes_copied += len(payload)
+
+    return True, len(images), bytes_copied
+
+
+def cmd_mirror(args: argparse.Namespace) -> dict:
+    if args.source == args.target:
+        raise InvalidArgumentsError("'from' and 'to' must be different environments.")
+
+    with using_env(args.source):
+        source = get_api()
+
+        uuids = list(args.uuid)
+
+        if args.filters is not None:
+            uuids += [
+                row["uuid"]
+                for row in _iter_keyset(source, ["created", "uuid"], args.filters, None)
+            ]
+
+    if not uuids:
+        raise InvalidArgumentsError("No studies given.")
+
+    with using_env(args.target):
+        target = get_api()
+        engine_fqdn = args.engine_fqdn or _get_engine_fqdn(target, args.namespace)
+    set_storage_pool_size(source, args.workers)
+    set_storage_pool_size(target, args.workers)
+
+    lock = threading.Lock()
+    stats = {"mirrored": 0, "skipped": 0, "failed": 0, "images": 0, "bytes": 0}
+    start = time.monotonic()
+
+    def mirror(uuid: str) -> None:
+        try:
+            copied, images, bytes_copied = _mirror_study(
+                source, target, args, engine_fqdn, uuid
+            )
+        except (AmbramelinError, AmbraException, requests.RequestException) as e:
+            print(f"Failed to mirror {uuid}: {e}", file=sys.stderr)
+
+            with lock:
+                stats["failed"] += 1
+
+            return
+
+        with lock:
+            stats["mirrored" if copied else "skipped"] += 1
+            stats["images"] += images
+            stats["bytes"] += bytes_copied
+            print(
+                f"{stats['mirrored'] + stats['skipped']:,}/{len(uuids):,} studies "
+                "mirrored",
+                end="\r",
+                file=sys.stderr,
+            )
+
+    # in the caller's context, each call in a copy of it, as one cannot be entered by
+    # several threads at once
+    context = contextvars.copy_context()
+
+    with ThreadPoolExecutor(args.workers) as executor:
+        # results are only collected to re-raise unexpected errors
+        list(executor.map(lambda uuid: context.copy().run(mirror, uuid), uuids))
+
+    print(file=sys.stderr)
+
+    return {**stats, "seconds": round(time.monotonic() - start, 3)}
+
+
+# a key's value, and the UUIDs and field digests of the studies with that value
+_DiffGroup = tuple[str, list[str], list[tuple[bytes, ...]]]
+
+
+def _hash_fields(row: dict, fields: list[str]) -> tuple[bytes, ...]:
+    return tuple(
+        hashlib.blake2b(
+            json.dumps(row.get(field), sort_keys=True).encode(), digest_size=8
+        ).digest()
+        for field in fields
+    )
+
+
+def _iter_diff_groups(
+    rows: Iterable[dict], key: str, fields: list[str]
+) -> Iterator[_DiffGroup]:
+    # a study UID can be in several namespaces, and so be several studies
+    for value, group in itertools.groupby(rows, key=lambda row: row[key]):
+        studies = list(group)
+        yield (
+            value,
+            [study["uuid"] for study in studies],
+            [_hash_fields(study, fields) for study in studies],
+        )
+
+
+def _get_differing_fields(
+    fields: list[str], source: list[tuple[bytes, ...]], target: list[tuple[bytes, ...]]
+) -> list[str]:
+    return [
+        field
+        for index, field in enumerate(fields)
+        if {d[index] for d in source} != {d[index] for d in target}
+    ]
+
+
+def cmd_diff(args: argparse.Namespace) -> None:
+    if args.source == args.target:
+        raise InvalidArgumentsError("'source' and 'target' must be different.")
+
+    with using_env(args.source):
+        source = get_api()
+
+    with using_env(args.target):
+        target = get_api()
+
+    compare = args.compare or []
+    fields = list(dict.fromkeys(["study_uid", "uuid", *compare]))
+    # studies are matched up by study UID, as a UUID is unique to an environment; both
+    # environments are scanned in study UID order and merged as they go, so only one
+    # page of each is held in memory, and fields are compared by their digests
+    source_groups, target_groups = (
+        _iter_diff_groups(
+            _iter_keyset(api, fields, args.filters, None, order="study_uid"),
+            "study_uid",
+            compare,
+        )
+        for api in (source, target)
+    )
+    counts = dict.fromkeys(
+        ("source", "target", "only_in_source", "only_in_target", "different"), 0
+    )
+
+    # a scan pages through its environment as it is advanced, and so is advanced in
+    # it, for its metrics to be labelled with it
+    def next_source() -> Optional[_DiffGroup]:
+        with using_env(args.source):
+            return next(source_groups, None)
+
+    def next_target() -> Optional[_DiffGroup]:
+        with using_env(args.target):
+            return next(target_groups, None)
+
+    a = next_source()
+    b = next_target()
+
+    while a is not None or b is not None:
+        diff: Optional[dict[str, Any]] = None
+
+        if b is None or (a is not None and a[0] < b[0]):
+            assert a is not None
+            diff = {"study_uid": a[0], "only_in": args.source, "uuids": a[1]}
+            # studies, of which a study UID can have several
+            counts["source"] += len(a[1])
+            counts["only_in_source"] += len(a[1])
+            a = next_source()
+        elif a is None or b[0] < a[0]:
+            diff = {"study_uid": b[0], "only_in": args.target, "uuids": b[1]}
+            counts["target"] += len(b[1])
+            counts["only_in_target"] += len(b[1])
+            b = next_target()
+        else:
+            differs = _get_differing_fields(compare, a[2], b[2])
+
+            if differs or len(a[1]) != len(b[1]):
+                diff = {
+                    "study_uid": a[0],
+                    "differs": differs,
+                    "uuids": {args.source: a[1], args.target: b[1]},
+                }
+                counts["different"] += 1
+
+            counts["source"] += len(a[1])
+            counts["target"] += len(b[1])
+            a = next_source()
+            b = next_target()
+
+        if diff is not None:
+            print(json.dumps(diff), flush=True)
+
+    print(
+        f"{counts['source']:,} studies in {args.source} and {counts['target']:,} in "
+        f"{args.target}: {counts['only_in_source']:,} only in {args.source}, "
+        f"{counts['only_in_target']:,} only in {args.target}, "
+        f"{counts['different']:,} study UIDs different",
+        file=sys.stderr,
     )
+
+
+def _read_manifest(path: Path) -> set[str]:
+    if not path.exists():
+        return set()
+
+    with path.open("r") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def cmd_upload(args: argparse.Namespace) -> dict:
+    api = get_api()
+    path = Path(args.path)
+
+    if not path.exists():
+        raise InvalidArgumentsError(f"'{path}' does not exist.")
+
+    manifest_path = Path(args.manifest or f"{path.resolve()}.manifest")
+    # instances uploaded by a previous (interrupted) run, plus those seen in this one
+    seen = _read_manifest(manifest_path)
+    engine_fqdn = args.engine_fqdn or _get_engine_fqdn(api, args.namespace)
+    set_storage_pool_size(api, args.workers)
+
+    lock = threading.Lock()
+    stats = {"uploaded": 0, "skipped": 0, "failed": 0, "bytes": 0}
+    start = time.monotonic()
+
+    def upload(name: str, data: bytes) -> None:
+        sop_instance_uid = read_sop_instance_uid(data)
+
+        with lock:
+            if sop_instance_uid is None or sop_instance_uid in seen:
+                stats["skipped"] += 1
+                return
+
+            seen.add(sop_instance_uid)
+
+        try:
+            api.Storage.Image.upload(engine_fqdn, args.namespace, opened_file=data)
+        except (AmbraException, requests.RequestException) as e:
+            with lock:
+                seen.discard(sop_instance_uid)
+                stats["failed"] += 1
+
+            print(f"Failed to upload {name}: {e}", file=sys.stderr)
+        else:
+            with lock:
+                manifest.write(f"{sop_instance_uid}\n")
+                manifest.flush()
+                stats["uploaded"] += 1
+                stats["bytes"] += len(data)
+                # e.g. with a coarse clock, right after the start
+                elapsed = time.monotonic() - start or float("inf")
+                print(
+                    f"{stats['uploaded']:,} files uploaded "
+                    f"({stats['uploaded'] / elapsed:.1f} files/s, "
+                    f"{stats['bytes'] / elapsed / 1e6:.1f} MB/s)",
+                    end="\r",
+                    file=sys.stderr,
+                )
+
+    with manifest_path.open("a") as manifest, ThreadPoolExecutor(
+        args.workers
+    ) as executor:
+        pending: set[Future] = set()
+
+        # files are read ahead of the uploads by at most one extra file per worker,
+        # to keep memory bounded regardless of how many files there are
+        for name, data in iter_files(path):
+            if len(pending) >= args.workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    future.result()
+
+            pending.add(executor.submit(upload, name, data))
+
+        for future in pending:
+            future.result()
+
+    print(file=sys.stderr)
+    elapsed = time.monotonic() - start
+    # no rates, rather than infinite ones, if no time could be measured
+    divisor = elapsed or float("inf")
+
+    return {
+        **stats,
+        "seconds": round(elapsed, 3),
+        "files_per_sec": round(stats["uploaded"] / divisor, 1),
+        "mb_per_sec": round(stats["bytes"] / divisor / 1e6, 1),
+    }
+
+
+def _watch_query(
+    api: Api, args: argparse.Namespace, order: SortingOrder, since: Optional[str]
+) -> QueryOF:
+    fields = args.fields and list(dict.fromkeys(["uuid", "created", *args.fields]))
+    query = api.Study.list(fields=fields and json.dumps(fields))
+
+    if args.filters is not None:
+        query = _augment_query_with_filters(query, args.filters)
+
+    if since is not None:
+        query = query.filter_by(Filter("created", FilterCondition.ge, since))
+
+    return query.sort_by(Sorter("created", order))
+
+
+def parse_download_args(uuid: str, *options: str) -> argparse.Namespace:
+    """
+    Returns the arguments of 'study download <uuid> <options>', for downloads started
+    by other commands, which so get the defaults of the options they do not give.
+    """
+    parser, _ = build_parser(load_config())
+    return parser.parse_args(["study", "download", uuid, *options])
+
+
+def _start_download(
+    executor: ThreadPoolExecutor, api: Api, args: argparse.Namespace, uuid: str
+) -> Future:
+    download_args = parse_download_args(uuid, f"--dest={args.download}", "--workers=1")
+
+    def download() -> None:
+        try:
+            cmd_download(download_args, api)
+        except (AmbramelinError, AmbraException, requests.RequestException) as e:
+            print(f"Failed to download {uuid}: {e}", file=sys.stderr)
+
+    # in the environment (and with the settings) of the watch
+    return executor.submit(contextvars.copy_context().run, download)
+
+
+def cmd_watch(args: argparse.Namespace) -> None:
+    if args.min_interval > args.max_interval:
+        raise InvalidArgumentsError(
+            "'max-interval' must not be less than 'min-interval'."
+        )
+
+    if args.download is not None and args.download.format(uuid="") == "-":
+        raise InvalidArgumentsError("'download' cannot be stdout, which lists studies.")
+
+    api = get_api()
+    # studies created at the high-water mark that were already listed, since the
+    # next poll lists studies created at or after it
+    seen: set[str] = set()
+    since = args.since
+
+    if since is None:
+        # start from the most recently created study, according to the server's clock
+        latest = _watch_query(api, args, SortingOrder.descending, None).first()
+
+        if latest is not None:
+            since = latest["created"]
+            seen = {
+                study["uuid"]
+                for study in _watch_query(
+                    api, args, SortingOrder.ascending, since
+                ).all()
+            }
+
+    print(f"Watching for studies created since {since}", file=sys.stderr)
+    interval = args.min_interval
+    downloads: list[Future] = []
+
+    # downloads run one at a time, in the background, so as not to delay polling
+    with ThreadPoolExecutor(1) as executor:
+        try:
+            while True:
+                try:
+                    studies = [
+                        study
+                        for study in _watch_query(
+                            api, args, SortingOrder.ascending, since
+                        ).all()
+                        if study["uuid"] not in seen
+                    ]
+                except (AmbraException, requests.RequestException) as e:
+                    print(f"Failed to list studies: {e}", file=sys.stderr)
+                    studies = []
+
+                for study in studies:
+                    print(json.dumps(study), flush=True)
+
+                    if args.download is not None:
+                        downloads = [d for d in downloads if not d.done()]
+                        downloads.append(
+                            _start_download(executor, api, args, study["uuid"])
+                        )
+
+                if studies:
+                    if studies[-1]["created"] != since:
+                        since = studies[-1]["created"]
+                        seen = set()
+
+                    seen.update(s["uuid"] for s in studies if s["created"] == since)
+                    # studies are arriving, so more are likely to follow soon
+                    interval = args.min_interval
+                else:
+                    interval = min(interval * 2, args.max_interval)
+
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            # allows resuming where this left off
+            print(
+                f"Stopped watching; resume with '--since \"{since}\"'", file=sys.stderr
+            )
+            executor.shutdown(wait=False, cancel_futures=True)
+            cancelled = sum(future.cancelled() for future in downloads)
+
+            if cancelled:
+                print(
+                    f"Cancelled {cancelled} pending download(s); finishing the one "
+                    "in progress",
+                    file=sys.stderr,
+                )
@@ -3,7 +3,7 @@ from getpass import getpass
 
 import cattr
 
-from ambramelin.util import credentials
+from ambramelin.util import agent, credentials
 from ambramelin.util.config import (
     Config,
     User,
@@ -66,6 +66,7 @@ def cmd_del(args: argparse.Namespace) -> None:
 
         cred_manager = credentials.managers[config.users[args.name].credentials_manager]
         cred_manager.del_password(args.name)
+        agent.del_password(args.name)
         del config.users[args.name]
 
         for name, env in config.envs.items():
@@ -104,6 +105,7 @@ def cmd_set(args: argparse.Namespace) -> dict:
             ].del_password(args.name)
             credentials.managers[args.creds].set_password(args.name, password)
             config.users[args.name].credentials_manager = args.creds
+            agent.del_password(args.name)
 
         elif args.passwd:
             password = getpass()
@@ -112,5 +114,6 @@ def cmd_set(args: argparse.Namespace) -> dict:
             ]
             cred_manager.del_password(args.name)
             cred_manager.set_password(args.name, password)
+            agent.del_password(args.name)
 
     return {args.name: cattr.unstructure(config.users[args.name])}
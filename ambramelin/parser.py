@@ -0,0 +1,574 @@
+"""The parser of the command line (see `ambramelin.main`), shared with batches."""
+
+import argparse
+from collections.abc import Callable
+from importlib import import_module
+from typing import Any
+
+from ambramelin.util import credentials, integrity
+from ambramelin.util.config import Config
+from ambramelin.util.ratelimit import parse_rate
+
+
+def _add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        metavar="SECONDS",
+        help="use a cached response, if there is one this recent (opts into caching)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="ignore cached responses, replacing them with fresh ones",
+    )
+
+
+def _add_fields_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--fields", type=str, nargs="+")
+    group.add_argument(
+        "--preset",
+        type=str,
+        help="named set of fields (e.g. 'storage'; see 'ambra env preset'), rather "
+        "than the 'default' one",
+    )
+    group.add_argument(
+        "--all-fields", action="store_true", help="request every field of studies"
+    )
+
+
+def _add_limit_rate_argument(parser: argparse.ArgumentParser, help: str) -> None:
+    parser.add_argument(
+        "--limit-rate",
+        type=parse_rate,
+        metavar="RATE",
+        help=f"{help}, in bytes per second (e.g. 500k or 2m)",
+    )
+
+
+def _get_envs_type(envs: tuple[str, ...]) -> Callable[[str], list[str]]:
+    def parse_envs(value: str) -> list[str]:
+        """Parses comma-separated environments, which must all have been added."""
+        names = [name.strip() for name in value.split(",")]
+        unknown = [name for name in names if name not in envs]
+
+        if unknown:
+            raise argparse.ArgumentTypeError(
+                f"invalid choice: {', '.join(map(repr, unknown))} (choose from "
+                f"{', '.join(map(repr, envs))})"
+            )
+
+        return names
+
+    return parse_envs
+
+
+def build_parser(
+    config: Config,
+) -> tuple[argparse.ArgumentParser, dict[str, argparse.ArgumentParser]]:
+    """Returns the top-level parser along with the parser of each command."""
+    # TODO: auto-generate documentation
+    envs = tuple(config.envs) or None
+    users = tuple(config.users) or None
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-y", "--yes", action="store_true", help="answer 'yes' to all prompts"
+    )
+    parser_envs_group = parser.add_mutually_exclusive_group()
+    parser_envs_group.add_argument(
+        "--envs",
+        type=_get_envs_type(tuple(config.envs)),
+        help="run the command against these (comma-separated) environments (only "
+        "commands that read from them, e.g. 'study list')",
+    )
+    parser_envs_group.add_argument(
+        "--all-envs", action="store_true", help="run the command against all envs"
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        metavar="PATH",
+        help="write metrics of the run to this file, in the OpenMetrics text format "
+        "(e.g. for node-exporter's textfile collector)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="serve metrics on http://127.0.0.1:PORT/metrics while the command runs",
+    )
+    subparsers = parser.add_subparsers(dest="cmd")
+
+    # env
+
+    parser_env = subparsers.add_parser("env")
+    parser_env_subparsers = parser_env.add_subparsers(dest="subcmd")
+
+    parser_env_add = parser_env_subparsers.add_parser("add")
+    parser_env_add.add_argument("name", type=str)
+    parser_env_add.add_argument("url", type=str)
+    parser_env_add.add_argument("--user", type=str, choices=users)
+    _add_limit_rate_argument(parser_env_add, "default download rate limit")
+
+    parser_env_subparsers.add_parser("current")
+
+    parser_env_del = parser_env_subparsers.add_parser("del")
+    parser_env_del.add_argument("name", type=str, choices=envs)
+
+    parser_env_subparsers.add_parser("list")
+
+    parser_env_preset = parser_env_subparsers.add_parser(
+        "preset", help="add, replace or (without fields) delete a field preset"
+    )
+    parser_env_preset.add_argument("name", type=str, choices=envs)
+    parser_env_preset.add_argument("preset", type=str)
+    parser_env_preset.add_argument("fields", type=str, nargs="*")
+
+    parser_env_set = parser_env_subparsers.add_parser("set")
+    parser_env_set.add_argument("name", type=str, choices=envs)
+    parser_env_set.add_argument("--url", type=str)
+    parser_env_set.add_argument("--user", type=str, choices=users)
+    _add_limit_rate_argument(parser_env_set, "default download rate limit (0 for none)")
+    parser_env_set.add_argument(
+        "--dicomweb-url",
+        type=str,
+        metavar="PATH",
+        help="path of DICOMweb series retrieval, relative to the storage API, for "
+        "'study download --method dicomweb' (e.g. '/dicomweb/{namespace}/studies/"
+        "{study_uid}/series/{series_uid}'; '' for none)",
+    )
+
+    parser_env_use = parser_env_subparsers.add_parser("use")
+    parser_env_use.add_argument("name", type=str, choices=envs)
+
+    # user
+
+    parser_user = subparsers.add_parser("user")
+    parser_user_subparsers = parser_user.add_subparsers(dest="subcmd")
+    parser_user_add = parser_user_subparsers.add_parser(
+        "add", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser_user_add.add_argument("name", type=str)
+    parser_user_add.add_argument(
+        "--creds",
+        type=str,
+        default="keychain",
+        choices=list(credentials.managers),
+        help="credentials manager",
+    )
+
+    parser_user_subparsers.add_parser("current")
+
+    parser_user_del = parser_user_subparsers.add_parser("del")
+    parser_user_del.add_argument("name", type=str, choices=users)
+
+    parser_user_subparsers.add_parser("list")
+
+    parser_user_set = parser_user_subparsers.add_parser(
+        "set", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser_user_set.add_argument("name", type=str, choices=users)
+    parser_user_set.add_argument(
+        "--creds",
+        type=str,
+        choices=list(credentials.managers),
+        help="credentials manager",
+    )
+    parser_user_set.add_argument("--passwd", action="store_true", help="password")
+
+    # study
+
+    parser_study = subparsers.add_parser("study")
+    parser_study_subparsers = parser_study.add_subparsers(dest="subcmd")
+
+    parser_study_count = parser_study_subparsers.add_parser("count")
+    parser_study_count.add_argument(
+        "--filters", type=str, nargs="+", help="field.condition.value"
+    )
+
+    parser_study_get = parser_study_subparsers.add_parser("get")
+    parser_study_get.add_argument("uuid", type=str)
+    _add_fields_arguments(parser_study_get)
+    _add_cache_arguments(parser_study_get)
+
+    parser_study_diff = parser_study_subparsers.add_parser(
+        "diff",
+        help="list the studies that differ between two environments",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser_study_diff.add_argument("source", type=str, choices=envs)
+    parser_study_diff.add_argument("target", type=str, choices=envs)
+    parser_study_diff.add_argument(
+        "--filters",
+        type=str,
+        nargs="+",
+        help="compare the studies matching these (field.condition.value)",
+    )
+    parser_study_diff.add_argument(
+        "--compare", type=str, nargs="+", help="fields to compare matched studies on"
+    )
+
+    parser_study_download = parser_study_subparsers.add_parser(
+        "download", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser_study_download.add_argument("uuid", type=str)
+    parser_study_download.add_argument(
+        "--dest", type=str, default="{uuid}.zip", help="destination ('-' for stdout)"
+    )
+    parser_study_download.add_argument(
+        "--bundle",
+        type=str,
+        default="dicom",
+        choices=["dicom", "iso", "osx", "win"],
+        help="bundle type",
+    )
+    parser_study_download.add_argument(
+        "--method",
+        type=str,
+        choices=["bundle", "images", "dicomweb"],
+        help="retrieve a bundle, each image individually ('images', the default with "
+        "'series', 'images' or 'deidentify', 'bundle' otherwise), or the study's "
+        "instances with DICOMweb (experimental: needs the environment's DICOMweb "
+        "path, see 'ambra env set --dicomweb-url')",
+    )
+    parser_study_download.add_argument(
+        "--deidentify",
+        type=str,
+        metavar="PROFILE",
+        help="de-identify instances as they are downloaded, according to a JSON "
+        "profile (with the 'images' or 'dicomweb' method)",
+    )
+    parser_study_download.add_argument(
+        "--chunk-size", type=int, default=1024 * 1024, help="chunk size in bytes"
+    )
+    parser_study_download.add_argument(
+        "--series", type=str, nargs="+", help="only download these series (UIDs)"
+    )
+    parser_study_download.add_argument(
+        "--images", type=str, nargs="+", help="only download these images (UIDs)"
+    )
+    parser_study_download.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="number of images (or series, with dicomweb) downloaded in parallel when "
+        "using series/images",
+    )
+    _add_limit_rate_argument(
+        parser_study_download, "download rate limit (defaults to the environment's)"
+    )
+    parser_study_download.add_argument(
+        "--hash",
+        type=str,
+        choices=integrity.ALGORITHMS,
+        help="hash the download as it is written, recording the digest, size and "
+        "timings in '<dest>.manifest.json'",
+    )
+    parser_study_download.add_argument(
+        "--skip-existing",
+        action="store_true",
+        help="do not download to a destination that matches its manifest "
+        "(implies '--hash sha256')",
+    )
+    parser_study_download.add_argument(
+        "--rehash-existing",
+        action="store_true",
+        help="with '--skip-existing', read the destination back to hash it again (an "
+        "extra pass over it) rather than trusting its size and modification time",
+    )
+
+    parser_study_frames = parser_study_subparsers.add_parser(
+        "frames",
+        help="fetch thumbnails or rendered frames of a study's images",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser_study_frames.add_argument("uuid", type=str)
+    parser_study_frames.add_argument(
+        "--dest",
+        type=str,
+        default="{uuid}",
+        help="directory the images are written to, as SERxxxx/IMGxxxx.jpg",
+    )
+    parser_study_frames.add_argument(
+        "--kind", type=str, default="thumbnail", choices=["thumbnail", "frame"]
+    )
+    parser_study_frames.add_argument(
+        "--frame", type=int, default=0, help="frame number of multi-frame images"
+    )
+    parser_study_frames.add_argument(
+        "--size",
+        type=str,
+        help="maximum edge length, or WIDTHxHEIGHT, of rendered frames",
+    )
+    parser_study_frames.add_argument(
+        "--series", type=str, nargs="+", help="only fetch these series (UIDs)"
+    )
+    parser_study_frames.add_argument(
+        "--images", type=str, nargs="+", help="only fetch these images (UIDs)"
+    )
+    parser_study_frames.add_argument(
+        "--workers", type=int, default=8, help="number of images fetched in parallel"
+    )
+    _add_cache_arguments(parser_study_frames)
+
+    parser_study_list = parser_study_subparsers.add_parser("list")
+    parser_study_list.add_argument(
+        "--filters", type=str, nargs="+", help="field.condition.value"
+    )
+    _add_fields_arguments(parser_study_list)
+    parser_study_list.add_argument("--min-row", type=int)
+    parser_study_list.add_argument("--max-row", type=int)
+    parser_study_list.add_argument(
+        "--keyset",
+        action="store_true",
+        help="page on (created, uuid) rather than by offset, for consistent and "
+        "resumable scans of many studies",
+    )
+    parser_study_list.add_argument(
+        "--cursor",
+        type=str,
+        help="continue a keyset scan from where it stopped (implies '--keyset')",
+    )
+
+    parser_study_mirror = parser_study_subparsers.add_parser(
+        "mirror",
+        help="copy studies from one environment to another",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser_study_mirror.add_argument("uuid", type=str, nargs="*")
+    parser_study_mirror.add_argument(
+        "--filters",
+        type=str,
+        nargs="+",
+        help="mirror the source's studies matching these (field.condition.value)",
+    )
+    parser_study_mirror.add_argument(
+        "--from", dest="source", type=str, required=True, choices=envs
+    )
+    parser_study_mirror.add_argument(
+        "--to", dest="target", type=str, required=True, choices=envs
+    )
+    parser_study_mirror.add_argument(
+        "--namespace",
+        type=str,
+        required=True,
+        help="storage namespace (UUID) in the destination",
+    )
+    parser_study_mirror.add_argument(
+        "--engine-fqdn", type=str, help="looked up from the namespace if omitted"
+    )
+    parser_study_mirror.add_argument(
+        "--workers", type=int, default=4, help="studies mirrored concurrently"
+    )
+
+    parser_study_schema = parser_study_subparsers.add_parser("schema")
+    parser_study_schema.add_argument("uuid", type=str)
+    parser_study_schema.add_argument("--extended", action="store_true")
+    parser_study_schema.add_argument("--attachments-only", action="store_true")
+    _add_cache_arguments(parser_study_schema)
+
+    parser_study_stats = parser_study_subparsers.add_parser(
+        "stats", help="aggregate studies without listing them"
+    )
+    parser_study_stats.add_argument(
+        "--filters", type=str, nargs="+", help="field.condition.value"
+    )
+    parser_study_stats.add_argument(
+        "--sum", type=str, nargs="+", help="fields to count, sum, min, max and average"
+    )
+    parser_study_stats.add_argument(
+        "--histogram", type=str, nargs="+", help="fields to count the values of"
+    )
+    parser_study_stats.add_argument(
+        "--per-day", type=str, nargs="+", help="date fields to count per day"
+    )
+    parser_study_stats.add_argument(
+        "--distinct",
+        type=str,
+        nargs="+",
+        help="fields to count the distinct values of (approximately)",
+    )
+    parser_study_stats.add_argument(
+        "--quantiles",
+        type=str,
+        nargs="+",
+        help="fields to estimate the median, 90th and 99th percentiles of",
+    )
+
+    parser_study_upload = parser_study_subparsers.add_parser(
+        "upload", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser_study_upload.add_argument(
+        "path", type=str, help="DICOM file, directory of DICOM files or zip archive"
+    )
+    parser_study_upload.add_argument(
+        "--namespace", type=str, required=True, help="storage namespace (UUID)"
+    )
+    parser_study_upload.add_argument(
+        "--engine-fqdn", type=str, help="looked up from the namespace if omitted"
+    )
+    parser_study_upload.add_argument(
+        "--manifest",
+        type=str,
+        help="file recording uploaded SOP Instance UIDs, for resuming "
+        "(defaults to '<path>.manifest')",
+    )
+    parser_study_upload.add_argument(
+        "--workers", type=int, default=8, help="number of parallel uploads"
+    )
+
+    parser_study_watch = parser_study_subparsers.add_parser(
+        "watch", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser_study_watch.add_argument(
+        "--filters", type=str, nargs="+", help="field.condition.value"
+    )
+    parser_study_watch.add_argument("--fields", type=str, nargs="+")
+    parser_study_watch.add_argument(
+        "--since",
+        type=str,
+        help="list studies created at or after this time (defaults to the most "
+        "recently created study)",
+    )
+    parser_study_watch.add_argument(
+        "--min-interval",
+        type=float,
+        default=5,
+        help="seconds between polls while studies are arriving",
+    )
+    parser_study_watch.add_argument(
+        "--max-interval",
+        type=float,
+        default=300,
+        help="seconds between polls, at most, while no studies are arriving",
+    )
+    parser_study_watch.add_argument(
+        "--download",
+        type=str,
+        metavar="DEST",
+        help="download new studies to this destination (e.g. '{uuid}.zip')",
+    )
+
+    # agent
+
+    parser_agent = subparsers.add_parser("agent")
+    parser_agent_subparsers = parser_agent.add_subparsers(dest="subcmd")
+
+    parser_agent_subparsers.add_parser("clear")
+
+    parser_agent_start = parser_agent_subparsers.add_parser(
+        "start", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser_agent_start.add_argument(
+        "--ttl", type=float, default=3600, help="seconds a password is held for"
+    )
+    parser_agent_start.add_argument(
+        "--foreground", action="store_true", help="do not run in the background"
+    )
+
+    parser_agent_subparsers.add_parser("status")
+    parser_agent_subparsers.add_parser("stop")
+
+    # jobs
+
+    parser_jobs = subparsers.add_parser("jobs")
+    parser_jobs_subparsers = parser_jobs.add_subparsers(dest="subcmd")
+
+    parser_jobs_add = parser_jobs_subparsers.add_parser(
+        "add", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser_jobs_add.add_argument("uuid", type=str, nargs="*")
+    parser_jobs_add.add_argument(
+        "--file", type=str, help="file of study UUIDs, one per line ('-' for stdin)"
+    )
+    parser_jobs_add.add_argument(
+        "--dest", type=str, default="{uuid}.zip", help="destination"
+    )
+    parser_jobs_add.add_argument(
+        "--bundle",
+        type=str,
+        default="dicom",
+        choices=["dicom", "iso", "osx", "win"],
+        help="bundle type",
+    )
+
+    for name, help in (
+        ("resume", "retry failed tasks, then run pending ones"),
+        ("run", "run pending tasks"),
+    ):
+        parser_jobs_run = parser_jobs_subparsers.add_parser(
+            name, help=help, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+        parser_jobs_run.add_argument(
+            "--workers", type=int, default=4, help="number of parallel downloads"
+        )
+        parser_jobs_run.add_argument(
+            "--max-attempts",
+            type=int,
+            default=3,
+            help="attempts made at a task before it is marked as failed",
+        )
+
+    parser_jobs_subparsers.add_parser("status")
+
+    # bundle
+
+    parser_bundle = subparsers.add_parser("bundle")
+    parser_bundle_subparsers = parser_bundle.add_subparsers(dest="subcmd")
+
+    parser_bundle_inspect = parser_bundle_subparsers.add_parser(
+        "inspect", help="summarise the series of a downloaded bundle"
+    )
+    parser_bundle_inspect.add_argument("path", type=str)
+    parser_bundle_inspect.add_argument(
+        "--series", type=str, nargs="+", help="also list the instances of these series"
+    )
+
+    parser_bundle_extract = parser_bundle_subparsers.add_parser(
+        "extract",
+        help="extract instances from a downloaded bundle",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser_bundle_extract.add_argument("path", type=str)
+    parser_bundle_extract.add_argument(
+        "--dest", type=str, default=".", help="destination directory"
+    )
+    parser_bundle_extract.add_argument(
+        "--series", type=str, nargs="+", help="only extract these series (UIDs)"
+    )
+    parser_bundle_extract.add_argument(
+        "--images", type=str, nargs="+", help="only extract these images (UIDs)"
+    )
+
+    # completion
+
+    parser_completion = subparsers.add_parser("completion")
+    parser_completion_subparsers = parser_completion.add_subparsers(dest="subcmd")
+    parser_completion_subparsers.add_parser("bash")
+    parser_completion_subparsers.add_parser("fish")
+    parser_completion_subparsers.add_parser("zsh")
+
+    # batch
+
+    parser_batch = subparsers.add_parser(
+        "batch", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser_batch.set_defaults(subcmd="run")
+    parser_batch.add_argument(
+        "file",
+        type=str,
+        nargs="?",
+        default="-",
+        help="file of commands, one per line, without the leading 'ambra' ('-' for "
+        "stdin)",
+    )
+    parser_batch.add_argument(
+        "--workers", type=int, default=1, help="number of commands run concurrently"
+    )
+
+    return parser, subparsers.choices
+
+
+def get_cmd(args: argparse.Namespace) -> Callable[[argparse.Namespace], Any]:
+    return getattr(import_module(f"ambramelin.cmd.{args.cmd}"), f"cmd_{args.subcmd}")
@@ -0,0 +1,198 @@
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from ambramelin.util.errors import InsecureAgentDirectoryError
+
+# how long a client waits on the agent before falling back to the credentials manager
+CLIENT_TIMEOUT = 1.0
+
+
+def get_socket_path() -> Path:
+    if path := os.environ.get("AMBRAMELIN_AGENT_SOCK"):
+        return Path(path)
+
+    # private to the user, unlike the temporary directory
+    if runtime_dir := os.environ.get("XDG_RUNTIME_DIR"):
+        return Path(runtime_dir) / "ambramelin" / "agent.sock"
+
+    return Path(tempfile.gettempdir()) / f"ambramelin-{os.getuid()}" / "agent.sock"
+
+
+def check_socket_dir(path: Path) -> None:
+    """
+    Makes sure that only the user can have put a socket in the directory, since in a
+    shared one (e.g. /tmp) another user could have created it in advance to collect
+    passwords.
+    """
+    try:
+        st = path.lstat()
+    except FileNotFoundError:
+        raise InsecureAgentDirectoryError(str(path), "it does not exist")
+
+    if not stat.S_ISDIR(st.st_mode):
+        raise InsecureAgentDirectoryError(str(path), "it is not a directory")
+
+    if st.st_uid != os.getuid():
+        raise InsecureAgentDirectoryError(str(path), "it is owned by another user")
+
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        raise InsecureAgentDirectoryError(
+            str(path), f"its mode is {stat.S_IMODE(st.st_mode):o} rather than 700"
+        )
+
+
+def _get_peer_uid(sock: socket.socket) -> Optional[int]:
+    """Returns the user at the other end of a socket, where the OS can tell."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+
+    # struct ucred: pid, uid, gid
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, 12)
+    return int.from_bytes(creds[4:8], sys.byteorder)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "AgentServer"
+
+    def handle(self) -> None:
+        if not self.server.is_peer_allowed(self.request):
+            return
+
+        try:
+            request = json.loads(self.rfile.readline())
+            response = self.server.dispatch(request)
+        except (ValueError, KeyError):
+            response = {"ok": False}
+
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class AgentServer(socketserver.ThreadingUnixStreamServer):
+    """Holds passwords in memory, each for `ttl` seconds after it was added."""
+
+    daemon_threads = True
+
+    def __init__(self, path: Path, ttl: float) -> None:
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        check_socket_dir(path.parent)
+        path.unlink(missing_ok=True)
+        self.ttl = ttl
+        self._passwords: dict[str, tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        # only the user running the agent may connect to its socket
+        umask = os.umask(0o177)
+
+        try:
+            super().__init__(str(path), _Handler)
+        finally:
+            os.umask(umask)
+
+    def is_peer_allowed(self, sock: socket.socket) -> bool:
+        # the socket's permissions already restrict access; where the OS can tell us
+        # who is connecting, make sure of it
+        return _get_peer_uid(sock) in (None, os.getuid())
+
+    def dispatch(self, request: dict) -> dict:
+        op = request["op"]
+
+        with self._lock:
+            if op == "get":
+                password, expires = self._passwords.get(request["account"], (None, 0))
+
+                if time.monotonic() >= expires:
+                    self._passwords.pop(request["account"], None)
+                    password = None
+
+                return {"ok": True, "password": password}
+
+            elif op == "set":
+                self._passwords[request["account"]] = (
+                    request["password"],
+                    time.monotonic() + self.ttl,
+                )
+
+            elif op == "del":
+                self._passwords.pop(request["account"], None)
+
+            elif op == "clear":
+                self._passwords.clear()
+
+            elif op == "status":
+                now = time.monotonic()
+                return {
+                    "ok": True,
+                    "accounts": sorted(
+                        account
+                        for account, (_, expires) in self._passwords.items()
+                        if now < expires
+                    ),
+                    "ttl": self.ttl,
+                }
+
+            elif op == "stop":
+                # `shutdown` waits for the serving loop, which is busy handling this
+                threading.Thread(target=self.shutdown).start()
+
+            else:
+                return {"ok": False}
+
+        return {"ok": True}
+
+
+def request(op: str, **kwargs: Any) -> Optional[dict]:
+    """
+    Sends a request to the agent, returning None if the agent is not running (or its
+    socket cannot be trusted to be the user's own agent).
+    """
+    path = get_socket_path()
+
+    if not path.exists():
+        return None
+
+    try:
+        check_socket_dir(path.parent)
+    except InsecureAgentDirectoryError as e:
+        print(f"Not using the agent: {e}", file=sys.stderr)
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(CLIENT_TIMEOUT)
+            sock.connect(str(path))
+
+            # nothing (e.g. a password) is sent to an agent run by another user
+            if _get_peer_uid(sock) not in (None, os.getuid()):
+                return None
+
+            sock.sendall(json.dumps({"op": op, **kwargs}).encode() + b"\n")
+
+            with sock.makefile("rb") as f:
+                return json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+
+
+def get_password(account: str) -> Optional[str]:
+    response = request("get", account=account)
+
+    if response is None:
+        return None
+
+    return response.get("password")
+
+
+def set_password(account: str, password: str) -> None:
+    request("set", account=account, password=password)
+
+
+def del_password(account: str) -> None:
+    request("del", account=account)
@@ -0,0 +1,197 @@
+"""
+Indexing of downloaded bundles (see `ambra bundle`), so that their contents can be
+listed and extracted without unpacking them.
+
+A bundle is memory-mapped, and only its central directory and the DICOM header of
+each entry are read to build its index, which is kept alongside it in
+`<bundle>.index.json` until the bundle changes. Entries are then read straight from
+the mapping at the offsets the index records.
+"""
+
+import contextlib
+import json
+import mmap
+import os
+import struct
+import zipfile
+import zlib
+from collections.abc import Iterator
+from pathlib import Path
+from typing import BinaryIO, Optional, cast
+
+import attr
+import cattr
+import pydicom
+from pydicom.errors import InvalidDicomError
+
+from ambramelin.util.errors import InvalidBundleError
+from ambramelin.util.files import atomic_write
+
+# signature, version, flags, method, time, date, crc, sizes, name length, extra length
+_LOCAL_HEADER = struct.Struct("<4s5HL2L2H")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+_HEADER_TAGS = [
+    "SOPInstanceUID",
+    "SeriesInstanceUID",
+    "SeriesDescription",
+    "Modality",
+    "InstanceNumber",
+]
+
+
+@attr.define
+class Entry:
+    name: str
+    # offset of the entry's local header
+    offset: int
+    method: int
+    compressed_size: int
+    size: int
+    crc: int
+    # None for entries that are not DICOM instances (e.g. a viewer's files)
+    sop_instance_uid: Optional[str] = None
+    series_uid: Optional[str] = None
+    series_description: Optional[str] = None
+    modality: Optional[str] = None
+    instance_number: Optional[int] = None
+
+
+@attr.define
+class Index:
+    # identity of the bundle that the index was built from
+    size: int
+    mtime_ns: int
+    entries: list[Entry]
+
+
+def get_index_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.index.json")
+
+
+@contextlib.contextmanager
+def _map(path: Path) -> Iterator[mmap.mmap]:
+    with path.open("rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file cannot be mapped
+            raise InvalidBundleError(str(path), "empty file")
+
+        with mm:
+            yield mm
+
+
+def _read_header(f: BinaryIO) -> dict:
+    try:
+        dataset = pydicom.dcmread(
+            f, stop_before_pixels=True, specific_tags=_HEADER_TAGS, force=True
+        )
+    except (InvalidDicomError, ValueError, EOFError, OSError, KeyError):
+        return {}
+
+    if "SOPInstanceUID" not in dataset:
+        return {}
+
+    instance_number = dataset.get("InstanceNumber")
+    return {
+        "sop_instance_uid": str(dataset.SOPInstanceUID),
+        "series_uid": dataset.get("SeriesInstanceUID"),
+        "series_description": dataset.get("SeriesDescription"),
+        "modality": dataset.get("Modality"),
+        "instance_number": None if instance_number is None else int(instance_number),
+    }
+
+
+def _build_index(path: Path, stat: os.stat_result) -> Index:
+    entries = []
+
+    with _map(path) as mm:
+        try:
+            zf = zipfile.ZipFile(cast(BinaryIO, mm))
+        except (zipfile.BadZipFile, ValueError):
+            # seeking outside of a mapping raises ValueError, e.g. for a small file
+            raise InvalidBundleError(str(path), "not a zip file")
+
+        with zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+
+                # reads as little of the entry as it takes to get past its header
+                with zf.open(info) as f:
+                    header = _read_header(cast(BinaryIO, f))
+
+                entries.append(
+                    Entry(
+                        name=info.filename,
+                        offset=info.header_offset,
+                        method=info.compress_type,
+                        compressed_size=info.compress_size,
+                        size=info.file_size,
+                        crc=info.CRC,
+                        **header,
+                    )
+                )
+
+    return Index(size=stat.st_size, mtime_ns=stat.st_mtime_ns, entries=entries)
+
+
+def _save_index(path: Path, index: Index) -> None:
+    index_path = get_index_path(path)
+    with atomic_write(index_path) as f:
+        json.dump(cattr.unstructure(index), f)
+
+
+def load_index(path: Path) -> Index:
+    """Returns the index of a bundle, building it if it is missing or out of date."""
+    stat = path.stat()
+
+    try:
+        with get_index_path(path).open("r") as f:
+            index = cattr.structure(json.load(f), Index)
+    except (OSError, ValueError, TypeError, KeyError):
+        index = None
+
+    if index is None or (index.size, index.mtime_ns) != (
+        stat.st_size,
+        stat.st_mtime_ns,
+    ):
+        index = _build_index(path, stat)
+
+        try:
+            _save_index(path, index)
+        except OSError:
+            # e.g. a read-only directory; the index is only an optimisation
+            pass
+
+    return index
+
+
+def _read_entry(path: Path, mm: mmap.mmap, entry: Entry) -> bytes:
+    fields = _LOCAL_HEADER.unpack_from(mm, entry.offset)
+
+    if fields[0] != _LOCAL_HEADER_SIGNATURE:
+        raise InvalidBundleError(str(path), f"no local header for '{entry.name}'")
+
+    start = entry.offset + _LOCAL_HEADER.size + fields[-2] + fields[-1]
+    data = mm[start : start + entry.compressed_size]
+
+    if entry.method == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(data, -zlib.MAX_WBITS)
+    elif entry.method != zipfile.ZIP_STORED:
+        raise InvalidBundleError(
+            str(path), f"unsupported compression of '{entry.name}'"
+        )
+
+    if zlib.crc32(data) != entry.crc:
+        raise InvalidBundleError(str(path), f"'{entry.name}' is corrupt")
+
+    return data
+
+
+def iter_entries(path: Path, entries: list[Entry]) -> Iterator[tuple[Entry, bytes]]:
+    """Yields the contents of the given entries of a bundle, read from their offsets."""
+    with _map(path) as mm:
+        for entry in entries:
+            yield entry, _read_entry(path, mm, entry)
@@ -0,0 +1,182 @@
+"""
+On-disk cache of API responses, for data that rarely (if ever) changes, such as the
+schemas of finalised studies.
+
+Each response is stored in its own file, named after a hash of the environment,
+endpoint and parameters it was requested with. Files are touched whenever they are
+used, and the least recently used are evicted once the cache grows beyond
+`MAX_SIZE`.
+
+Renderings of images (thumbnails and frames) are cached likewise, in an `images`
+subdirectory with a limit of its own, `MAX_IMAGES_SIZE`.
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, Optional
+
+import attr
+import cattr
+
+from ambramelin.util import metrics
+from ambramelin.util.config import get_response_cache_dir
+from ambramelin.util.files import atomic_write
+from ambramelin.util.sdk import get_env_name
+
+# bytes
+MAX_SIZE = 64 * 1024 * 1024
+MAX_IMAGES_SIZE = 256 * 1024 * 1024
+
+
+@attr.define
+class Entry:
+    value: Any
+    # validators for revalidating the entry once it is stale, if the API provides them
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # time.time() at which the entry was fetched or last revalidated
+    created: float = attr.Factory(time.time)
+
+    def get_conditional_headers(self) -> dict[str, str]:
+        headers = {}
+
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+
+        return headers
+
+
+def _get_key(env: str, endpoint: str, params: dict) -> str:
+    key = json.dumps([env, endpoint, params], sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _get_path(env: str, endpoint: str, params: dict) -> Path:
+    return get_response_cache_dir() / f"{_get_key(env, endpoint, params)}.json"
+
+
+def _get_image_path(env: str, endpoint: str, params: dict) -> Path:
+    return get_response_cache_dir() / "images" / _get_key(env, endpoint, params)
+
+
+def _load(path: Path) -> Optional[Entry]:
+    try:
+        with path.open("r") as f:
+            entry = cattr.structure(json.load(f), Entry)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    # marks the entry as recently used
+    os.utime(path)
+    return entry
+
+
+def _save(path: Path, entry: Entry) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with atomic_write(path) as f:
+        json.dump(cattr.unstructure(entry), f)
+
+    _evict(path.parent, "*.json", MAX_SIZE)
+
+
+def _evict(cache_dir: Path, pattern: str, max_size: float) -> None:
+    files = []
+
+    for file in cache_dir.glob(pattern):
+        try:
+            files.append((file.stat(), file))
+        except FileNotFoundError:
+            # evicted by another process
+            pass
+
+    size = sum(stat.st_size for stat, _ in files)
+
+    for stat, file in sorted(files, key=lambda f: f[0].st_mtime):
+        if size <= max_size:
+            break
+
+        file.unlink(missing_ok=True)
+        size -= stat.st_size
+
+
+def read_through(
+    endpoint: str,
+    params: dict,
+    fetch: Callable[[Optional[Entry]], Entry],
+    max_age: Optional[float],
+    refresh: bool = False,
+) -> Any:
+    """
+    Returns the cached response to a request if it is at most `max_age` seconds old,
+    and otherwise fetches (and caches) it. Responses are cached per environment.
+
+    `fetch` is given the stale entry, if there is one, which it may return (e.g. when
+    revalidating it results in a "304 Not Modified"). Nothing is cached when `max_age`
+    is None, while `refresh` ignores (but replaces) any cached response.
+    """
+    if max_age is None:
+        return fetch(None).value
+
+    path = _get_path(get_env_name(), endpoint, params)
+    entry = None if refresh else _load(path)
+
+    if entry is not None and time.time() - entry.created <= max_age:
+        metrics.inc("ambra_cache_requests", endpoint=endpoint, result="hit")
+        return entry.value
+
+    stale_entry = entry
+    entry = fetch(entry)
+    # `fetch` returns the stale entry when the server confirms it is still valid
+    revalidated = stale_entry is not None and entry is stale_entry
+    result = "revalidated" if revalidated else "miss"
+    metrics.inc("ambra_cache_requests", endpoint=endpoint, result=result)
+    entry.created = time.time()
+    _save(path, entry)
+    return entry.value
+
+
+def read_through_image(
+    endpoint: str, params: dict, fetch: Callable[[], bytes], refresh: bool = False
+) -> bytes:
+    """
+    Returns the cached rendering of an image, fetching (and caching) it if there is
+    none. `params` must identify the image version (e.g. its UID and version), which
+    a rendering never outlives, so that cached renderings need not expire.
+
+    Renderings are typically fetched many at a time, so rather than after each one,
+    the cache is trimmed with `evict_images` once they have been.
+    """
+    path = _get_image_path(get_env_name(), endpoint, params)
+
+    if not refresh:
+        try:
+            content = path.read_bytes()
+        except FileNotFoundError:
+            pass
+        else:
+            # marks the rendering as recently used
+            os.utime(path)
+            metrics.inc("ambra_cache_requests", endpoint=endpoint, result="hit")
+            return content
+
+    content = fetch()
+    metrics.inc("ambra_cache_requests", endpoint=endpoint, result="miss")
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with atomic_write(path, "wb") as f:
+        f.write(content)
+
+    return content
+
+
+def evict_images() -> None:
+    # temporary files start with a dot, and so are not matched
+    _evict(get_response_cache_dir() / "images", "[!.]*", MAX_IMAGES_SIZE)
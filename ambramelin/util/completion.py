@@ -0,0 +1,58 @@
+"""
+Cache of the values offered by shell completion (see `ambra completion`).
+
+The cache is a small text file with one line per key, the key followed by its values,
+all separated by spaces, so that completion scripts can read it without starting
+Python.
+"""
+
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Optional
+
+from ambra_sdk.service.filtering import FilterCondition
+
+from ambramelin.util.files import atomic_write
+
+# number of recently used study UUIDs and fields that are kept
+MAX_RECENT = 50
+
+
+def _read(path: Path) -> dict[str, list[str]]:
+    try:
+        with path.open("r") as f:
+            return {key: values for key, *values in map(str.split, f) if key}
+    except FileNotFoundError:
+        return {}
+
+
+def _recent(new: Iterable[str], old: Iterable[str]) -> list[str]:
+    return list(dict.fromkeys([*new, *old]))[:MAX_RECENT]
+
+
+def update_cache(
+    path: Path,
+    envs: Optional[Iterable[str]] = None,
+    users: Optional[Iterable[str]] = None,
+    uuids: Iterable[str] = (),
+    fields: Iterable[str] = (),
+) -> None:
+    """
+    Replaces the cached environment and user names (if given) and adds to the recently
+    used study UUIDs and fields.
+    """
+    cache = _read(path)
+    updated = {
+        "envs": list(envs) if envs is not None else cache.get("envs", []),
+        "users": list(users) if users is not None else cache.get("users", []),
+        "uuids": _recent(uuids, cache.get("uuids", [])),
+        "fields": _recent(fields, cache.get("fields", [])),
+        "conditions": [condition.value for condition in FilterCondition],
+    }
+
+    if updated == cache:
+        return
+
+    with atomic_write(path) as f:
+        for key, values in updated.items():
+            f.write(" ".join([key, *values]) + "\n")
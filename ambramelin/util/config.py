@@ -1,4 +1,6 @@
 import contextlib
+import copy
+import fcntl
 import json
 from collections.abc import Iterator
 from pathlib import Path
@@ -7,6 +9,9 @@ from typing import Optional
 import attr
 import cattr
 
+from ambramelin.util import completion
+from ambramelin.util.files import atomic_write
+
 
 @attr.define
 class User:
@@ -17,13 +22,20 @@ class User:
 class Environment:
     url: str
     user: Optional[str] = None
+    # bytes per second that downloads are limited to, by default
+    limit_rate: Optional[float] = None
+    # name -> fields, in addition to (or instead of) the built-in field presets
+    presets: dict[str, list[str]] = attr.Factory(dict)
+    # path of DICOMweb (WADO-RS) retrieval of a series, relative to the storage API,
+    # which ambra_sdk does not expose (see `ambra study download --method dicomweb`)
+    dicomweb_url: Optional[str] = None
 
 
 @attr.define
 class Config:
     current: Optional[str] = None
-    envs: dict[str, Environment] = {}
-    users: dict[str, User] = {}
+    envs: dict[str, Environment] = attr.Factory(dict)
+    users: dict[str, User] = attr.Factory(dict)
 
 
 def _get_config_path() -> Path:
@@ -32,28 +44,89 @@ def _get_config_path() -> Path:
     return Path("config.json")
 
 
+# the most recently loaded/saved config, along with the identity (inode, mtime, size)
+# of the file it corresponds to
+_cache: Optional[tuple[tuple[int, int, int], Config]] = None
+
+
+def _get_file_identity(file: Path) -> tuple[int, int, int]:
+    stat = file.stat()
+    # a save replaces the file, so the inode changes even if mtime and size do not
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def get_completion_cache_path() -> Path:
+    return _get_config_path().with_name("completion.cache")
+
+
+def get_response_cache_dir() -> Path:
+    return _get_config_path().with_name("cache")
+
+
+def get_jobs_path() -> Path:
+    return _get_config_path().with_name("jobs.sqlite")
+
+
 def load_config() -> Config:
+    global _cache
     file = _get_config_path()
 
-    if file.exists():
+    try:
+        identity = _get_file_identity(file)
+    except FileNotFoundError:
+        return Config()
+
+    if _cache is None or _cache[0] != identity:
         with file.open("r") as f:
-            return cattr.structure(json.loads(f.read()), Config)
+            _cache = identity, cattr.structure(json.loads(f.read()), Config)
 
-    return Config()
+    # callers are free to modify what they are given
+    return copy.deepcopy(_cache[1])
 
 
 def save_config(config: Config) -> None:
+    global _cache
     file = _get_config_path()
 
-    with file.open("w") as f:
+    # write to a temporary file that then replaces the config file, so that readers
+    # never see a partially written config
+    with atomic_write(file, fsync=True) as f:
         f.write(json.dumps(cattr.unstructure(config), indent=2))
 
+    _cache = _get_file_identity(file), copy.deepcopy(config)
+
+    try:
+        completion.update_cache(
+            get_completion_cache_path(), envs=config.envs, users=config.users
+        )
+    except OSError:
+        # completion is a convenience, and must not fail a saved config
+        pass
+
+
+@contextlib.contextmanager
+def _lock_config() -> Iterator[None]:
+    """Holds an exclusive lock, across processes, for the duration of the context."""
+    file = _get_config_path()
+
+    with open(file.with_name(f"{file.name}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
 
 @contextlib.contextmanager
 def update_config() -> Iterator[Config]:
-    config = load_config()
-    yield config
-    save_config(config)
+    with _lock_config():
+        config = load_config()
+        original = cattr.unstructure(config)
+        yield config
+
+        if cattr.unstructure(config) != original:
+            save_config(config)
 
 
 def envs_added(config: Config) -> bool:
@@ -1,9 +1,17 @@
+import json
+import os
+import re
 import subprocess
+import sys
 from abc import ABC, abstractmethod
-from typing import Optional
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 
 from ambramelin.util.errors import AmbramelinError
 
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+
 
 class CredentialManagerError(AmbramelinError):
     pass
@@ -69,7 +77,7 @@ class KeychainManager(CredentialManager):
         except subprocess.CalledProcessError as error:
             raise CredentialManagerError("Failed to set password.") from error
 
-        print(f"Password for '{account}' added to keychain.")
+        print(f"Password for '{account}' added to keychain.", file=sys.stderr)
 
     def del_password(self, account: str) -> None:
         try:
@@ -88,11 +96,204 @@ class KeychainManager(CredentialManager):
         except subprocess.CalledProcessError as error:
             raise CredentialManagerError("Failed to delete password.") from error
 
-        print(f"Password for '{account}' deleted from keychain.")
+        print(f"Password for '{account}' deleted from keychain.", file=sys.stderr)
+
+
+class EncryptedFileManager(CredentialManager):
+    """
+    Stores passwords in a local file, encrypted with a key that is either given by the
+    AMBRAMELIN_CREDENTIALS_KEY envvar or kept in a separate, user-only key file.
+
+    Requires the 'cryptography' package (the 'encryption' extra).
+    """
+
+    def __init__(self) -> None:
+        self._fernet: Optional["Fernet"] = None
+
+    def _get_store_path(self) -> Path:
+        # TODO: belongs elsewhere, along with the config file
+        return Path("credentials.json")
+
+    def _get_key_path(self) -> Path:
+        return Path("credentials.key")
+
+    def _get_fernet(self, create_key: bool = False) -> Optional["Fernet"]:
+        if self._fernet is not None:
+            return self._fernet
+
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError as error:
+            raise CredentialManagerError(
+                "The 'cryptography' package (the 'encryption' extra) is required to "
+                "encrypt credentials."
+            ) from error
+
+        if key := os.environ.get("AMBRAMELIN_CREDENTIALS_KEY"):
+            self._fernet = Fernet(key.encode())
+        elif (key_path := self._get_key_path()).exists():
+            self._fernet = Fernet(key_path.read_bytes())
+        elif create_key:
+            key_path.touch(mode=0o600)
+            key_path.write_bytes(Fernet.generate_key())
+            self._fernet = Fernet(key_path.read_bytes())
+
+        return self._fernet
+
+    def _load(self) -> dict[str, str]:
+        path = self._get_store_path()
+
+        if not path.exists():
+            return {}
+
+        with path.open("r") as f:
+            return json.loads(f.read())
+
+    def _save(self, store: dict[str, str]) -> None:
+        path = self._get_store_path()
+        path.touch(mode=0o600)
+
+        with path.open("w") as f:
+            f.write(json.dumps(store, indent=2))
+
+    def get_password(self, account: str) -> Optional[str]:
+        token = self._load().get(account)
+        fernet = self._get_fernet()
+
+        if token is None or fernet is None:
+            return None
+
+        from cryptography.fernet import InvalidToken
+
+        try:
+            return fernet.decrypt(token.encode()).decode()
+        except InvalidToken:
+            return None
+
+    def set_password(self, account: str, password: str) -> None:
+        fernet = self._get_fernet(create_key=True)
+        assert fernet is not None
+        store = self._load()
+        store[account] = fernet.encrypt(password.encode()).decode()
+        self._save(store)
+        print(
+            f"Password for '{account}' added to {self._get_store_path()}.",
+            file=sys.stderr,
+        )
+
+    def del_password(self, account: str) -> None:
+        store = self._load()
+
+        if account not in store:
+            raise CredentialManagerError("Failed to delete password.")
+
+        del store[account]
+        self._save(store)
+        print(
+            f"Password for '{account}' deleted from {self._get_store_path()}.",
+            file=sys.stderr,
+        )
+
+
+class EnvironmentManager(CredentialManager):
+    """
+    Reads passwords from AMBRAMELIN_PASSWORD_<ACCOUNT> envvars, or from the file named
+    by AMBRAMELIN_PASSWORD_<ACCOUNT>_FILE (e.g. a mounted container secret).
+
+    The account is upper-cased, with every non-alphanumeric character replaced by '_'.
+    """
+
+    def _get_var(self, account: str) -> str:
+        return "AMBRAMELIN_PASSWORD_" + re.sub(r"[^A-Z0-9]", "_", account.upper())
+
+    def get_password(self, account: str) -> Optional[str]:
+        var = self._get_var(account)
+
+        if (password := os.environ.get(var)) is not None:
+            return password
+
+        if path := os.environ.get(f"{var}_FILE"):
+            try:
+                return Path(path).read_text().strip()
+            except OSError:
+                return None
+
+        return None
+
+    def set_password(self, account: str, password: str) -> None:
+        var = self._get_var(account)
+        print(
+            f"Passwords are not stored; set {var} or {var}_FILE for '{account}'.",
+            file=sys.stderr,
+        )
+
+    def del_password(self, account: str) -> None:
+        pass
+
+
+class DockerCredentialHelperManager(CredentialManager):
+    """
+    Uses a docker credential helper, i.e. a `docker-credential-<helper>` executable, as
+    the store (see https://github.com/docker/docker-credential-helpers).
+    """
+
+    def __init__(self, helper: str) -> None:
+        self.helper = helper
+
+    def _run(self, action: str, data: str) -> str:
+        try:
+            res = subprocess.run(
+                [f"docker-credential-{self.helper}", action],
+                input=data.encode(),
+                check=True,
+                capture_output=True,
+            )
+        except (subprocess.CalledProcessError, FileNotFoundError) as error:
+            raise CredentialManagerError(
+                f"docker-credential-{self.helper} {action} failed."
+            ) from error
+        else:
+            return res.stdout.decode()
+
+    def _get_server_url(self, account: str) -> str:
+        return f"ambramelin://{account}"
+
+    def get_password(self, account: str) -> Optional[str]:
+        try:
+            res = self._run("get", self._get_server_url(account))
+        except CredentialManagerError:
+            return None
+        else:
+            return json.loads(res)["Secret"]
+
+    def set_password(self, account: str, password: str) -> None:
+        self._run(
+            "store",
+            json.dumps(
+                {
+                    "ServerURL": self._get_server_url(account),
+                    "Username": account,
+                    "Secret": password,
+                }
+            ),
+        )
+        print(
+            f"Password for '{account}' added to docker-credential-{self.helper}.",
+            file=sys.stderr,
+        )
+
+    def del_password(self, account: str) -> None:
+        self._run("erase", self._get_server_url(account))
+        print(
+            f"Password for '{account}' deleted from docker-credential-{self.helper}.",
+            file=sys.stderr,
+        )
 
 
-# TODO: add other managers
-#  https://docs.docker.com/engine/reference/commandline/login/#credentials-store
 managers = {
     "keychain": KeychainManager(),
+    "file": EncryptedFileManager(),
+    "env": EnvironmentManager(),
+    "docker-pass": DockerCredentialHelperManager("pass"),
+    "docker-secretservice": DockerCredentialHelperManager("secretservice"),
 }
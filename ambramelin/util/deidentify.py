@@ -0,0 +1,109 @@
+"""
+De-identification of DICOM instances as they are downloaded, according to a profile
+(see `ambra study download --deidentify`).
+"""
+
+import json
+from io import BytesIO
+from pathlib import Path
+
+import attr
+import cattr
+import pydicom
+from pydicom.dataelem import DataElement
+from pydicom.dataset import Dataset
+from pydicom.errors import InvalidDicomError
+from pydicom.tag import BaseTag, Tag
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+
+from ambramelin.util.errors import InvalidArgumentsError, MalformedResponseError
+
+PIXEL_DATA = Tag("PixelData")
+
+
+@attr.define
+class Profile:
+    # tag -> value it is replaced with, where present
+    replace: dict[str, str] = attr.Factory(dict)
+    remove: list[str] = attr.Factory(list)
+    remove_private: bool = False
+
+
+def _get_tag(name: str) -> BaseTag:
+    """Returns the tag of a keyword (e.g. "PatientName") or hex tag ("00100010")."""
+    try:
+        return Tag(name)
+    except ValueError:
+        raise InvalidArgumentsError(f"'{name}' is not a DICOM keyword or tag.")
+
+
+def load_profile(path: Path) -> Profile:
+    try:
+        with path.open("r") as f:
+            profile = cattr.structure(json.load(f), Profile)
+    except (OSError, ValueError, TypeError) as e:
+        raise InvalidArgumentsError(f"Invalid de-identification profile: {e}")
+
+    # fail before downloading anything, rather than on the first instance
+    for name in [*profile.replace, *profile.remove]:
+        _get_tag(name)
+
+    return profile
+
+
+def _apply(dataset: Dataset, profile: Profile) -> None:
+    replace = {_get_tag(name): value for name, value in profile.replace.items()}
+    remove = {_get_tag(name) for name in profile.remove}
+
+    def callback(ds: Dataset, elem: DataElement) -> None:
+        if elem.tag in remove or (profile.remove_private and elem.tag.is_private):
+            del ds[elem.tag]
+        elif elem.tag in replace:
+            elem.value = replace[elem.tag]
+        elif elem.tag.element == 0 and elem.tag.group > 2:
+            # (retired) group lengths would no longer be right
+            del ds[elem.tag]
+
+    # including the datasets of sequences
+    dataset.walk(callback)
+
+
+def deidentify(data: bytes, profile: Profile) -> bytes:
+    """
+    Returns a DICOM instance with its header rewritten according to `profile`.
+
+    Only the header, which comes before the pixel data, is decoded and re-encoded; the
+    pixel data (and anything after it) is copied through as it is, unless the profile
+    removes private tags or matches tags after the pixel data (which some instances
+    have, e.g. in group 7FE1), in which case the whole instance is. Tags are matched
+    in sequences too, but the pixel data is not searched (e.g. for burnt-in text).
+    """
+    fp = BytesIO(data)
+
+    try:
+        dataset = pydicom.dcmread(fp, stop_before_pixels=True)
+    except (InvalidDicomError, ValueError, EOFError, OSError):
+        raise MalformedResponseError("not a DICOM instance")
+
+    tags = {_get_tag(name) for name in [*profile.replace, *profile.remove]}
+
+    # the pixel data is deflated along with the header, so cannot be set aside
+    deflated = (
+        dataset.file_meta.get("TransferSyntaxUID") == DeflatedExplicitVRLittleEndian
+    )
+    # tags after the pixel data are copied through unless the whole instance is read
+    after_pixels = profile.remove_private or any(tag > PIXEL_DATA for tag in tags)
+
+    if deflated or after_pixels:
+        dataset = pydicom.dcmread(BytesIO(data))
+        pixels_offset = len(data)
+    else:
+        # where reading stopped, before the pixel data
+        pixels_offset = fp.tell()
+
+    _apply(dataset, profile)
+
+    out = BytesIO()
+    dataset.save_as(out, write_like_original=True)
+    out.write(memoryview(data)[pixels_offset:])
+    return out.getvalue()
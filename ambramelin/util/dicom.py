@@ -0,0 +1,43 @@
+import zipfile
+from collections.abc import Iterator
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+import pydicom
+from pydicom.errors import InvalidDicomError
+
+
+def read_sop_instance_uid(data: bytes) -> Optional[str]:
+    """Returns the SOP Instance UID of a DICOM instance, or None if it is not one."""
+    try:
+        dataset = pydicom.dcmread(
+            BytesIO(data),
+            stop_before_pixels=True,
+            specific_tags=["SOPInstanceUID"],
+            force=True,
+        )
+    except (InvalidDicomError, ValueError, EOFError, OSError):
+        return None
+
+    return dataset.get("SOPInstanceUID")
+
+
+def iter_files(path: Path) -> Iterator[tuple[str, bytes]]:
+    """
+    Yields the (name, contents) of every file in a directory (recursively) or zip
+    archive.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    yield info.filename, zf.read(info)
+
+    elif path.is_dir():
+        for file in sorted(path.rglob("*")):
+            if file.is_file():
+                yield str(file.relative_to(path)), file.read_bytes()
+
+    else:
+        yield path.name, path.read_bytes()
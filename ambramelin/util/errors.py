@@ -7,6 +7,16 @@ class AmbramelinError(Exception):
     pass
 
 
+class AgentAlreadyRunningError(AmbramelinError):
+    def __init__(self) -> None:
+        super().__init__("Agent already running.")
+
+
+class AgentNotRunningError(AmbramelinError):
+    def __init__(self) -> None:
+        super().__init__("Agent not running.")
+
+
 class EnvironmentAlreadyExistsError(AmbramelinError):
     def __init__(self, env: str) -> None:
         super().__init__(f"Environment '{env}' already exists.")
@@ -19,6 +29,16 @@ class EnvironmentNotFoundError(AmbramelinError):
         )
 
 
+class InsecureAgentDirectoryError(AmbramelinError):
+    def __init__(self, path: str, reason: str) -> None:
+        super().__init__(f"Refusing to use '{path}' for the agent's socket: {reason}.")
+
+
+class InvalidBundleError(AmbramelinError):
+    def __init__(self, file: str, reason: str) -> None:
+        super().__init__(f"'{file}' is not a valid bundle: {reason}.")
+
+
 class InvalidFilterConditionError(AmbramelinError):
     def __init__(self, condition: str) -> None:
         super().__init__(
@@ -27,6 +47,16 @@ class InvalidFilterConditionError(AmbramelinError):
         )
 
 
+class MalformedResponseError(AmbramelinError):
+    def __init__(self, reason: str) -> None:
+        super().__init__(f"Malformed response: {reason}.")
+
+
+class MetricsServerError(AmbramelinError):
+    def __init__(self, port: int, reason: str) -> None:
+        super().__init__(f"Cannot serve metrics on port {port}: {reason}.")
+
+
 class NoEnvironmentsError(AmbramelinError):
     def __init__(self) -> None:
         super().__init__("No environments added.")
@@ -42,6 +72,14 @@ class NoUsersError(AmbramelinError):
         super().__init__("No users added.")
 
 
+class PromptNotAllowedError(AmbramelinError):
+    def __init__(self, msg: str) -> None:
+        super().__init__(
+            f"Cannot ask '{msg}' when running non-interactively; pass '--yes' to "
+            "answer 'yes'."
+        )
+
+
 class UserAlreadyExistsError(AmbramelinError):
     def __init__(self, user: str) -> None:
         super().__init__(f"Used '{user}' already exists.")
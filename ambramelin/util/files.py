@@ -0,0 +1,39 @@
+import contextlib
+import os
+import tempfile
+from collections.abc import Iterator
+from pathlib import Path
+from typing import IO, Any, Optional
+
+
+@contextlib.contextmanager
+def atomic_write(
+    path: Path,
+    mode: str = "w",
+    fsync: bool = False,
+    permissions: Optional[int] = None,
+) -> Iterator[IO[Any]]:
+    """
+    Yields a temporary file that replaces `path` once it is written, so that readers
+    never see a partly written file; it is removed if writing or replacing fails.
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+        if permissions is not None:
+            # rather than mkstemp's 0o600
+            os.chmod(tmp, permissions)
+
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+
+        raise
@@ -1,10 +1,39 @@
+import threading
+
+from ambramelin.util.errors import PromptNotAllowedError
+
+# prompts may be issued from several threads at once (e.g. when fanning out to
+# multiple environments), so they are answered one at a time
+_lock = threading.Lock()
+_assume_yes = False
+# whether anyone is around to answer prompts (not, e.g., in batches)
+_interactive = True
+
+
+def set_assume_yes(assume_yes: bool) -> None:
+    global _assume_yes
+    _assume_yes = assume_yes
+
+
+def set_interactive(interactive: bool) -> None:
+    global _interactive
+    _interactive = interactive
+
+
 def bool_prompt(msg: str) -> bool:
-    while True:
-        response = input(f"{msg} [y/n]: ").lower()
-
-        if response == "y":
-            return True
-        elif response == "n":
-            return False
-        else:
-            print(f"'{response}' is an invalid option.")
+    if _assume_yes:
+        return True
+
+    if not _interactive:
+        raise PromptNotAllowedError(msg)
+
+    with _lock:
+        while True:
+            response = input(f"{msg} [y/n]: ").lower()
+
+            if response == "y":
+                return True
+            elif response == "n":
+                return False
+            else:
+                print(f"'{response}' is an invalid option.")
@@ -0,0 +1,134 @@
+"""
+Hashing of downloads as they are written, so that they need not be read back to be
+hashed.
+
+A download's digest is recorded, along with its size, modification time and how long
+it took, in a sidecar manifest named after it (e.g. 'study.zip.manifest.json'). That
+a file is unchanged since can be told from its size and modification time alone,
+while verifying its digest (see `verify`) is a separate pass over it: files are not
+verified as they are read, as the bundle commands read them with random access (see
+`ambramelin.util.bundle`) rather than front to back.
+"""
+
+import datetime
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any, BinaryIO, Optional
+
+from ambramelin.util.files import atomic_write
+
+ALGORITHMS = ("sha256", "blake2b")
+
+
+def get_manifest_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.manifest.json")
+
+
+def read_manifest(path: Path) -> Optional[dict]:
+    """Returns the manifest of the file at `path`, if it has one."""
+    try:
+        with get_manifest_path(path).open("r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    return manifest if manifest.get("algorithm") in ALGORITHMS else None
+
+
+class HashingWriter:
+    """
+    Wraps a file, hashing what is written to it.
+
+    The wrapper is deliberately not seekable, so that writers that would otherwise
+    seek back to patch what they wrote (e.g. `zipfile`) write strictly sequentially.
+    """
+
+    def __init__(self, f: BinaryIO, algorithm: str) -> None:
+        self._f = f
+        self._hash = hashlib.new(algorithm)
+        self._started = datetime.datetime.now(datetime.timezone.utc)
+        self._start = time.monotonic()
+        self.algorithm = algorithm
+        self.bytes = 0
+
+    def write(self, data: bytes) -> int:
+        self._hash.update(data)
+        self.bytes += len(data)
+        return self._f.write(data)
+
+    def tell(self) -> int:
+        return self.bytes
+
+    def flush(self) -> None:
+        self._f.flush()
+
+    def get_manifest(self, file: str) -> dict[str, Any]:
+        seconds = time.monotonic() - self._start
+        return {
+            "file": file,
+            "algorithm": self.algorithm,
+            "digest": self._hash.hexdigest(),
+            "bytes": self.bytes,
+            "started": self._started.isoformat(timespec="seconds"),
+            "seconds": round(seconds, 3),
+            "bytes_per_sec": round(self.bytes / seconds) if seconds else None,
+        }
+
+
+def write_manifest(path: Path, manifest: dict[str, Any]) -> None:
+    """Writes the manifest of the (complete) file at `path`."""
+    manifest = {**manifest, "mtime_ns": path.stat().st_mtime_ns}
+    manifest_path = get_manifest_path(path)
+
+    # replaced atomically, so that an interrupted write never leaves a manifest that
+    # does not describe its file
+    with atomic_write(manifest_path) as f:
+        json.dump(manifest, f, indent=1)
+
+
+def is_unchanged(path: Path) -> bool:
+    """
+    Returns whether the file at `path` has the size and modification time recorded in
+    its manifest (if it has one), i.e. whether it was not modified since it was
+    written, without reading it.
+    """
+    manifest = read_manifest(path)
+
+    if manifest is None:
+        return False
+
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return False
+
+    return (stat.st_size, stat.st_mtime_ns) == (
+        manifest["bytes"],
+        manifest.get("mtime_ns"),
+    )
+
+
+def verify(path: Path, chunk_size: int = 1024 * 1024) -> bool:
+    """
+    Returns whether the file at `path` matches the digest in its manifest (if it has
+    one), which takes reading all of it.
+    """
+    manifest = read_manifest(path)
+
+    if manifest is None:
+        return False
+
+    hash = hashlib.new(manifest["algorithm"])
+    size = 0
+
+    try:
+        with path.open("rb") as f:
+            while chunk := f.read(chunk_size):
+                hash.update(chunk)
+                size += len(chunk)
+    except FileNotFoundError:
+        return False
+
+    return (size, hash.hexdigest()) == (manifest["bytes"], manifest["digest"])
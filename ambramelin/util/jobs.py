@@ -0,0 +1,189 @@
+"""
+A durable queue of study download tasks, kept in a local SQLite database so that
+it survives crashes and reboots (see `ambra jobs`).
+
+A task is "pending" until a worker claims it, "running" while it is being
+downloaded, and then either "done" or, once it has failed `max_attempts` times,
+"failed". A running task is leased to the process running it, which renews the lease
+while it runs; a task whose lease expired (e.g. because its process crashed, or the
+machine rebooted) is pending again.
+"""
+
+import contextlib
+import sqlite3
+import time
+import uuid
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any, Optional
+
+import attr
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, RUNNING, DONE, FAILED)
+
+# seconds a running task is leased for, without being renewed
+LEASE = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    env TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    dest TEXT NOT NULL,
+    bundle TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    -- bytes downloaded by the latest attempt
+    bytes INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    -- queue (i.e. process) running the task, which renews its lease through `updated`
+    owner TEXT,
+    updated REAL NOT NULL,
+    UNIQUE (env, uuid, dest)
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, id);
+"""
+
+
+@attr.define
+class Task:
+    id: int
+    env: str
+    uuid: str
+    dest: str
+    bundle: str
+    attempts: int
+
+
+class JobQueue:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # rather than the PID, which a process may reuse (e.g. after a reboot)
+        self.owner = uuid.uuid4().hex
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # a connection per operation, so that the queue can be used from any thread
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connect() as conn:
+            # takes the write lock up front, so that concurrent claims do not race
+            conn.execute("BEGIN IMMEDIATE")
+
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+            conn.execute("COMMIT")
+
+    def add(self, env: str, uuids: Iterable[str], dest: str, bundle: str) -> int:
+        """Adds a task per study, unless it was added before; returns how many were."""
+        with self._transaction() as conn:
+            return conn.executemany(
+                "INSERT OR IGNORE INTO tasks (env, uuid, dest, bundle, updated) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((env, uuid, dest, bundle, time.time()) for uuid in uuids),
+            ).rowcount
+
+    def recover(self) -> int:
+        """Makes running tasks whose lease expired pending again."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE tasks SET state = ?, owner = NULL "
+                "WHERE state = ? AND updated < ?",
+                (PENDING, RUNNING, time.time() - LEASE),
+            ).rowcount
+
+    def renew(self) -> None:
+        """Renews the lease of the tasks this queue is running."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET updated = ? WHERE state = ? AND owner = ?",
+                (time.time(), RUNNING, self.owner),
+            )
+
+    def retry_failed(self) -> int:
+        """Makes failed tasks pending again, with their attempts reset."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE tasks SET state = ?, attempts = 0 WHERE state = ?",
+                (PENDING, FAILED),
+            ).rowcount
+
+    def claim(self) -> Optional[Task]:
+        """Marks the oldest pending task as running in this process, and returns it."""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, env, uuid, dest, bundle, attempts FROM tasks "
+                "WHERE state = ? ORDER BY id LIMIT 1",
+                (PENDING,),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            task = Task(*row)
+            task.attempts += 1
+            conn.execute(
+                "UPDATE tasks SET state = ?, attempts = ?, owner = ?, updated = ? "
+                "WHERE id = ?",
+                (RUNNING, task.attempts, self.owner, time.time(), task.id),
+            )
+
+        return task
+
+    def _finish(self, task: Task, state: str, bytes_: int, error: Any) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET state = ?, bytes = ?, error = ?, owner = NULL, "
+                "updated = ? WHERE id = ?",
+                (state, bytes_, error, time.time(), task.id),
+            )
+
+    def complete(self, task: Task, bytes_: int) -> None:
+        self._finish(task, DONE, bytes_, None)
+
+    def fail(self, task: Task, bytes_: int, error: str, max_attempts: int) -> None:
+        """Records a failed attempt, leaving the task pending if it may be retried."""
+        state = FAILED if task.attempts >= max_attempts else PENDING
+        self._finish(task, state, bytes_, error)
+
+    def get_status(self) -> dict[str, Any]:
+        with self._connect() as conn:
+            counts = dict(
+                conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state")
+            )
+            (bytes_,) = conn.execute(
+                "SELECT COALESCE(SUM(bytes), 0) FROM tasks"
+            ).fetchone()
+            failures = [
+                {"env": env, "uuid": uuid, "attempts": attempts, "error": error}
+                for env, uuid, attempts, error in conn.execute(
+                    "SELECT env, uuid, attempts, error FROM tasks WHERE state = ? "
+                    "ORDER BY id",
+                    (FAILED,),
+                )
+            ]
+
+        return {
+            **{state: counts.get(state, 0) for state in STATES},
+            "bytes": bytes_,
+            "failures": failures,
+        }
@@ -0,0 +1,304 @@
+"""
+Client-side metrics (command durations, HTTP requests, bytes downloaded, cache use),
+exported in the OpenMetrics text format either as a file, e.g. for node-exporter's
+textfile collector, or from a local scrape endpoint while a command runs (see the
+global `--metrics-file` and `--metrics-port` options).
+
+Metrics are kept per process, so a file describes the run that wrote it, and are
+labelled with the environment they were recorded for, so that the environments of a
+run (see `--envs`) are told apart.
+"""
+
+import contextlib
+import contextvars
+import math
+import re
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from ambramelin.util.errors import MetricsServerError
+from ambramelin.util.files import atomic_write
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600)
+
+# name -> (type, unit, help, buckets)
+FAMILIES: dict[str, tuple[str, str, str, tuple[float, ...]]] = {
+    "ambra_command_duration_seconds": (
+        "histogram",
+        "seconds",
+        "Duration of commands, by command and outcome.",
+        DURATION_BUCKETS,
+    ),
+    "ambra_http_requests": (
+        "counter",
+        "",
+        "HTTP requests made, by endpoint, method and status.",
+        (),
+    ),
+    "ambra_http_request_duration_seconds": (
+        "histogram",
+        "seconds",
+        "Time until the response headers of HTTP requests arrived, by endpoint.",
+        LATENCY_BUCKETS,
+    ),
+    "ambra_http_retries": (
+        "counter",
+        "",
+        "HTTP requests retried (e.g. on connection errors), by endpoint.",
+        (),
+    ),
+    "ambra_downloaded_bytes": ("counter", "bytes", "Bytes of studies downloaded.", ()),
+    "ambra_cache_requests": (
+        "counter",
+        "",
+        "Requests for cached responses, by endpoint and result (hit, revalidated or "
+        "miss).",
+        (),
+    ),
+}
+
+_Labels = tuple[tuple[str, str], ...]
+
+# the environment recorded as a label: the run's (see `set_env`), unless a context
+# records another (see `recording_env`); the run's is global rather than a context
+# variable so that threads started by commands see it too
+_env: Optional[str] = None
+_context_env: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "metrics_env", default=None
+)
+
+_lock = threading.Lock()
+_counters: dict[tuple[str, _Labels], float] = {}
+# (name, labels) -> (bucket counts, count, sum)
+_histograms: dict[tuple[str, _Labels], tuple[list[int], int, float]] = {}
+
+# path segments that identify something (UUIDs, DICOM UIDs, numeric IDs), replaced
+# so as not to create an endpoint per study
+_ID_RE = re.compile(r"^([0-9a-fA-F]{8}-[0-9a-fA-F-]{27}|[0-9]+(\.[0-9]+)*)$")
+
+
+def set_env(name: Optional[str]) -> None:
+    global _env
+    _env = name
+
+
+@contextlib.contextmanager
+def recording_env(name: str) -> Iterator[None]:
+    token = _context_env.set(name)
+
+    try:
+        yield
+    finally:
+        _context_env.reset(token)
+
+
+def _get_key(name: str, labels: dict[str, str]) -> tuple[str, _Labels]:
+    env = _context_env.get() or _env
+
+    if env is not None:
+        labels = {**labels, "env": env}
+
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels: str) -> None:
+    key = _get_key(name, labels)
+
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    key = _get_key(name, labels)
+    buckets = FAMILIES[name][3]
+
+    with _lock:
+        counts, count, total = _histograms.get(key, ([0] * len(buckets), 0, 0.0))
+
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                counts[index] += 1
+
+        _histograms[key] = counts, count + 1, total + value
+
+
+def reset() -> None:
+    set_env(None)
+
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _format_labels(labels: _Labels, *extra: tuple[str, str]) -> str:
+    if not labels and not extra:
+        return ""
+
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in (*labels, *extra)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _format_bound(bound: float) -> str:
+    # OpenMetrics requires the canonical text of floats for 'le', e.g. "1.0"
+    return "+Inf" if math.isinf(bound) else repr(float(bound))
+
+
+def render() -> str:
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(c), n, s) for key, (c, n, s) in _histograms.items()}
+
+    lines = []
+
+    for name, (type_, unit, help_, buckets) in FAMILIES.items():
+        lines.append(f"# TYPE {name} {type_}")
+
+        if unit:
+            lines.append(f"# UNIT {name} {unit}")
+
+        lines.append(f"# HELP {name} {help_}")
+
+        if type_ == "counter":
+            for (family, labels), value in sorted(counters.items()):
+                if family == name:
+                    lines.append(
+                        f"{name}_total{_format_labels(labels)} {_format_value(value)}"
+                    )
+        else:
+            for (family, labels), (counts, count, total) in sorted(histograms.items()):
+                if family != name:
+                    continue
+
+                for bound, bucket_count in zip((*buckets, math.inf), (*counts, count)):
+                    bucket_labels = _format_labels(labels, ("le", _format_bound(bound)))
+                    lines.append(f"{name}_bucket{bucket_labels} {bucket_count}")
+
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total!r}")
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: Path) -> None:
+    # replaced atomically, so that a collector never reads a partial file
+    with atomic_write(path, permissions=0o644) as f:
+        f.write(render())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # scrapes would otherwise be logged to stderr
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serves metrics on http://host:port/metrics from a background thread."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@contextlib.contextmanager
+def exporting(path: Optional[Path], port: Optional[int]) -> Iterator[None]:
+    server = None
+
+    if port is not None:
+        try:
+            server = serve(port)
+        except OSError as e:
+            # e.g. the port is in use
+            raise MetricsServerError(port, e.strerror or str(e))
+
+    try:
+        yield
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+        if path is not None:
+            write_textfile(path)
+
+
+@contextlib.contextmanager
+def timing_command(command: str) -> Iterator[None]:
+    start = time.monotonic()
+    outcome = "error"
+
+    try:
+        yield
+        outcome = "ok"
+    except SystemExit as e:
+        if not e.code:
+            outcome = "ok"
+
+        raise
+    finally:
+        observe(
+            "ambra_command_duration_seconds",
+            time.monotonic() - start,
+            command=command,
+            outcome=outcome,
+        )
+
+
+def get_endpoint(url: str) -> str:
+    """Returns the path of a URL, with identifiers replaced by '{id}'."""
+    segments = urlsplit(url).path.split("/")
+    return "/".join("{id}" if _ID_RE.match(s) else s for s in segments)
+
+
+def _record_response(response: requests.Response, *args: Any, **kwargs: Any) -> None:
+    endpoint = get_endpoint(response.url)
+    inc(
+        "ambra_http_requests",
+        endpoint=endpoint,
+        method=response.request.method or "",
+        status=str(response.status_code),
+    )
+    observe(
+        "ambra_http_request_duration_seconds",
+        response.elapsed.total_seconds(),
+        endpoint=endpoint,
+    )
+    # retries made by urllib3 (see `Retry`) before this response
+    retries = getattr(getattr(response.raw, "retries", None), "history", None)
+
+    if retries:
+        inc("ambra_http_retries", len(retries), endpoint=endpoint)
+
+
+def instrument(session: requests.Session) -> None:
+    """Records the requests made with a session."""
+    if _record_response not in session.hooks["response"]:
+        session.hooks["response"].append(_record_response)
@@ -0,0 +1,99 @@
+"""
+Incremental parsing of multipart responses (RFC 2046), such as DICOMweb's
+`multipart/related; type="application/dicom"`.
+"""
+
+from collections.abc import Iterable, Iterator
+from email.message import Message
+from typing import Optional
+
+from ambramelin.util.errors import MalformedResponseError
+
+
+def get_boundary(content_type: str) -> bytes:
+    message = Message()
+    message["content-type"] = content_type
+    boundary = message.get_param("boundary")
+
+    if not isinstance(boundary, str) or message.get_content_maintype() != "multipart":
+        raise MalformedResponseError(f"not a multipart response ('{content_type}')")
+
+    return boundary.encode()
+
+
+class _Reader:
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        # the first delimiter need not be preceded by a line break
+        self._buffer = bytearray(b"\r\n")
+
+    def read_until(self, separator: bytes) -> Optional[bytes]:
+        """
+        Returns the bytes up to the next `separator`, consuming both, or None if the
+        chunks run out first.
+        """
+        start = 0
+
+        while True:
+            index = self._buffer.find(separator, start)
+
+            if index != -1:
+                data = bytes(self._buffer[:index])
+                del self._buffer[: index + len(separator)]
+                return data
+
+            # only search the bytes that could not already be ruled out
+            start = max(len(self._buffer) - len(separator) + 1, 0)
+            chunk = next(self._chunks, None)
+
+            if chunk is None:
+                return None
+
+            self._buffer += chunk
+
+    def read_rest(self) -> bytes:
+        """Returns the bytes left once the chunks have run out."""
+        return bytes(self._buffer)
+
+
+def iter_parts(
+    chunks: Iterable[bytes], boundary: bytes
+) -> Iterator[tuple[dict[str, str], bytes]]:
+    """
+    Yields the (headers, body) of each part of a multipart body as soon as the part
+    has been received, so that only one part is held in memory at a time. Header
+    names are lowercased.
+    """
+    reader = _Reader(chunks)
+    delimiter = b"\r\n--" + boundary
+
+    # the preamble
+    if reader.read_until(delimiter) is None:
+        raise MalformedResponseError("no multipart boundary")
+
+    while True:
+        line = reader.read_until(b"\r\n")
+
+        if line is None:
+            # the close delimiter need not be followed by a line break either
+            line = reader.read_rest()
+
+        if line.startswith(b"--"):
+            # the close delimiter; the epilogue is ignored
+            return
+
+        headers = {}
+
+        while line := reader.read_until(b"\r\n"):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if line is None:
+            raise MalformedResponseError("truncated multipart body")
+
+        body = reader.read_until(delimiter)
+
+        if body is None:
+            raise MalformedResponseError("truncated multipart body")
+
+        yield headers, body
@@ -0,0 +1,68 @@
+import argparse
+import re
+import threading
+import time
+from typing import Optional
+
+_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+# bytes reserved at a time, so that concurrent consumers take turns at the budget
+QUANTUM = 64 * 1024
+
+_limiters: dict[tuple[str, float], "RateLimiter"] = {}
+_limiters_lock = threading.Lock()
+
+
+def parse_rate(value: str) -> float:
+    """Parses a rate in bytes per second, with an optional k/m/g suffix (e.g. 500k)."""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([kmg]?)", value.strip().lower())
+
+    if match is None:
+        raise argparse.ArgumentTypeError(
+            f"invalid rate: '{value}' (e.g. 800000, 500k or 2m)"
+        )
+
+    return float(match[1]) * _UNITS[match[2]]
+
+
+class RateLimiter:
+    """
+    A token bucket, filled at `rate` bytes per second and holding up to `burst` bytes.
+
+    Tokens are handed out in the order they are asked for (as with GCRA), so threads
+    sharing a limiter get an equal share of its rate.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        # allow up to a quarter of a second's worth of bytes through at once
+        self.burst = max(burst if burst is not None else rate / 4, QUANTUM)
+        self._lock = threading.Lock()
+        # time at which the bucket will have been refilled
+        self._full_at = time.monotonic()
+
+    def consume(self, amount: int) -> None:
+        """Blocks until `amount` bytes may be transferred."""
+        for start in range(0, amount, QUANTUM):
+            self._consume(min(QUANTUM, amount - start))
+
+    def _consume(self, amount: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._full_at = max(self._full_at, now) + amount / self.rate
+            delay = self._full_at - now - self.burst / self.rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def get_limiter(env: str, rate: float) -> RateLimiter:
+    """
+    Returns the limiter shared by all transfers from `env` at `rate` within this
+    process, so that concurrent downloads split the rate rather than each using it.
+    """
+    with _limiters_lock:
+        if (env, rate) not in _limiters:
+            _limiters[env, rate] = RateLimiter(rate)
+
+        return _limiters[env, rate]
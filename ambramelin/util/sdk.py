@@ -1,20 +1,144 @@
+import contextlib
+import contextvars
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Optional
+
+import requests
 from ambra_sdk.api import Api
+from ambra_sdk.exceptions.base import AmbraException
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+from ambramelin.util import agent, credentials, metrics
+from ambramelin.util.config import Config, env_exists, env_selected, load_config
+from ambramelin.util.errors import (
+    AmbramelinError,
+    EnvironmentNotFoundError,
+    NoEnvironmentSelectedError,
+)
+
+# environment to use instead of the current one; set per thread by `using_env`
+_env: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "env", default=None
+)
+
+# `Api` per environment, shared by all `get_api` calls within `shared_apis`
+_apis: Optional[dict[str, Api]] = None
+_apis_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def shared_apis() -> Iterator[None]:
+    """
+    Makes `get_api` return the same `Api` for an environment every time, so that
+    commands run in the same process share one login and connection pool.
+    """
+    global _apis
+    _apis = {}
+
+    try:
+        yield
+    finally:
+        _apis = None
+
+
+@contextlib.contextmanager
+def using_env(name: str) -> Iterator[None]:
+    """Makes `get_api` use the given environment instead of the current one."""
+    token = _env.set(name)
+
+    try:
+        with metrics.recording_env(name):
+            yield
+    finally:
+        _env.reset(token)
+
+
+def fan_out(
+    fn: Callable[[], Any], envs: Iterable[str]
+) -> Iterator[tuple[str, Any, Optional[Exception]]]:
+    """
+    Calls `fn` concurrently once per environment, yielding (env, result, error) as
+    each call completes so that a slow environment does not hold up the others, nor
+    one failing (e.g. being unreachable) the others.
+    """
+
+    def call(name: str) -> Any:
+        with using_env(name):
+            return fn()
+
+    envs = list(envs)
+
+    with ThreadPoolExecutor(max(len(envs), 1)) as executor:
+        futures = {executor.submit(call, name): name for name in envs}
 
-from ambramelin.util import credentials
-from ambramelin.util.config import env_selected, load_config
-from ambramelin.util.errors import NoEnvironmentSelectedError
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except (AmbramelinError, AmbraException, requests.RequestException) as e:
+                yield futures[future], None, e
+
+
+def get_env_name() -> str:
+    """Returns the name of the environment that `get_api` uses."""
+    config = load_config()
+    name = _env.get()
+
+    if name is None:
+        if not env_selected(config):
+            raise NoEnvironmentSelectedError()
+
+        assert config.current is not None
+        return config.current
+
+    if not env_exists(config, name):
+        raise EnvironmentNotFoundError(name, config)
+
+    return name
 
 
 def get_api() -> Api:
     config = load_config()
+    name = get_env_name()
 
-    if not env_selected(config):
-        raise NoEnvironmentSelectedError()
+    if _apis is None:
+        return _create_api(config, name)
 
-    assert config.current is not None
-    env = config.envs[config.current]
+    with _apis_lock:
+        if name not in _apis:
+            _apis[name] = _create_api(config, name)
+
+        return _apis[name]
+
+
+def _create_api(config: Config, name: str) -> Api:
+    env = config.envs[name]
 
     assert env.user is not None
-    cred_manager = credentials.managers[config.users[env.user].credentials_manager]
+    password = agent.get_password(env.user)
+
+    if password is None:
+        cred_manager = credentials.managers[config.users[env.user].credentials_manager]
+        password = cred_manager.get_password(env.user)
+
+        if password is not None:
+            agent.set_password(env.user, password)
+
+    api = Api(env.url, username=env.user, password=password)
+    metrics.instrument(api.service_session)
+    metrics.instrument(api.storage_session)
+    return api
+
 
-    return Api(env.url, username=env.user, password=cred_manager.get_password(env.user))
+def set_storage_pool_size(api: Api, size: int) -> None:
+    """
+    Allows up to `size` keep-alive connections per storage engine, so that that many
+    concurrent Storage API requests do not have to open (and discard) connections.
+    """
+    adapter = HTTPAdapter(
+        pool_maxsize=size, max_retries=Retry(**api.storage_retry_params)
+    )
+    api.storage_session.mount("http://", adapter)
+    api.storage_session.mount("https://", adapter)
@@ -0,0 +1,134 @@
+"""
+Aggregates that are computed incrementally, a value at a time, in constant memory
+(see `ambra study stats`).
+"""
+
+import hashlib
+import math
+import random
+from collections import Counter
+from typing import Any, Optional
+
+
+class Summary:
+    """Count, sum, min, max and mean of numeric values."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum: float = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def result(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count if self.count else None,
+        }
+
+
+class Histogram:
+    """
+    Counts of values, of which only the first `max_buckets` distinct ones (if given)
+    are counted individually; the rest are counted together, as "(other)".
+    """
+
+    OTHER = "(other)"
+
+    def __init__(self, max_buckets: Optional[int] = 1000) -> None:
+        self.max_buckets = max_buckets
+        self.counts: Counter = Counter()
+        self.other = 0
+
+    def add(self, value: Any) -> None:
+        key = str(value)
+
+        full = self.max_buckets is not None and len(self.counts) >= self.max_buckets
+
+        if key in self.counts or not full:
+            self.counts[key] += 1
+        else:
+            self.other += 1
+
+    def result(self) -> dict[str, int]:
+        result = dict(sorted(self.counts.items()))
+
+        if self.other:
+            result[self.OTHER] = self.other
+
+        return result
+
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct values, with a standard error of about
+    1.04 / sqrt(2 ** precision) (0.8% for the default precision), using 2 ** precision
+    bytes.
+    """
+
+    def __init__(self, precision: int = 14) -> None:
+        self.precision = precision
+        self.registers = bytearray(2**precision)
+
+    def add(self, value: Any) -> None:
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, "big")
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        # position of the leftmost 1 bit among the remaining bits
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        self.registers[index] = max(self.registers[index], rank)
+
+    def result(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+
+        return round(estimate)
+
+
+class Quantiles:
+    """
+    Estimates quantiles of numeric values from a uniform random sample of at most
+    `sample_size` of them (reservoir sampling).
+    """
+
+    def __init__(self, quantiles: tuple[float, ...] = (0.5, 0.9, 0.99)) -> None:
+        self.quantiles = quantiles
+        self.sample_size = 10000
+        self.sample: list[float] = []
+        self.count = 0
+        self._random = random.Random(0)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+
+        if len(self.sample) < self.sample_size:
+            self.sample.append(value)
+        else:
+            index = self._random.randrange(self.count)
+
+            if index < self.sample_size:
+                self.sample[index] = value
+
+    def result(self) -> dict[str, Optional[float]]:
+        sample = sorted(self.sample)
+        return {
+            f"p{q * 100:g}": (
+                sample[min(int(q * len(sample)), len(sample) - 1)] if sample else None
+            )
+            for q in self.quantiles
+        }
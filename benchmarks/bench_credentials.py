@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of `CredentialManager.get_password` latency.
+
+Usage: python benchmarks/bench_credentials.py [--number N] [manager ...]
+
+Each manager is given a throwaway password which is removed afterwards. Managers that
+are unavailable on this machine (e.g. 'keychain' outside of macOS) are skipped.
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import timeit
+
+from ambramelin.util import credentials
+from ambramelin.util.credentials import CredentialManagerError
+
+ACCOUNT = "ambramelin-benchmark"
+PASSWORD = "benchmark-password"
+
+
+def bench(name: str, number: int) -> None:
+    manager = credentials.managers[name]
+
+    try:
+        manager.set_password(ACCOUNT, PASSWORD)
+    except (CredentialManagerError, OSError) as e:
+        print(f"{name}: skipped ({e})")
+        return
+
+    try:
+        if manager.get_password(ACCOUNT) is None:
+            print(f"{name}: skipped (password not retrievable)")
+            return
+
+        timings = timeit.repeat(
+            lambda: manager.get_password(ACCOUNT), number=1, repeat=number
+        )
+        timings_us = sorted(t * 1e6 for t in timings)
+        print(
+            f"{name}: median {statistics.median(timings_us):,.1f}us, "
+            f"p95 {timings_us[int(len(timings_us) * 0.95)]:,.1f}us, "
+            f"min {timings_us[0]:,.1f}us ({number} calls)"
+        )
+    finally:
+        try:
+            manager.del_password(ACCOUNT)
+        except CredentialManagerError:
+            pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("managers", nargs="*", default=list(credentials.managers))
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    # the 'env' manager does not store passwords, so provide one the way a container
+    # would
+    os.environ["AMBRAMELIN_PASSWORD_AMBRAMELIN_BENCHMARK"] = PASSWORD
+
+    # keep the 'file' manager's store and key out of the working directory
+    os.chdir(tempfile.mkdtemp())
+
+    for name in args.managers:
+        bench(name, args.number)
+
+
+if __name__ == "__main__":
+    main()
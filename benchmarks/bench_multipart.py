@@ -0,0 +1,50 @@
+"""
+Micro-benchmark of parsing a DICOMweb multipart response (`study download --method
+dicomweb`), to check that parsing keeps up with the network.
+
+Usage: python benchmarks/bench_multipart.py [--instances N] [--size BYTES]
+    [--chunk-size BYTES ...]
+"""
+
+import argparse
+import os
+import time
+
+from ambramelin.util import multipart
+
+BOUNDARY = b"ambramelin-benchmark"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instances", type=int, default=200)
+    parser.add_argument("--size", type=int, default=512 * 1024)
+    parser.add_argument(
+        "--chunk-size", type=int, nargs="+", default=[8192, 64 * 1024, 1024 * 1024]
+    )
+    args = parser.parse_args()
+
+    # random bytes, so that the boundary is no easier to rule out than in pixel data
+    instance = os.urandom(args.size)
+    part = b"--%s\r\nContent-Type: application/dicom\r\n\r\n%s\r\n" % (
+        BOUNDARY,
+        instance,
+    )
+    body = part * args.instances
+    body += b"--" + BOUNDARY + b"--\r\n"
+
+    for chunk_size in args.chunk_size:
+        chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)]
+        start = time.perf_counter()
+        parts = sum(1 for _ in multipart.iter_parts(chunks, BOUNDARY))
+        elapsed = time.perf_counter() - start
+        assert parts == args.instances
+
+        print(
+            f"chunk size {chunk_size:,}: {len(body) / elapsed / 1e6:,.0f} MB/s "
+            f"({parts} instances of {args.size:,} bytes)"
+        )
+
+
+if __name__ == "__main__":
+    main()
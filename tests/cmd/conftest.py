@@ -1,3 +1,4 @@
+from pathlib import Path
 from unittest.mock import MagicMock
 
 import attr
@@ -21,12 +22,16 @@ def _copy_config(config: Config) -> Config:
 
 
 @pytest.fixture(autouse=True)
-def config(mocker: MockerFixture, request: SubRequest) -> Config:
+def config(mocker: MockerFixture, request: SubRequest, tmp_path: Path) -> Config:
     try:
         _config = _copy_config(request.param)
     except AttributeError:
         _config = Config()
 
+    # keep the lock file (see `update_config`) out of the working directory
+    mocker.patch.object(
+        util_config, "_get_config_path", return_value=tmp_path / "config.json"
+    )
     mocker.patch.object(util_config, "load_config", return_value=_copy_config(_config))
 
     def save_config(config: Config) -> None:
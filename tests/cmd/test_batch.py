@@ -0,0 +1,153 @@
+import argparse
+import io
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ambramelin.cmd import batch
+from ambramelin.util import config as util_config
+from ambramelin.util import input
+from ambramelin.util.config import Config, Environment, load_config, save_config
+from ambramelin.util.errors import InvalidArgumentsError
+
+
+@pytest.fixture(autouse=True)
+def prompts(monkeypatch: pytest.MonkeyPatch) -> None:
+    # restored after each test, as running a batch makes prompts non-interactive
+    monkeypatch.setattr(input, "_interactive", True)
+    monkeypatch.setattr(input, "_assume_yes", False)
+
+
+def _cmd(args: argparse.Namespace) -> Any:
+    if args.subcmd == "get":
+        raise InvalidArgumentsError("bad")
+
+    return f"{args.subcmd} result"
+
+
+@pytest.mark.parametrize("workers", (1, 4))
+def test_run(
+    mocker: MockerFixture, capsys: pytest.CaptureFixture, workers: int
+) -> None:
+    mocker.patch.object(batch, "load_config", return_value=Config())
+    mock_get_cmd = mocker.patch.object(batch, "get_cmd", return_value=_cmd)
+    mock_shared_apis = mocker.spy(batch, "shared_apis")
+
+    with TemporaryDirectory() as dirname:
+        path = Path(dirname) / "commands"
+        path.write_text(
+            "# counts\n"
+            "study count --filters field.equals.val\n"
+            "\n"
+            "study get uuid\n"
+            "study bogus\n"
+            "batch\n"
+            "--all-envs study count\n"
+        )
+
+        with pytest.raises(SystemExit):
+            batch.cmd_run(argparse.Namespace(file=str(path), workers=workers))
+
+    results = {}
+
+    for line in capsys.readouterr().out.splitlines():
+        result = json.loads(line)
+        results[result["line"]] = result
+
+    assert results[2]["status"] == "ok"
+    assert results[2]["result"] == "count result"
+    assert results[2]["command"] == "study count --filters field.equals.val"
+    assert results[4]["status"] == "error"
+    assert "bad" in results[4]["error"]
+    assert results[5]["status"] == "error"
+    assert "invalid choice" in results[5]["error"]
+    assert results[6]["status"] == "error"
+    assert results[7]["status"] == "error"
+    assert set(results) == {2, 4, 5, 6, 7}
+    assert mock_get_cmd.call_count == 2
+    mock_shared_apis.assert_called_once_with()
+
+
+def _prompting_cmd(args: argparse.Namespace) -> Any:
+    return input.bool_prompt("Proceed?")
+
+
+@pytest.mark.parametrize("assume_yes", (False, True))
+def test_run_prompt(
+    mocker: MockerFixture,
+    capsys: pytest.CaptureFixture,
+    tmp_path: Path,
+    assume_yes: bool,
+) -> None:
+    mocker.patch.object(batch, "load_config", return_value=Config())
+    mocker.patch.object(batch, "get_cmd", return_value=_prompting_cmd)
+    # i.e. 'ambra --yes batch run'
+    input.set_assume_yes(assume_yes)
+    path = tmp_path / "commands"
+    path.write_text("study list\n--yes study list\n")
+
+    with pytest.raises(SystemExit):
+        batch.cmd_run(argparse.Namespace(file=str(path), workers=1))
+
+    results = {}
+
+    for line in capsys.readouterr().out.splitlines():
+        result = json.loads(line)
+        results[result["line"]] = result
+
+    # nobody is around to answer, so the command fails rather than proceeding
+    if assume_yes:
+        assert results[1]["status"] == "ok"
+        assert results[1]["result"] is True
+    else:
+        assert results[1]["status"] == "error"
+        assert "PromptNotAllowedError" in results[1]["error"]
+
+    # a line cannot answer prompts for itself
+    assert "'yes' applies to whole batches" in results[2]["error"]
+
+
+@pytest.mark.parametrize("workers", (1, 4))
+def test_run_config_changes(
+    mocker: MockerFixture, capsys: pytest.CaptureFixture, workers: int
+) -> None:
+    # with the config file itself, rather than the mocks of the 'config' fixture
+    mocker.patch.object(util_config, "load_config", new=load_config)
+    mocker.patch.object(util_config, "save_config", new=save_config)
+    commands = "".join(f"env add env{i} url{i}\nenv use env{i}\n" for i in range(20))
+    mocker.patch.object(batch.sys, "stdin", io.StringIO(commands))
+
+    batch.cmd_run(argparse.Namespace(file="-", workers=workers))
+
+    results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    # each command is parsed against the environments the ones before it added
+    assert [result["status"] for result in results] == ["ok"] * 40
+    assert load_config().current == "env19"
+
+
+@pytest.mark.parametrize(
+    "command", ("study diff env1 env2", "study watch", "study download uuid --dest -")
+)
+def test_run_stdout(
+    mocker: MockerFixture, capsys: pytest.CaptureFixture, command: str
+) -> None:
+    mocker.patch.object(
+        batch,
+        "load_config",
+        return_value=Config(
+            envs={"env1": Environment(url=""), "env2": Environment(url="")}
+        ),
+    )
+    mock_get_cmd = mocker.patch.object(batch, "get_cmd")
+    mocker.patch.object(batch.sys, "stdin", io.StringIO(command))
+
+    with pytest.raises(SystemExit):
+        batch.cmd_run(argparse.Namespace(file="-", workers=1))
+
+    (result,) = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert "cannot write to stdout in batches" in result["error"]
+    mock_get_cmd.assert_not_called()
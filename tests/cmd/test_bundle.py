@@ -0,0 +1,91 @@
+import argparse
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from ambramelin.cmd import bundle
+from ambramelin.util.errors import InvalidArgumentsError
+from tests.conftest import make_dicom
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> Path:
+    path = tmp_path / "study.zip"
+
+    with zipfile.ZipFile(path, mode="w") as zf:
+        zf.writestr("SER0001/IMG0001.dcm", make_dicom("1.1", "1", Modality="CT"))
+        zf.writestr("SER0001/IMG0002.dcm", make_dicom("1.2", "1", Modality="CT"))
+        zf.writestr("SER0002/IMG0001.dcm", make_dicom("2.1", "2", Modality="SR"))
+        zf.writestr("README.txt", b"not a dicom file")
+
+    return path
+
+
+class TestExtract:
+    def test_success(self, path: Path, tmp_path: Path) -> None:
+        dest = tmp_path / "extracted"
+        result = bundle.cmd_extract(
+            argparse.Namespace(
+                path=str(path), dest=str(dest), series=["1"], images=["1.2", "2.1"]
+            )
+        )
+
+        assert result == {
+            "instances": 1,
+            "bytes": len(make_dicom("1.2", "1", Modality="CT")),
+        }
+        assert [p.relative_to(dest) for p in dest.rglob("*.dcm")] == [
+            Path("SER0001/IMG0002.dcm")
+        ]
+        assert (dest / "SER0001/IMG0002.dcm").read_bytes() == make_dicom(
+            "1.2", "1", Modality="CT"
+        )
+
+    def test_failure_no_matching_instances(self, path: Path, tmp_path: Path) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            bundle.cmd_extract(
+                argparse.Namespace(
+                    path=str(path), dest=str(tmp_path), series=["3"], images=None
+                )
+            )
+
+
+class TestInspect:
+    def test_success(self, path: Path) -> None:
+        result = bundle.cmd_inspect(argparse.Namespace(path=str(path), series=None))
+        size = len(make_dicom("1.1", "1", Modality="CT"))
+
+        assert result == {
+            "series": {
+                "1": {
+                    "modality": "CT",
+                    "description": None,
+                    "instances": 2,
+                    "bytes": size * 2,
+                },
+                "2": {
+                    "modality": "SR",
+                    "description": None,
+                    "instances": 1,
+                    "bytes": len(make_dicom("2.1", "2", Modality="SR")),
+                },
+            },
+            "other_files": 1,
+        }
+
+    def test_success_series(self, path: Path) -> None:
+        result = bundle.cmd_inspect(argparse.Namespace(path=str(path), series=["2"]))
+
+        assert result["instances"] == [
+            {
+                "name": "SER0002/IMG0001.dcm",
+                "sop_instance_uid": "2.1",
+                "instance_number": None,
+                "bytes": len(make_dicom("2.1", "2", Modality="SR")),
+            }
+        ]
+
+    def test_failure_not_found(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            bundle.cmd_inspect(argparse.Namespace(path="nonexistent", series=None))
@@ -0,0 +1,54 @@
+import argparse
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ambramelin.cmd import completion
+from ambramelin.util.config import Config, Environment
+
+
+@pytest.fixture(autouse=True)
+def mock_config(mocker: MockerFixture, config: Config) -> None:
+    mocker.patch.object(completion, "load_config", return_value=config)
+    mocker.patch.object(
+        completion,
+        "get_completion_cache_path",
+        return_value=Path("/cache/completion.cache"),
+    )
+
+
+@pytest.mark.parametrize(
+    "config",
+    (Config(envs={"envname": Environment(url="")}),),
+    indirect=True,
+)
+@pytest.mark.parametrize("shell", ("bash", "zsh"))
+def test_bash(config: Config, shell: str) -> None:
+    script = getattr(completion, f"cmd_{shell}")(argparse.Namespace())
+
+    assert "complete -F _ambra ambra" in script
+    assert "/cache/completion.cache" in script
+    assert "'study download --bundle') echo '1 dicom iso osx win' ;;" in script
+    assert "'env use 0') echo '@envs' ;;" in script
+    # environments are read from the cache, rather than baked into the script
+    assert "envname" not in script
+
+
+def test_zsh() -> None:
+    assert completion.cmd_zsh(argparse.Namespace()).startswith(
+        "autoload -U +X bashcompinit && bashcompinit"
+    )
+
+
+def test_fish() -> None:
+    script = completion.cmd_fish(argparse.Namespace())
+
+    assert "/cache/completion.cache" in script
+    assert (
+        "complete -c ambra -n '__ambra_using study download' -l bundle "
+        "-x -a 'dicom iso osx win'"
+    ) in script
+    assert (
+        "complete -c ambra -n '__ambra_using env use' -x -a '(__ambra_cache envs)'"
+    ) in script
@@ -18,13 +18,33 @@ from ambramelin.util.output import MSG_NO_ENV_SELECTED, MSG_NO_ENVS_ADDED
 class TestAdd:
     def test_success(self, config: Config) -> None:
         result = env.cmd_add(
-            argparse.Namespace(name="envname", url="ambra.com", user=None)
+            argparse.Namespace(
+                name="envname", url="ambra.com", user=None, limit_rate=None
+            )
         )
-        assert result == {"envname": {"url": "ambra.com", "user": None}}
+        assert result == {
+            "envname": {
+                "url": "ambra.com",
+                "user": None,
+                "limit_rate": None,
+                "presets": {},
+                "dicomweb_url": None,
+            }
+        }
         assert config == Config(
             envs={"envname": Environment(url="ambra.com", user=None)}
         )
 
+    def test_success_with_limit_rate(self, config: Config) -> None:
+        env.cmd_add(
+            argparse.Namespace(
+                name="envname", url="ambra.com", user=None, limit_rate=1024.0
+            )
+        )
+        assert config == Config(
+            envs={"envname": Environment(url="ambra.com", limit_rate=1024.0)}
+        )
+
     @pytest.mark.parametrize(
         "config",
         (Config(users={"username": User(credentials_manager="keychain")}),),
@@ -32,9 +52,19 @@ class TestAdd:
     )
     def test_success_with_user(self, config: Config) -> None:
         result = env.cmd_add(
-            argparse.Namespace(name="envname", url="ambra.com", user="username")
+            argparse.Namespace(
+                name="envname", url="ambra.com", user="username", limit_rate=None
+            )
         )
-        assert result == {"envname": {"url": "ambra.com", "user": "username"}}
+        assert result == {
+            "envname": {
+                "url": "ambra.com",
+                "user": "username",
+                "limit_rate": None,
+                "presets": {},
+                "dicomweb_url": None,
+            }
+        }
         assert config == Config(
             envs={"envname": Environment(url="ambra.com", user="username")},
             users={"username": User(credentials_manager="keychain")},
@@ -142,13 +172,44 @@ class TestList:
         assert env.cmd_list(argparse.Namespace()) == result
 
 
+class TestPreset:
+    @pytest.mark.parametrize(
+        "config",
+        (
+            Config(
+                envs={"envname": Environment(url="", presets={"old": ["study_uid"]})}
+            ),
+        ),
+        indirect=True,
+    )
+    def test_success(self, config: Config) -> None:
+        env.cmd_preset(
+            argparse.Namespace(name="envname", preset="new", fields=["uuid"])
+        )
+        env.cmd_preset(argparse.Namespace(name="envname", preset="old", fields=[]))
+        assert config == Config(
+            envs={"envname": Environment(url="", presets={"new": ["uuid"]})}
+        )
+
+    def test_failure_no_envs_added(self) -> None:
+        with pytest.raises(NoEnvironmentsError):
+            env.cmd_preset(argparse.Namespace(name="env", preset="new", fields=[]))
+
+
 class TestSet:
     @pytest.mark.parametrize(
         "args",
         (
-            {"url": "new.com", "user": None},
-            {"url": None, "user": "new-user"},
-            {"url": "new.com", "user": "new-user"},
+            {"url": "new.com", "user": None, "limit_rate": None, "dicomweb_url": None},
+            {"url": None, "user": "new-user", "limit_rate": None, "dicomweb_url": None},
+            {
+                "url": "new.com",
+                "user": "new-user",
+                "limit_rate": None,
+                "dicomweb_url": None,
+            },
+            {"url": None, "user": None, "limit_rate": 1024.0, "dicomweb_url": None},
+            {"url": None, "user": None, "limit_rate": None, "dicomweb_url": "/wado"},
         ),
     )
     @pytest.mark.parametrize(
@@ -170,12 +231,18 @@ class TestSet:
             "envname": {
                 "url": args["url"] or "old.com",
                 "user": args["user"] or "old-user",
+                "limit_rate": args["limit_rate"],
+                "presets": {},
+                "dicomweb_url": args["dicomweb_url"],
             }
         }
         assert config == Config(
             envs={
                 "envname": Environment(
-                    url=args["url"] or "old.com", user=args["user"] or "old-user"
+                    url=args["url"] or "old.com",
+                    user=args["user"] or "old-user",
+                    limit_rate=args["limit_rate"],
+                    dicomweb_url=args["dicomweb_url"],
                 )
             },
             users={
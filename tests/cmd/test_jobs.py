@@ -0,0 +1,108 @@
+import argparse
+import io
+from pathlib import Path
+from typing import Optional
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ambramelin.cmd import jobs
+from ambramelin.util.errors import AmbramelinError, InvalidArgumentsError
+
+
+@pytest.fixture(autouse=True)
+def mock_env_name(mocker: MockerFixture) -> None:
+    mocker.patch.object(jobs, "get_env_name", return_value="envname")
+    mocker.patch.object(jobs, "using_env")
+
+
+@pytest.fixture
+def mock_download(mocker: MockerFixture) -> MagicMock:
+    return mocker.patch.object(jobs, "cmd_download")
+
+
+def _add(*uuids: str, file: Optional[str] = None) -> dict:
+    return jobs.cmd_add(
+        argparse.Namespace(uuid=uuids, file=file, dest="{uuid}.zip", bundle="dicom")
+    )
+
+
+def _run_args(max_attempts: int = 3) -> argparse.Namespace:
+    return argparse.Namespace(workers=2, max_attempts=max_attempts)
+
+
+class TestAdd:
+    def test_success(self, tmp_path: Path) -> None:
+        file = tmp_path / "uuids"
+        file.write_text("uuid2\n\nuuid3\n")
+
+        assert _add("uuid1", file=str(file)) == {"added": 3, "skipped": 0}
+        assert _add("uuid1") == {"added": 0, "skipped": 1}
+
+    def test_success_stdin(self, mocker: MockerFixture) -> None:
+        stdin = io.StringIO("uuid1\nuuid2\n")
+        mocker.patch.object(jobs.sys, "stdin", stdin)
+
+        assert _add(file="-") == {"added": 2, "skipped": 0}
+        assert not stdin.closed
+
+    def test_failure_no_studies(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            _add()
+
+
+class TestRun:
+    def test_success(self, mock_download: MagicMock) -> None:
+        _add("uuid1", "uuid2", "uuid3")
+
+        status = jobs.cmd_run(_run_args())
+
+        assert status["done"] == 3
+        assert sorted(call.args[0].uuid for call in mock_download.call_args_list) == [
+            "uuid1",
+            "uuid2",
+            "uuid3",
+        ]
+        assert all(
+            call.args[0].skip_existing and call.args[0].hash == "sha256"
+            for call in mock_download.call_args_list
+        )
+        # nothing left to do
+        jobs.cmd_run(_run_args())
+        assert mock_download.call_count == 3
+
+    def test_failure_retried(self, mock_download: MagicMock) -> None:
+        mock_download.side_effect = [AmbramelinError("error"), None]
+        _add("uuid1")
+
+        status = jobs.cmd_run(_run_args())
+
+        assert status["done"] == 1
+        assert mock_download.call_count == 2
+
+    def test_failure_max_attempts(self, mock_download: MagicMock) -> None:
+        mock_download.side_effect = AmbramelinError("error")
+        _add("uuid1")
+
+        status = jobs.cmd_run(_run_args(max_attempts=2))
+
+        assert status["failed"] == 1
+        assert status["failures"][0]["error"] == "error"
+        assert mock_download.call_count == 2
+
+        mock_download.side_effect = None
+        assert jobs.cmd_resume(_run_args())["done"] == 1
+
+
+def test_status() -> None:
+    _add("uuid1")
+
+    assert jobs.cmd_status(argparse.Namespace()) == {
+        "pending": 1,
+        "running": 0,
+        "done": 0,
+        "failed": 0,
+        "bytes": 0,
+        "failures": [],
+    }
@@ -1,16 +1,35 @@
 import argparse
+import base64
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import zipfile
+from io import BytesIO
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Iterator, Optional
+from typing import Any, Callable, Iterator, Optional
 from unittest.mock import MagicMock
 from uuid import uuid4
 
+import pydicom
 import pytest
+import requests
+from ambra_sdk.api import Api
+from ambra_sdk.exceptions.base import AmbraResponseException
 from ambra_sdk.service.filtering import Filter, FilterCondition
+from ambra_sdk.service.sorting import Sorter
 from pytest_mock import MockerFixture
 
 from ambramelin.cmd import study
+from ambramelin.util import config as util_config
+from ambramelin.util import integrity, metrics, sdk
+from ambramelin.util.config import Config, Environment
+from ambramelin.util.dicom import read_sop_instance_uid
 from ambramelin.util.errors import InvalidArgumentsError, InvalidFilterConditionError
+from tests.conftest import make_dicom
 
 filter_params = (
     "filters_arg,filters",
@@ -63,11 +82,38 @@ def mock_get_storage_args(mocker: MockerFixture) -> MagicMock:
     )
 
 
+@pytest.fixture(autouse=True)
+def mock_env(mocker: MockerFixture) -> Environment:
+    environment = Environment(url="")
+    mocker.patch.object(study, "get_env_name", return_value="envname")
+    mocker.patch.object(
+        study, "load_config", return_value=Config(envs={"envname": environment})
+    )
+    return environment
+
+
 @pytest.fixture(autouse=True)
 def mock_bool_prompt(mocker: MockerFixture) -> None:
     mocker.patch.object(study, "bool_prompt", return_value=True)
 
 
+def prepare_upload(*args: Any, **kwargs: Any) -> requests.PreparedRequest:
+    """
+    Stands in for `Storage.Image.upload`, building the request with the SDK and
+    preparing it with requests (which is where unsupported arguments fail).
+    """
+    api = Api("https://ambra.invalid/api/v3", username="username", password="")
+    request = api.Storage.Image.upload(*args, **kwargs, only_prepare=True)
+    return requests.Request(
+        request.method.value,
+        request.url,
+        params=request.params,
+        data=request.data,
+        files=request.files,
+        headers=request.headers,
+    ).prepare()
+
+
 class TestCount:
     @pytest.mark.parametrize(*filter_params)
     def test_success(
@@ -106,6 +152,129 @@ class TestCount:
         with pytest.raises(InvalidFilterConditionError):
             study.cmd_count(argparse.Namespace(fields=None, filters=["field.cond.val"]))
 
+    def test_success_split_filters(
+        self, mocker: MockerFixture, mock_api: MagicMock
+    ) -> None:
+        mocker.patch.object(study, "IN_FILTER_CHUNK_SIZE", 2)
+        mock_augment = mocker.patch.object(study, "_augment_query_with_filters")
+        mock_augment.return_value.get.return_value = {"count": 2}
+
+        result = study.cmd_count(
+            argparse.Namespace(
+                filters=["field1.in_or_null.1,2,3,1", "field2.in.1,2,3,3"]
+            )
+        )
+
+        assert result == "8"
+        assert sorted(call.args[1] for call in mock_augment.call_args_list) == [
+            ["field1.in.3", "field2.in.1,2"],
+            ["field1.in.3", "field2.in.3"],
+            ["field1.in_or_null.1,2", "field2.in.1,2"],
+            ["field1.in_or_null.1,2", "field2.in.3"],
+        ]
+
+
+class TestDiff:
+    @pytest.fixture(autouse=True)
+    def apis(self, mocker: MockerFixture) -> tuple[MagicMock, MagicMock]:
+        mocker.patch.object(study, "KEYSET_PAGE_SIZE", 2)
+        source, target = MagicMock(), MagicMock()
+        mocker.patch.object(study, "get_api", side_effect=[source, target])
+
+        for api, studies in (
+            (
+                source,
+                [
+                    ("s1", "uid1", "CT"),
+                    ("s2a", "uid2", "MR"),
+                    ("s2b", "uid2", "MR"),
+                    ("s3", "uid3", "CT"),
+                    ("s5", "uid5", "US"),
+                ],
+            ),
+            (
+                target,
+                [
+                    ("t2", "uid2", "MR"),
+                    ("t3", "uid3", "MR"),
+                    ("t4", "uid4", "CT"),
+                    ("t5", "uid5", "US"),
+                ],
+            ),
+        ):
+            rows = [
+                {"uuid": uuid, "study_uid": study_uid, "modality": modality}
+                for uuid, study_uid, modality in studies
+            ]
+            api.Study.list.side_effect = lambda fields, rows=rows: FakeStudyListQuery(
+                rows, []
+            )
+
+        return source, target
+
+    @staticmethod
+    def _diff(**kwargs: Any) -> None:
+        study.cmd_diff(
+            argparse.Namespace(
+                **{
+                    "source": "env1",
+                    "target": "env2",
+                    "filters": None,
+                    "compare": None,
+                    **kwargs,
+                }
+            )
+        )
+
+    @pytest.mark.parametrize("compare", (None, ["modality"]))
+    def test_success(
+        self,
+        capsys: pytest.CaptureFixture,
+        apis: tuple[MagicMock, MagicMock],
+        compare: Optional[list[str]],
+    ) -> None:
+        self._diff(compare=compare)
+
+        captured = capsys.readouterr()
+        diffs = [json.loads(line) for line in captured.out.splitlines()]
+        expected = [
+            {"study_uid": "uid1", "only_in": "env1", "uuids": ["s1"]},
+            {
+                "study_uid": "uid2",
+                "differs": [],
+                "uuids": {"env1": ["s2a", "s2b"], "env2": ["t2"]},
+            },
+            {"study_uid": "uid4", "only_in": "env2", "uuids": ["t4"]},
+        ]
+
+        if compare is not None:
+            expected.insert(
+                2,
+                {
+                    "study_uid": "uid3",
+                    "differs": ["modality"],
+                    "uuids": {"env1": ["s3"], "env2": ["t3"]},
+                },
+            )
+
+        assert diffs == expected
+        # studies, rather than study UIDs, are counted
+        assert captured.err == (
+            "5 studies in env1 and 4 in env2: 1 only in env1, 1 only in env2, "
+            f"{len(expected) - 2} study UIDs different\n"
+        )
+
+        for api in apis:
+            assert set(json.loads(api.Study.list.call_args.kwargs["fields"])) == {
+                "uuid",
+                "study_uid",
+                *(compare or []),
+            }
+
+    def test_failure_same_env(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            self._diff(target="env1")
+
 
 class TestDownload:
     def test_success(
@@ -128,6 +297,14 @@ class TestDownload:
                     uuid=uuid,
                     bundle="dicom",
                     chunk_size=512,
+                    series=None,
+                    images=None,
+                    method="bundle",
+                    deidentify=None,
+                    limit_rate=None,
+                    hash=None,
+                    skip_existing=False,
+                    rehash_existing=False,
                 )
             )
 
@@ -139,36 +316,642 @@ class TestDownload:
             with open(Path(dirname) / f"{uuid}.zip") as f:
                 assert f.read() == "chunk1chunk2"
 
+    @pytest.mark.parametrize(
+        "limit_rate,env_limit_rate,rate",
+        ((None, None, None), (None, 1024.0, 1024.0), (2048.0, 1024.0, 2048.0)),
+    )
+    def test_success_limit_rate(
+        self,
+        mocker: MockerFixture,
+        mock_api: MagicMock,
+        mock_env: Environment,
+        capsysbinary: pytest.CaptureFixture,
+        limit_rate: Optional[float],
+        env_limit_rate: Optional[float],
+        rate: Optional[float],
+    ) -> None:
+        mock_env.limit_rate = env_limit_rate
+        mock_get_limiter = mocker.patch.object(study, "get_limiter")
+        mock_api.Storage.Study.download().iter_content.return_value = [b"chunk1"]
+
+        study.cmd_download(
+            argparse.Namespace(
+                dest="-",
+                uuid="uuid",
+                bundle="dicom",
+                chunk_size=512,
+                series=None,
+                images=None,
+                method="bundle",
+                deidentify=None,
+                limit_rate=limit_rate,
+                hash=None,
+                skip_existing=False,
+                rehash_existing=False,
+            )
+        )
+
+        if rate is None:
+            mock_get_limiter.assert_not_called()
+        else:
+            mock_get_limiter.assert_called_once_with("envname", rate)
+            mock_get_limiter().consume.assert_called_once_with(6)
+
+    @pytest.mark.parametrize("algorithm", ("sha256", "blake2b"))
+    @pytest.mark.parametrize("selective", (False, True))
+    def test_success_hash(
+        self, mock_api: MagicMock, tmp_path: Path, algorithm: str, selective: bool
+    ) -> None:
+        mock_api.Storage.Study.download().iter_content.return_value = [b"chunk1"]
+        mock_api.Storage.Study.schema.return_value = {
+            "series": [{"series_uid": "1", "images": [{"id": "1", "version": "1"}]}]
+        }
+        mock_api.Storage.Image.dicom_payload().content = b"payload"
+        dest = tmp_path / "study.zip"
+
+        study.cmd_download(
+            argparse.Namespace(
+                dest=str(dest),
+                uuid="uuid",
+                bundle="dicom",
+                chunk_size=512,
+                series=["1"] if selective else None,
+                images=None,
+                method=None,
+                deidentify=None,
+                workers=1,
+                limit_rate=None,
+                hash=algorithm,
+                skip_existing=False,
+                rehash_existing=False,
+            )
+        )
+
+        data = dest.read_bytes()
+        manifest = json.loads((tmp_path / "study.zip.manifest.json").read_text())
+        assert manifest["algorithm"] == algorithm
+        assert manifest["digest"] == hashlib.new(algorithm, data).hexdigest()
+        assert manifest["bytes"] == len(data)
+
+        if selective:
+            with zipfile.ZipFile(dest) as zf:
+                assert zf.read("SER0001/IMG0001.dcm") == b"payload"
+
+    @pytest.mark.parametrize("rehash_existing", (False, True))
+    @pytest.mark.parametrize("state", ("intact", "modified", "corrupted"))
+    def test_success_skip_existing(
+        self, mock_api: MagicMock, tmp_path: Path, rehash_existing: bool, state: str
+    ) -> None:
+        dest = tmp_path / "study.zip"
+        dest.write_bytes(b"chunk1")
+        integrity.write_manifest(
+            dest,
+            {
+                "file": str(dest),
+                "algorithm": "sha256",
+                "digest": hashlib.sha256(b"chunk1").hexdigest(),
+                "bytes": 6,
+            },
+        )
+        mtime_ns = dest.stat().st_mtime_ns
+
+        if state != "intact":
+            dest.write_bytes(b"chunk2")
+            mtime_ns = mtime_ns + 1 if state == "modified" else mtime_ns
+            # a corrupted file (e.g. by the disk) still looks unchanged
+            os.utime(dest, ns=(mtime_ns, mtime_ns))
+
+        mock_api.Storage.Study.download().iter_content.return_value = [b"chunk1"]
+        mock_api.Storage.Study.download.reset_mock()
+
+        study.cmd_download(
+            argparse.Namespace(
+                dest=str(dest),
+                uuid="uuid",
+                bundle="dicom",
+                chunk_size=512,
+                series=None,
+                images=None,
+                method="bundle",
+                deidentify=None,
+                limit_rate=None,
+                hash=None,
+                skip_existing=True,
+                rehash_existing=rehash_existing,
+            )
+        )
+
+        # only hashing the destination again tells that a corrupted one changed
+        downloaded = state == "modified" or (state == "corrupted" and rehash_existing)
+        assert mock_api.Storage.Study.download.called is downloaded
+        assert integrity.is_unchanged(dest) is (state != "modified" or downloaded)
+        assert integrity.verify(dest) is (state == "intact" or downloaded)
+
+    def test_failure_skip_existing_stdout(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            study.cmd_download(
+                argparse.Namespace(
+                    dest="-",
+                    uuid="uuid",
+                    bundle="dicom",
+                    series=None,
+                    images=None,
+                    method="bundle",
+                    deidentify=None,
+                    hash=None,
+                    skip_existing=True,
+                    rehash_existing=False,
+                )
+            )
+
+    def test_success_stdout(
+        self, capsysbinary: pytest.CaptureFixture, mock_api: MagicMock
+    ) -> None:
+        mock_response = MagicMock()
+        mock_response.iter_content.return_value = iter([b"chunk1", b"chunk2"])
+        mock_api.Storage.Study.download.return_value = mock_response
+
+        study.cmd_download(
+            argparse.Namespace(
+                dest="-",
+                uuid=str(uuid4()),
+                bundle="dicom",
+                chunk_size=512,
+                series=None,
+                images=None,
+                method="bundle",
+                deidentify=None,
+                limit_rate=None,
+                hash=None,
+                skip_existing=False,
+                rehash_existing=False,
+            )
+        )
+
+        out, err = capsysbinary.readouterr()
+        assert out == b"chunk1chunk2"
+        assert b"12 bytes downloaded" in err
 
-class TestGet:
     @pytest.mark.parametrize(
-        "fields_arg,fields",
+        "series,images,entries",
         (
-            (None, None),
-            (["field1", "field2"], '["field1", "field2"]'),
+            (
+                ["series1"],
+                None,
+                {"SER0001/IMG0001.dcm": b"image1", "SER0001/IMG0002.dcm": b"image2"},
+            ),
+            (None, ["image3"], {"SER0002/IMG0001.dcm": b"image3"}),
+            (["series1"], ["image2"], {"SER0001/IMG0002.dcm": b"image2"}),
         ),
     )
+    def test_success_selective(
+        self,
+        mock_api: MagicMock,
+        series: Optional[list[str]],
+        images: Optional[list[str]],
+        entries: dict[str, bytes],
+    ) -> None:
+        uuid = str(uuid4())
+        mock_api.Storage.Study.schema.return_value = {
+            "series": [
+                {
+                    "series_uid": "series1",
+                    "images": [
+                        {"id": "image1", "version": "v1"},
+                        {"id": "image2", "version": "v2"},
+                    ],
+                },
+                {
+                    "series_uid": "series2",
+                    "images": [{"id": "image3", "version": "v3"}],
+                },
+            ]
+        }
+        mock_api.Storage.Image.dicom_payload.side_effect = lambda *args: MagicMock(
+            content=args[3].encode()
+        )
+
+        with TemporaryDirectory() as dirname:
+            study.cmd_download(
+                argparse.Namespace(
+                    dest=f"{dirname}/{{uuid}}.zip",
+                    uuid=uuid,
+                    bundle="dicom",
+                    chunk_size=512,
+                    series=series,
+                    images=images,
+                    method=None,
+                    deidentify=None,
+                    limit_rate=None,
+                    hash=None,
+                    skip_existing=False,
+                    rehash_existing=False,
+                    workers=2,
+                )
+            )
+
+            mock_api.Storage.Study.download.assert_not_called()
+
+            with zipfile.ZipFile(Path(dirname) / f"{uuid}.zip") as zf:
+                assert {name: zf.read(name) for name in zf.namelist()} == entries
+
+    @pytest.mark.parametrize(
+        "series,entries",
+        (
+            (
+                None,
+                {
+                    "SER0001/IMG0001.dcm": b"image1",
+                    "SER0001/IMG0002.dcm": b"image2",
+                    "SER0002/IMG0001.dcm": b"image3",
+                },
+            ),
+            (["series2"], {"SER0002/IMG0001.dcm": b"image3"}),
+        ),
+    )
+    def test_success_dicomweb(
+        self,
+        mocker: MockerFixture,
+        mock_api: MagicMock,
+        mock_env: Environment,
+        series: Optional[list[str]],
+        entries: dict[str, bytes],
+    ) -> None:
+        uuid = str(uuid4())
+        mock_env.dicomweb_url = "/dicomweb/{series_uid}"
+        mock_api.Storage.Study.schema.return_value = {
+            "series": [
+                {"series_uid": "series1", "images": [{}, {}]},
+                {"series_uid": "series2", "images": [{}]},
+            ]
+        }
+        payloads = {"series1": [b"image1", b"image2"], "series2": [b"image3"]}
+
+        def retrieve_series(*args: str) -> MagicMock:
+            assert args[1] == "/dicomweb/{series_uid}"
+            body = b"".join(
+                b"--b\r\nContent-Type: application/dicom\r\n\r\n" + payload + b"\r\n"
+                for payload in payloads[args[5]]
+            )
+            response = MagicMock()
+            response.headers = {"Content-Type": "multipart/related; boundary=b"}
+            body += b"--b--\r\n"
+            # chunks do not line up with parts
+            response.iter_content.side_effect = lambda size: (
+                body[i : i + 5] for i in range(0, len(body), 5)
+            )
+            return response
+
+        mock_retrieve = mocker.patch.object(
+            study, "_retrieve_series", side_effect=retrieve_series
+        )
+
+        with TemporaryDirectory() as dirname:
+            study.cmd_download(
+                argparse.Namespace(
+                    dest=f"{dirname}/{{uuid}}.zip",
+                    uuid=uuid,
+                    bundle="dicom",
+                    chunk_size=512,
+                    series=series,
+                    images=None,
+                    method="dicomweb",
+                    deidentify=None,
+                    limit_rate=None,
+                    hash=None,
+                    skip_existing=False,
+                    rehash_existing=False,
+                    workers=2,
+                )
+            )
+
+            mock_api.Storage.Study.download.assert_not_called()
+            mock_api.Storage.Image.dicom_payload.assert_not_called()
+            assert mock_retrieve.call_count == len(series or payloads)
+
+            with zipfile.ZipFile(Path(dirname) / f"{uuid}.zip") as zf:
+                assert {name: zf.read(name) for name in zf.namelist()} == entries
+
+    def test_success_deidentify(self, mock_api: MagicMock, tmp_path: Path) -> None:
+        uuid = str(uuid4())
+        mock_api.Storage.Study.schema.return_value = {
+            "series": [
+                {"series_uid": "series1", "images": [{"id": "1.1", "version": "v1"}]}
+            ]
+        }
+        mock_api.Storage.Image.dicom_payload.side_effect = lambda *args: MagicMock(
+            content=make_dicom(args[3], PatientName="Doe^John")
+        )
+        profile = tmp_path / "profile.json"
+        profile.write_text(json.dumps({"replace": {"PatientName": "ANON"}}))
+
+        study.cmd_download(
+            argparse.Namespace(
+                dest=f"{tmp_path}/{{uuid}}.zip",
+                uuid=uuid,
+                bundle="dicom",
+                chunk_size=512,
+                series=None,
+                images=None,
+                method=None,
+                deidentify=str(profile),
+                limit_rate=None,
+                hash=None,
+                skip_existing=False,
+                rehash_existing=False,
+                workers=2,
+            )
+        )
+
+        # instances are downloaded individually, rather than as a bundle
+        mock_api.Storage.Study.download.assert_not_called()
+
+        with zipfile.ZipFile(tmp_path / f"{uuid}.zip") as zf:
+            dataset = pydicom.dcmread(BytesIO(zf.read("SER0001/IMG0001.dcm")))
+
+        assert dataset.PatientName == "ANON"
+        assert dataset.SOPInstanceUID == "1.1"
+
+    def test_failure_dicomweb_images(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            study.cmd_download(
+                argparse.Namespace(
+                    dest="{uuid}.zip",
+                    uuid=str(uuid4()),
+                    bundle="dicom",
+                    series=None,
+                    images=["image1"],
+                    method="dicomweb",
+                    deidentify=None,
+                    limit_rate=None,
+                    hash=None,
+                    skip_existing=False,
+                    rehash_existing=False,
+                )
+            )
+
+    def test_failure_dicomweb_no_url(self) -> None:
+        with pytest.raises(InvalidArgumentsError, match="DICOMweb path"):
+            study.cmd_download(
+                argparse.Namespace(
+                    dest="{uuid}.zip",
+                    uuid=str(uuid4()),
+                    bundle="dicom",
+                    series=None,
+                    images=None,
+                    method="dicomweb",
+                    deidentify=None,
+                    limit_rate=None,
+                    hash=None,
+                    skip_existing=False,
+                    rehash_existing=False,
+                )
+            )
+
+    @pytest.mark.parametrize("series, deidentify", ((["series1"], False), (None, True)))
+    def test_failure_bundle_selective(
+        self, tmp_path: Path, series: Optional[list[str]], deidentify: bool
+    ) -> None:
+        profile = tmp_path / "profile.json"
+        profile.write_text("{}")
+
+        with pytest.raises(InvalidArgumentsError, match="'bundle' method"):
+            study.cmd_download(
+                argparse.Namespace(
+                    dest="{uuid}.zip",
+                    uuid=str(uuid4()),
+                    bundle="dicom",
+                    series=series,
+                    images=None,
+                    method="bundle",
+                    deidentify=str(profile) if deidentify else None,
+                    limit_rate=None,
+                    hash=None,
+                    skip_existing=False,
+                    rehash_existing=False,
+                )
+            )
+
+    def test_failure_no_matching_images(self, mock_api: MagicMock) -> None:
+        mock_api.Storage.Study.schema.return_value = {"series": []}
+
+        with TemporaryDirectory() as dirname:
+            with pytest.raises(InvalidArgumentsError):
+                study.cmd_download(
+                    argparse.Namespace(
+                        dest=f"{dirname}/{{uuid}}.zip",
+                        uuid=str(uuid4()),
+                        bundle="dicom",
+                        series=["series1"],
+                        images=None,
+                        method=None,
+                        deidentify=None,
+                        limit_rate=None,
+                        hash=None,
+                        skip_existing=False,
+                        rehash_existing=False,
+                        workers=1,
+                    )
+                )
+
+    def test_failure_selective_non_dicom_bundle(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            study.cmd_download(
+                argparse.Namespace(
+                    dest="{uuid}.zip",
+                    uuid=str(uuid4()),
+                    bundle="iso",
+                    series=["series1"],
+                    images=None,
+                    method="bundle",
+                    deidentify=None,
+                    limit_rate=None,
+                    hash=None,
+                    skip_existing=False,
+                    rehash_existing=False,
+                )
+            )
+
+
+fields_params = (
+    "fields_arg,preset,all_fields,fields",
+    (
+        (None, None, False, json.dumps(study.FIELD_PRESETS["default"])),
+        (None, "storage", False, json.dumps(study.FIELD_PRESETS["storage"])),
+        (None, None, True, None),
+        (["field1", "field2"], None, False, '["field1", "field2"]'),
+    ),
+)
+
+
+class TestFrames:
+    @pytest.fixture(autouse=True)
+    def cache_dir(self, mocker: MockerFixture, tmp_path: Path) -> Path:
+        mocker.patch.object(
+            study.cache, "get_response_cache_dir", return_value=tmp_path / "cache"
+        )
+        mocker.patch.object(study.cache, "get_env_name", return_value="envname")
+        return tmp_path / "cache"
+
+    @pytest.fixture(autouse=True)
+    def schema(self, mock_api: MagicMock) -> None:
+        mock_api.Storage.Study.schema.return_value = {
+            "series": [
+                {
+                    "series_uid": "series1",
+                    "images": [
+                        {"id": "image1", "version": "v1"},
+                        {"id": "image2", "version": "v1"},
+                    ],
+                },
+                {
+                    "series_uid": "series2",
+                    "images": [{"id": "image3", "version": "v1"}],
+                },
+            ]
+        }
+        mock_api.Storage.Study.thumbnail.side_effect = lambda *args: MagicMock(
+            content=f"thumbnail of {args[3]}".encode()
+        )
+        mock_api.Storage.Study.frame.side_effect = lambda *args, size: MagicMock(
+            content=f"frame {args[5]} of {args[3]} ({size})".encode()
+        )
+
+    @staticmethod
+    def _frames(dest: Path, **kwargs: Any) -> dict:
+        return study.cmd_frames(
+            argparse.Namespace(
+                **{
+                    "uuid": "uuid",
+                    "dest": str(dest / "{uuid}"),
+                    "kind": "thumbnail",
+                    "frame": 0,
+                    "size": None,
+                    "series": None,
+                    "images": None,
+                    "workers": 2,
+                    "max_age": None,
+                    "no_cache": False,
+                    **kwargs,
+                }
+            )
+        )
+
+    def test_success(self, mock_api: MagicMock, tmp_path: Path) -> None:
+        result = self._frames(tmp_path)
+
+        assert result == {
+            "dest": str(tmp_path / "uuid"),
+            "images": 3,
+            "fetched": 3,
+            "bytes": 3 * len(b"thumbnail of imageN"),
+        }
+        assert (tmp_path / "uuid/SER0001/IMG0002.jpg").read_bytes() == (
+            b"thumbnail of image2"
+        )
+        assert (tmp_path / "uuid/SER0002/IMG0001.jpg").read_bytes() == (
+            b"thumbnail of image3"
+        )
+        mock_api.Storage.Study.thumbnail.assert_any_call(
+            "engine_fqdn", "storage_namespace", "study_uuid", "image1", "v1", 0
+        )
+
+        # renderings are cached by image, so fetching them again is free
+        result = self._frames(tmp_path / "again", series=["series2"])
+        assert result["images"] == 1
+        assert result["fetched"] == 0
+        assert mock_api.Storage.Study.thumbnail.call_count == 3
+
+        result = self._frames(tmp_path / "again", series=["series2"], no_cache=True)
+        assert result["fetched"] == 1
+
+    def test_success_frame(self, mock_api: MagicMock, tmp_path: Path) -> None:
+        self._frames(tmp_path, kind="frame", frame=2, size="64", images=["image3"])
+
+        assert [p.name for p in (tmp_path / "uuid").rglob("*.jpg")] == ["IMG0001.jpg"]
+        assert (tmp_path / "uuid/SER0002/IMG0001.jpg").read_bytes() == (
+            b"frame 2 of image3 (64)"
+        )
+
+        # a different size is a different rendering
+        result = self._frames(
+            tmp_path, kind="frame", frame=2, size="128", images=["image3"]
+        )
+        assert result["fetched"] == 1
+
+    def test_failure_no_images(self, tmp_path: Path) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            self._frames(tmp_path, images=["other"])
+
+
+class TestGet:
+    @pytest.mark.parametrize(*fields_params)
     def test_success(
         self,
         mock_api: MagicMock,
         fields_arg: Optional[list[str]],
+        preset: Optional[str],
+        all_fields: bool,
         fields: Optional[str],
     ) -> None:
         uuid = str(uuid4())
-        result = study.cmd_get(argparse.Namespace(uuid=uuid, fields=fields_arg))
+        result = study.cmd_get(
+            argparse.Namespace(
+                uuid=uuid,
+                fields=fields_arg,
+                preset=preset,
+                all_fields=all_fields,
+                max_age=None,
+                no_cache=False,
+            )
+        )
         mock_api.Study.get.assert_called_once_with(uuid=uuid, fields=fields)
         mock_api.Study.get().get.assert_called_once_with()
         assert result == mock_api.Study.get().get()
 
-
-class TestList:
     @pytest.mark.parametrize(
-        "fields_arg,fields",
-        (
-            (None, None),
-            (["field1", "field2"], '["field1", "field2"]'),
-        ),
+        "config",
+        (Config(current="envname", envs={"envname": Environment(url="")}),),
+        indirect=True,
     )
+    def test_success_cached(self, mocker: MockerFixture, mock_api: MagicMock) -> None:
+        mocker.patch.object(sdk, "load_config", return_value=util_config.load_config())
+        mock_api.Study.get().get.side_effect = [{"uuid": "1"}, {"uuid": "2"}]
+
+        def get(**kwargs: Any) -> dict:
+            return study.cmd_get(
+                argparse.Namespace(
+                    uuid="uuid",
+                    fields=["uuid"],
+                    preset=None,
+                    all_fields=False,
+                    **{"no_cache": False, **kwargs},
+                )
+            )
+
+        assert get(max_age=60) == {"uuid": "1"}
+        assert get(max_age=60) == {"uuid": "1"}
+        assert get(max_age=0) == {"uuid": "2"}
+        assert get(max_age=60) == {"uuid": "2"}
+
+
+class TestGetFields:
+    def test_success_env_preset(self, mock_env: Environment) -> None:
+        mock_env.presets = {"storage": ["study_uid"], "mine": ["uuid"]}
+        args = argparse.Namespace(fields=None, preset="storage", all_fields=False)
+        assert study._get_fields(args) == ["study_uid"]
+        args.preset = "mine"
+        assert study._get_fields(args) == ["uuid"]
+
+    def test_failure_unknown_preset(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            study._get_fields(
+                argparse.Namespace(fields=None, preset="unknown", all_fields=False)
+            )
+
+
+class TestList:
+    @pytest.mark.parametrize(*fields_params)
     @pytest.mark.parametrize(*filter_params)
     @pytest.mark.parametrize("min_row_arg", (None, 5))
     @pytest.mark.parametrize("max_row_arg", (None, 10))
@@ -177,6 +960,8 @@ class TestList:
         mocker: MockerFixture,
         mock_api: MagicMock,
         fields_arg: list[str],
+        preset: Optional[str],
+        all_fields: bool,
         fields: Optional[str],
         filters_arg: Optional[tuple[str]],
         filters: list[Filter],
@@ -198,9 +983,13 @@ class TestList:
         result = study.cmd_list(
             argparse.Namespace(
                 fields=fields_arg,
+                preset=preset,
+                all_fields=all_fields,
                 filters=filters_arg,
                 min_row=min_row_arg,
                 max_row=max_row_arg,
+                keyset=False,
+                cursor=None,
             )
         )
 
@@ -214,6 +1003,53 @@ class TestList:
             ]
             assert "".join(result) == "filtered-results"[min_row_arg:max_row_arg]
 
+    @pytest.mark.parametrize(
+        "min_row,max_row,result",
+        (
+            (None, None, ["1", "2", "3", "4"]),
+            (1, 3, ["2", "3"]),
+            (None, 1, ["1"]),
+        ),
+    )
+    def test_success_split_filters(
+        self,
+        mocker: MockerFixture,
+        mock_api: MagicMock,
+        min_row: Optional[int],
+        max_row: Optional[int],
+        result: list[str],
+    ) -> None:
+        mocker.patch.object(study, "IN_FILTER_CHUNK_SIZE", 2)
+        rows = {
+            "uuid.in.1,2": [{"uuid": "1"}, {"uuid": "2"}],
+            # a study matching several queries is only listed once
+            "uuid.in.3,4": [{"uuid": "3"}, {"uuid": "2"}, {"uuid": "4"}],
+        }
+
+        def augment(query: MagicMock, filters: list[str]) -> MagicMock:
+            (query_filter,) = filters
+            query.all.return_value = iter(rows[query_filter])
+            return query
+
+        mocker.patch.object(study, "_augment_query_with_filters", side_effect=augment)
+        mock_api.Study.list.side_effect = lambda fields: MagicMock()
+
+        assert [
+            row["uuid"]
+            for row in study.cmd_list(
+                argparse.Namespace(
+                    fields=["uuid"],
+                    preset=None,
+                    all_fields=False,
+                    filters=["uuid.in.1,2,3,4"],
+                    min_row=min_row,
+                    max_row=max_row,
+                    keyset=False,
+                    cursor=None,
+                )
+            )
+        ] == result
+
     def test_failure_invalid_filter_condition(self, mocker: MockerFixture) -> None:
         mocker.patch.object(FilterCondition, "__init__", side_effect=ValueError)
 
@@ -221,9 +1057,13 @@ class TestList:
             study.cmd_list(
                 argparse.Namespace(
                     fields=None,
+                    preset=None,
+                    all_fields=False,
                     filters=["field.cond.val"],
                     min_row=None,
                     max_row=None,
+                    keyset=False,
+                    cursor=None,
                 )
             )
 
@@ -232,11 +1072,325 @@ class TestList:
         with pytest.raises(InvalidArgumentsError):
             study.cmd_list(
                 argparse.Namespace(
-                    fields=None, filters=None, min_row=min_row, max_row=max_row
+                    fields=None,
+                    preset=None,
+                    all_fields=False,
+                    filters=None,
+                    min_row=min_row,
+                    max_row=max_row,
+                    keyset=False,
+                    cursor=None,
                 )
             )
 
 
+class FakeStudyListQuery:
+    """Enough of a study/list query to serve a keyset scan of `studies`."""
+
+    def __init__(self, studies: list[dict], pages: list[int]) -> None:
+        self._studies = studies
+        self._filters: list[Filter] = []
+        self._sorters: list[str] = []
+        self._rows_in_page = 100
+        # the number of studies each page has
+        self._pages = pages
+
+    def filter_by(self, f: Filter) -> "FakeStudyListQuery":
+        self._filters.append(f)
+        return self
+
+    def sort_by(self, sorter: Sorter) -> "FakeStudyListQuery":
+        self._sorters.append(sorter.field_name)
+        return self
+
+    def set_rows_in_page(self, rows_in_page: int) -> "FakeStudyListQuery":
+        self._rows_in_page = rows_in_page
+        return self
+
+    def first(self) -> Optional[dict]:
+        return next(self.all(), None)
+
+    def all(self) -> Iterator[dict]:
+        ops = {
+            FilterCondition.equals: lambda a, b: a == b,
+            FilterCondition.ge: lambda a, b: a >= b,
+            FilterCondition.gt: lambda a, b: a > b,
+        }
+        studies = [
+            study
+            for study in self._studies
+            if all(
+                ops[f.condition](study[f.field_name], f.value) for f in self._filters
+            )
+        ]
+        studies.sort(key=lambda study: [study[field] for field in self._sorters])
+        page = studies[: self._rows_in_page]
+        self._pages.append(len(page))
+
+        yield from page
+
+        if len(page) == self._rows_in_page:
+            raise AssertionError("Only the first page may be requested.")
+
+
+class TestListKeyset:
+    @pytest.fixture
+    def pages(self) -> list[int]:
+        return []
+
+    @pytest.fixture(autouse=True)
+    def studies(
+        self, mocker: MockerFixture, mock_api: MagicMock, pages: list[int]
+    ) -> list[dict]:
+        mocker.patch.object(study, "KEYSET_PAGE_SIZE", 3)
+        # several studies created at the same time, more than fit in a page
+        studies = [
+            {"uuid": f"{uuid:02d}", "created": created, "modality": "CT"}
+            for uuid, created in enumerate(["t1", "t2", "t2", "t2", "t2", "t3", "t4"])
+        ]
+        mock_api.Study.list.side_effect = lambda fields: FakeStudyListQuery(
+            studies, pages
+        )
+        return studies
+
+    @staticmethod
+    def _list(**kwargs: Any) -> list:
+        return study.cmd_list(
+            argparse.Namespace(
+                **{
+                    "fields": None,
+                    "preset": None,
+                    "all_fields": False,
+                    "filters": ["modality.equals.CT"],
+                    "min_row": None,
+                    "max_row": None,
+                    "keyset": True,
+                    "cursor": None,
+                    **kwargs,
+                }
+            )
+        )
+
+    def test_success(self, studies: list[dict], pages: list[int]) -> None:
+        assert self._list() == studies
+        assert all(page <= 3 for page in pages)
+
+    def test_success_fields(self, studies: list[dict]) -> None:
+        assert self._list(fields=["modality"]) == [{"modality": "CT"}] * len(studies)
+
+    def test_success_cursor(
+        self, studies: list[dict], capsys: pytest.CaptureFixture
+    ) -> None:
+        rows = []
+        cursor = None
+
+        while True:
+            rows += self._list(max_row=2, cursor=cursor)
+            match = re.search(r"--cursor (\S+)'", capsys.readouterr().err)
+
+            if match is None:
+                break
+
+            cursor = match[1]
+
+        assert rows == studies
+
+    def test_success_interrupted(
+        self, mocker: MockerFixture, studies: list[dict], capsys: pytest.CaptureFixture
+    ) -> None:
+        iter_keyset = study._iter_keyset
+        calls = []
+
+        def interrupted(*args: Any) -> Iterator[dict]:
+            calls.append(args)
+
+            if len(calls) == 1:
+                yield from itertools.islice(iter_keyset(*args), 4)
+                raise KeyboardInterrupt()
+
+            yield from iter_keyset(*args)
+
+        mocker.patch.object(study, "_iter_keyset", new=interrupted)
+
+        assert self._list() == studies[:4]
+        match = re.search(r"--cursor (\S+)'", capsys.readouterr().err)
+        assert match is not None
+        assert self._list(cursor=match[1]) == studies[4:]
+
+    @pytest.mark.parametrize(
+        "cursor",
+        (
+            "invalid",
+            # JSON, but not a list of two values
+            base64.urlsafe_b64encode(b"1").decode(),
+            base64.urlsafe_b64encode(b'["t1"]').decode(),
+            base64.urlsafe_b64encode(b'"t1"').decode(),
+            base64.urlsafe_b64encode(b'{"t": 1, "u": 2}').decode(),
+            base64.urlsafe_b64encode(b'["t1", 2]').decode(),
+        ),
+    )
+    def test_failure_invalid_cursor(self, cursor: str) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            self._list(cursor=cursor)
+
+
+class TestMirror:
+    @pytest.fixture
+    def apis(self, mocker: MockerFixture) -> tuple[MagicMock, MagicMock]:
+        source, target = MagicMock(), MagicMock()
+        mocker.patch.object(study, "get_api", side_effect=[source, target])
+        source.Storage.Study.schema.return_value = {
+            "series": [
+                {
+                    "series_uid": "series1",
+                    "images": [
+                        {"id": "image1", "version": "v1"},
+                        {"id": "image2", "version": "v1"},
+                    ],
+                }
+            ]
+        }
+        source.Storage.Image.dicom_payload.return_value.content = b"payload"
+        # "uid2" was copied to the target, and "uid3" only partly
+        target_studies = [
+            {
+                "uuid": "target1",
+                "study_uid": "uid2",
+                "storage_namespace": "namespace",
+                "image_count": 2,
+            },
+            {
+                "uuid": "target2",
+                "study_uid": "uid3",
+                "storage_namespace": "namespace",
+                "image_count": 1,
+            },
+            {
+                "uuid": "target3",
+                "study_uid": "uid1",
+                "storage_namespace": "other",
+                "image_count": 2,
+            },
+        ]
+        target.Study.list.side_effect = lambda fields: FakeStudyListQuery(
+            target_studies, []
+        )
+        return source, target
+
+    @staticmethod
+    def _mirror(**kwargs: Any) -> dict:
+        return study.cmd_mirror(
+            argparse.Namespace(
+                **{
+                    "uuid": [],
+                    "filters": None,
+                    "source": "env1",
+                    "target": "env2",
+                    "namespace": "namespace",
+                    "engine_fqdn": "target_fqdn",
+                    "workers": 1,
+                    **kwargs,
+                }
+            )
+        )
+
+    def test_success_metrics_env(
+        self,
+        mock_get_storage_args: MagicMock,
+        apis: tuple[MagicMock, MagicMock],
+    ) -> None:
+        source, target = apis
+        mock_get_storage_args.return_value = "source_fqdn", "source_namespace", "uid1"
+        metrics.reset()
+        # as `metrics.instrument` would record the requests
+        metrics.set_env("current")
+
+        def request(endpoint: str) -> Callable[..., MagicMock]:
+            def record(*args: Any, **kwargs: Any) -> MagicMock:
+                metrics.inc("ambra_http_requests", endpoint=endpoint)
+                return MagicMock(content=b"payload")
+
+            return record
+
+        source.Storage.Image.dicom_payload.side_effect = request("payload")
+        target.Storage.Image.upload.side_effect = request("upload")
+
+        try:
+            self._mirror(uuid=["uuid1"], workers=2)
+            samples = metrics.render().splitlines()
+        finally:
+            metrics.reset()
+
+        assert 'ambra_http_requests_total{endpoint="payload",env="env1"} 2' in samples
+        assert 'ambra_http_requests_total{endpoint="upload",env="env2"} 2' in samples
+
+    def test_success(
+        self,
+        mock_get_storage_args: MagicMock,
+        apis: tuple[MagicMock, MagicMock],
+    ) -> None:
+        source, target = apis
+        mock_get_storage_args.side_effect = lambda api, uuid: (
+            "source_fqdn",
+            "source_namespace",
+            {"uuid1": "uid1", "uuid2": "uid2", "uuid3": "uid3"}[uuid],
+        )
+
+        result = self._mirror(uuid=["uuid1", "uuid2", "uuid3"])
+
+        assert {k: v for k, v in result.items() if k != "seconds"} == {
+            "mirrored": 2,
+            "skipped": 1,
+            "failed": 0,
+            "images": 4,
+            "bytes": 28,
+        }
+        assert [
+            c.args + (c.kwargs["opened_file"], c.kwargs["study_uid"])
+            for c in target.Storage.Image.upload.call_args_list
+        ] == [
+            ("target_fqdn", "namespace", b"payload", "uid1"),
+            ("target_fqdn", "namespace", b"payload", "uid1"),
+            ("target_fqdn", "namespace", b"payload", "uid3"),
+            ("target_fqdn", "namespace", b"payload", "uid3"),
+        ]
+
+    def test_success_request(
+        self,
+        mock_get_storage_args: MagicMock,
+        apis: tuple[MagicMock, MagicMock],
+    ) -> None:
+        source, target = apis
+        mock_get_storage_args.return_value = ("source_fqdn", "source_namespace", "uid1")
+        target.Storage.Image.upload.side_effect = prepare_upload
+
+        assert self._mirror(uuid=["uuid1"])["mirrored"] == 1
+
+    def test_success_failed(
+        self,
+        mock_get_storage_args: MagicMock,
+        apis: tuple[MagicMock, MagicMock],
+        capsys: pytest.CaptureFixture,
+    ) -> None:
+        source, target = apis
+        mock_get_storage_args.return_value = ("source_fqdn", "source_namespace", "uid1")
+        target.Storage.Image.upload.side_effect = AmbraResponseException(500)
+
+        result = self._mirror(uuid=["uuid1"])
+
+        assert result["failed"] == 1
+        assert result["mirrored"] == 0
+        assert "Failed to mirror uuid1" in capsys.readouterr().err
+
+    def test_failure_same_env(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            self._mirror(uuid=["uuid1"], target="env1")
+
+    def test_failure_no_studies(self, apis: tuple[MagicMock, MagicMock]) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            self._mirror()
+
+
 class TestSchema:
     @pytest.mark.parametrize("extended", (True, False))
     @pytest.mark.parametrize("attachments_only", (True, False))
@@ -250,10 +1404,14 @@ class TestSchema:
         uuid = str(uuid4())
         result = study.cmd_schema(
             argparse.Namespace(
-                uuid=uuid, extended=extended, attachments_only=attachments_only
+                uuid=uuid,
+                extended=extended,
+                attachments_only=attachments_only,
+                max_age=None,
+                no_cache=False,
             )
         )
-        mock_get_storage_args.assert_called_once_with(mock_api, uuid)
+        mock_get_storage_args.assert_called_once_with(mock_api, uuid, None, False)
         mock_api.Storage.Study.schema.assert_called_once_with(
             "engine_fqdn",
             "storage_namespace",
@@ -262,3 +1420,291 @@ class TestSchema:
             attachments_only=int(attachments_only),
         )
         assert result == mock_api.Storage.Study.schema()
+
+    @pytest.mark.parametrize(
+        "config",
+        (Config(current="envname", envs={"envname": Environment(url="")}),),
+        indirect=True,
+    )
+    def test_success_revalidated(
+        self, mocker: MockerFixture, mock_api: MagicMock
+    ) -> None:
+        mocker.patch.object(sdk, "load_config", return_value=util_config.load_config())
+        mock_request = mock_api.Storage.Study.schema.return_value
+        mock_request.headers = None
+        mock_request.execute.side_effect = [
+            MagicMock(json=lambda: {"series": []}, headers={"ETag": '"v1"'}),
+            AmbraResponseException(code=304),
+        ]
+        args = argparse.Namespace(
+            uuid="uuid",
+            extended=False,
+            attachments_only=False,
+            max_age=0,
+            no_cache=False,
+        )
+
+        assert study.cmd_schema(args) == {"series": []}
+        assert study.cmd_schema(args) == {"series": []}
+        assert mock_request.headers == {"If-None-Match": '"v1"'}
+
+
+class TestStats:
+    @pytest.fixture(autouse=True)
+    def studies(self, mocker: MockerFixture, mock_api: MagicMock) -> list[dict]:
+        mocker.patch.object(study, "KEYSET_PAGE_SIZE", 2)
+        studies = [
+            {
+                "uuid": f"{uuid:02d}",
+                "created": f"2024-01-0{1 + uuid // 2} 12:00:00",
+                "modality": modality,
+                "patient_id": f"p{uuid % 3}",
+                "size": size,
+            }
+            for uuid, (modality, size) in enumerate(
+                [("CT", "100"), ("MR", 200), ("CT", None), ("CT", 300), ("US", "4.5")]
+            )
+        ]
+        mock_api.Study.list.side_effect = lambda fields: FakeStudyListQuery(studies, [])
+        return studies
+
+    @staticmethod
+    def _stats(**kwargs: Any) -> dict:
+        return study.cmd_stats(
+            argparse.Namespace(
+                **{
+                    "filters": None,
+                    "sum": None,
+                    "histogram": None,
+                    "per_day": None,
+                    "distinct": None,
+                    "quantiles": None,
+                    **kwargs,
+                }
+            )
+        )
+
+    def test_success(self, mock_api: MagicMock) -> None:
+        result = self._stats(
+            sum=["size"],
+            histogram=["modality"],
+            per_day=["created"],
+            distinct=["patient_id"],
+            quantiles=["size"],
+        )
+        assert result == {
+            "studies": 5,
+            "sum": {
+                "size": {
+                    "count": 4,
+                    "sum": 604.5,
+                    "min": 4.5,
+                    "max": 300,
+                    "mean": 151.125,
+                }
+            },
+            "histogram": {"modality": {"CT": 3, "MR": 1, "US": 1}},
+            "per_day": {"created": {"2024-01-01": 2, "2024-01-02": 2, "2024-01-03": 1}},
+            "distinct": {"patient_id": 3},
+            "quantiles": {"size": {"p50": 200, "p90": 300, "p99": 300}},
+        }
+        # only the aggregated fields are fetched
+        assert set(json.loads(mock_api.Study.list.call_args.kwargs["fields"])) == {
+            "size",
+            "modality",
+            "created",
+            "patient_id",
+            "uuid",
+        }
+
+    def test_success_interrupted(self, mocker: MockerFixture) -> None:
+        iter_keyset = study._iter_keyset
+
+        def interrupted(*args: Any) -> Iterator[dict]:
+            yield from itertools.islice(iter_keyset(*args), 3)
+            raise KeyboardInterrupt()
+
+        mocker.patch.object(study, "_iter_keyset", new=interrupted)
+
+        assert self._stats(histogram=["modality"]) == {
+            "studies": 3,
+            "partial": True,
+            "histogram": {"modality": {"CT": 2, "MR": 1}},
+        }
+
+    def test_failure_no_aggregates(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            self._stats()
+
+
+class TestUpload:
+    def test_success(self, mock_api: MagicMock) -> None:
+        with TemporaryDirectory() as dirname:
+            path = Path(dirname) / "study"
+            path.mkdir()
+            (path / "1.dcm").write_bytes(make_dicom("1.1"))
+            (path / "2.dcm").write_bytes(make_dicom("1.2"))
+            (path / "2-copy.dcm").write_bytes(make_dicom("1.2"))
+            (path / "3.dcm").write_bytes(make_dicom("1.3"))
+            (path / "README").write_bytes(b"not a dicom file")
+            manifest = Path(dirname) / "manifest"
+            manifest.write_text("1.3\n")
+
+            result = study.cmd_upload(
+                argparse.Namespace(
+                    path=str(path),
+                    namespace="namespace",
+                    engine_fqdn=None,
+                    manifest=str(manifest),
+                    workers=2,
+                )
+            )
+
+            mock_api.Namespace.engine_fqdn.assert_called_once_with(
+                namespace_id="namespace"
+            )
+            uploaded = {
+                read_sop_instance_uid(c.kwargs["opened_file"])
+                for c in mock_api.Storage.Image.upload.call_args_list
+            }
+            assert uploaded == {"1.1", "1.2"}
+            assert set(manifest.read_text().split()) == {"1.1", "1.2", "1.3"}
+            assert result["uploaded"] == 2
+            assert result["skipped"] == 3
+            assert result["failed"] == 0
+
+    def test_success_request(self, mock_api: MagicMock, tmp_path: Path) -> None:
+        mock_api.Storage.Image.upload.side_effect = prepare_upload
+        (tmp_path / "1.dcm").write_bytes(make_dicom("1.1"))
+
+        result = study.cmd_upload(
+            argparse.Namespace(
+                path=str(tmp_path),
+                namespace="namespace",
+                engine_fqdn="engine_fqdn",
+                manifest=str(tmp_path / "manifest"),
+                workers=1,
+            )
+        )
+
+        assert result["uploaded"] == 1
+        assert result["failed"] == 0
+
+    def test_success_no_elapsed_time(
+        self, mocker: MockerFixture, mock_api: MagicMock, tmp_path: Path
+    ) -> None:
+        mocker.patch.object(study.time, "monotonic", return_value=100.0)
+        (tmp_path / "1.dcm").write_bytes(make_dicom("1.1"))
+
+        result = study.cmd_upload(
+            argparse.Namespace(
+                path=str(tmp_path),
+                namespace="namespace",
+                engine_fqdn="engine_fqdn",
+                manifest=str(tmp_path / "manifest"),
+                workers=1,
+            )
+        )
+
+        assert result["uploaded"] == 1
+        assert result["seconds"] == 0
+        assert result["files_per_sec"] == 0
+
+    def test_failure_path_not_found(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            study.cmd_upload(argparse.Namespace(path="nonexistent"))
+
+
+class TestWatch:
+    @staticmethod
+    def _args(**kwargs: Any) -> argparse.Namespace:
+        return argparse.Namespace(
+            **{
+                "filters": None,
+                "fields": None,
+                "since": None,
+                "min_interval": 1,
+                "max_interval": 4,
+                "download": None,
+                **kwargs,
+            }
+        )
+
+    def test_success(
+        self, mocker: MockerFixture, mock_api: MagicMock, capsys: pytest.CaptureFixture
+    ) -> None:
+        polls = iter(
+            (
+                # priming: studies created at the high-water mark
+                [{"uuid": "1", "created": "t1"}],
+                [],
+                [{"uuid": "1", "created": "t1"}, {"uuid": "2", "created": "t1"}],
+                [{"uuid": "2", "created": "t1"}, {"uuid": "3", "created": "t2"}],
+                [{"uuid": "3", "created": "t2"}],
+                [],
+            )
+        )
+        mock_list_query = mock_api.Study.list.return_value
+        mock_list_query.filter_by.return_value = mock_list_query
+        mock_query = mock_list_query.sort_by.return_value
+        mock_query.first.return_value = {"uuid": "1", "created": "t1"}
+        mock_query.all.side_effect = lambda: next(polls)
+        mock_sleep = mocker.patch.object(
+            study.time, "sleep", side_effect=[None] * 4 + [KeyboardInterrupt]
+        )
+        mock_download = mocker.patch.object(study, "cmd_download")
+
+        study.cmd_watch(self._args(download="{uuid}.zip"))
+
+        assert [json.loads(line) for line in capsys.readouterr().out.splitlines()] == [
+            {"uuid": "2", "created": "t1"},
+            {"uuid": "3", "created": "t2"},
+        ]
+        assert [call.args[0] for call in mock_sleep.call_args_list] == [2, 1, 1, 2, 4]
+        assert [call.args[0].uuid for call in mock_download.call_args_list] == [
+            "2",
+            "3",
+        ]
+        # with the watch's client, rather than another one
+        assert all(call.args[1] is mock_api for call in mock_download.call_args_list)
+        mock_list_query.filter_by.assert_called_with(
+            Filter("created", FilterCondition.ge, "t2")
+        )
+
+    def test_success_interrupted(
+        self, mocker: MockerFixture, mock_api: MagicMock, capsys: pytest.CaptureFixture
+    ) -> None:
+        mock_list_query = mock_api.Study.list.return_value
+        mock_list_query.filter_by.return_value = mock_list_query
+        mock_query = mock_list_query.sort_by.return_value
+        mock_query.all.return_value = [
+            {"uuid": "1", "created": "t1"},
+            {"uuid": "2", "created": "t1"},
+        ]
+        started = threading.Event()
+
+        def download(*_: Any) -> None:
+            started.set()
+            # not time.sleep(), which is patched
+            threading.Event().wait(0.1)
+
+        def sleep(_: float) -> None:
+            started.wait()
+            raise KeyboardInterrupt
+
+        mocker.patch.object(study.time, "sleep", side_effect=sleep)
+        mock_download = mocker.patch.object(study, "cmd_download", side_effect=download)
+
+        study.cmd_watch(self._args(since="t0", download="{uuid}.zip"))
+
+        # the download in progress finishes, and the pending one is not started
+        assert [call.args[0].uuid for call in mock_download.call_args_list] == ["1"]
+        assert "Cancelled 1 pending download(s)" in capsys.readouterr().err
+
+    def test_failure_invalid_intervals(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            study.cmd_watch(self._args(min_interval=2, max_interval=1))
+
+    def test_failure_download_to_stdout(self) -> None:
+        with pytest.raises(InvalidArgumentsError):
+            study.cmd_watch(self._args(download="-"))
@@ -197,7 +197,9 @@ class TestSet:
             user.cmd_set(argparse.Namespace(name="user"))
 
     @pytest.mark.parametrize(
-        "config", (Config(users={"other-user": User(credentials_manager="keychain")}),)
+        "config",
+        (Config(users={"other-user": User(credentials_manager="keychain")}),),
+        indirect=True,
     )
     def test_failure_user_not_found(self, config: Config) -> None:
         with pytest.raises(UserNotFoundError):
@@ -1,7 +1,10 @@
+from io import BytesIO
 from typing import Optional
 from unittest.mock import MagicMock
 
 import pytest
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import UID, ExplicitVRLittleEndian
 from pytest_mock import MockerFixture
 
 from ambramelin.util import credentials
@@ -22,6 +25,28 @@ class DummyCredentialManager(CredentialManager):
         del self._store[account]
 
 
+def make_dicom(
+    sop_instance_uid: str, series_instance_uid: str = "1.2.3", **elements: str
+) -> bytes:
+    dataset = Dataset()
+    dataset.file_meta = FileMetaDataset()
+    dataset.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    dataset.file_meta.MediaStorageSOPClassUID = UID("1.2.840.10008.5.1.4.1.1.7")
+    dataset.file_meta.MediaStorageSOPInstanceUID = UID(sop_instance_uid)
+    dataset.SOPClassUID = "1.2.840.10008.5.1.4.1.1.7"
+    dataset.SOPInstanceUID = sop_instance_uid
+    dataset.SeriesInstanceUID = series_instance_uid
+
+    for keyword, value in elements.items():
+        setattr(dataset, keyword, value)
+
+    dataset.PixelData = b"\x00\x01" * 8
+    dataset["PixelData"].VR = "OW"
+    buffer = BytesIO()
+    dataset.save_as(buffer, write_like_original=False)
+    return buffer.getvalue()
+
+
 @pytest.fixture
 def dummy_creds_manager() -> DummyCredentialManager:
     return DummyCredentialManager()
@@ -0,0 +1,120 @@
+import os
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ambramelin.util import agent
+from ambramelin.util.agent import AgentServer
+from ambramelin.util.errors import InsecureAgentDirectoryError
+
+
+@pytest.fixture
+def socket_path(monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    with TemporaryDirectory() as dirname:
+        path = Path(dirname) / "agent" / "agent.sock"
+        monkeypatch.setenv("AMBRAMELIN_AGENT_SOCK", str(path))
+        yield path
+
+
+@pytest.fixture
+def server(socket_path: Path) -> Iterator[AgentServer]:
+    server = AgentServer(socket_path, ttl=60)
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+    thread.start()
+
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_socket_permissions(server: AgentServer, socket_path: Path) -> None:
+    assert socket_path.stat().st_mode & 0o777 == 0o600
+    assert socket_path.parent.stat().st_mode & 0o777 == 0o700
+
+
+def test_get_set_del(server: AgentServer) -> None:
+    assert agent.get_password("username") is None
+
+    agent.set_password("username", "password")
+    assert agent.get_password("username") == "password"
+    assert agent.request("status") == {"ok": True, "accounts": ["username"], "ttl": 60}
+
+    agent.del_password("username")
+    assert agent.get_password("username") is None
+
+
+def test_ttl(mocker: MockerFixture, server: AgentServer) -> None:
+    mock_monotonic = mocker.patch.object(agent.time, "monotonic", return_value=0)
+    agent.set_password("username", "password")
+
+    mock_monotonic.return_value = 59
+    assert agent.get_password("username") == "password"
+
+    mock_monotonic.return_value = 60
+    assert agent.get_password("username") is None
+
+
+def test_clear(server: AgentServer) -> None:
+    agent.set_password("username", "password")
+    agent.request("clear")
+    assert agent.get_password("username") is None
+
+
+def test_not_running(socket_path: Path) -> None:
+    assert agent.request("status") is None
+    assert agent.get_password("username") is None
+    agent.set_password("username", "password")  # no-op
+
+
+def test_socket_path(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("AMBRAMELIN_AGENT_SOCK", raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+    assert agent.get_socket_path() == Path("/run/user/1000/ambramelin/agent.sock")
+
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    assert agent.get_socket_path().parent.name == f"ambramelin-{os.getuid()}"
+
+
+def test_insecure_dir_mode(socket_path: Path) -> None:
+    socket_path.parent.mkdir(mode=0o755)
+    socket_path.parent.chmod(0o755)
+
+    with pytest.raises(InsecureAgentDirectoryError):
+        AgentServer(socket_path, ttl=60)
+
+
+def test_insecure_dir_symlink(socket_path: Path) -> None:
+    target = socket_path.parent.with_name("elsewhere")
+    target.mkdir(mode=0o700)
+    socket_path.parent.symlink_to(target)
+
+    with pytest.raises(InsecureAgentDirectoryError):
+        AgentServer(socket_path, ttl=60)
+
+
+def test_insecure_dir_owner(
+    mocker: MockerFixture, server: AgentServer, socket_path: Path
+) -> None:
+    mocker.patch.object(agent.os, "getuid", return_value=os.getuid() + 1)
+
+    # e.g. another user's socket, in a directory they created in advance
+    assert agent.request("status") is None
+
+    with pytest.raises(InsecureAgentDirectoryError):
+        agent.check_socket_dir(socket_path.parent)
+
+
+def test_other_users_agent(mocker: MockerFixture, server: AgentServer) -> None:
+    mocker.patch.object(agent, "_get_peer_uid", return_value=os.getuid() + 1)
+    agent.set_password("username", "password")
+    mocker.stopall()
+
+    # the password was never sent
+    assert agent.get_password("username") is None
@@ -0,0 +1,85 @@
+import os
+import zipfile
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ambramelin.util import bundle
+from ambramelin.util.errors import InvalidBundleError
+from tests.conftest import make_dicom
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> Path:
+    path = tmp_path / "study.zip"
+
+    with zipfile.ZipFile(path, mode="w") as zf:
+        zf.writestr("SER0001/IMG0001.dcm", make_dicom("1.1", "1", Modality="CT"))
+        zf.writestr(
+            "SER0002/IMG0001.dcm",
+            make_dicom("2.1", "2", SeriesDescription="Axial"),
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+        zf.writestr("DICOMDIR/README.txt", b"not a dicom file")
+
+    return path
+
+
+def test_load_index(path: Path) -> None:
+    entries = bundle.load_index(path).entries
+
+    assert [
+        (e.name, e.sop_instance_uid, e.series_uid, e.modality, e.series_description)
+        for e in entries
+    ] == [
+        ("SER0001/IMG0001.dcm", "1.1", "1", "CT", None),
+        ("SER0002/IMG0001.dcm", "2.1", "2", None, "Axial"),
+        ("DICOMDIR/README.txt", None, None, None, None),
+    ]
+    assert entries[0].size == len(make_dicom("1.1", "1", Modality="CT"))
+    assert bundle.get_index_path(path).exists()
+
+
+def test_load_index_cached(mocker: MockerFixture, path: Path) -> None:
+    index = bundle.load_index(path)
+    mock_build_index = mocker.spy(bundle, "_build_index")
+
+    assert bundle.load_index(path) == index
+    mock_build_index.assert_not_called()
+
+    # the bundle changes
+    with zipfile.ZipFile(path, mode="a") as zf:
+        zf.writestr("SER0003/IMG0001.dcm", make_dicom("3.1", "3"))
+
+    os.utime(path, ns=(0, 0))
+    assert len(bundle.load_index(path).entries) == 4
+    mock_build_index.assert_called_once()
+
+
+def test_load_index_failure(tmp_path: Path) -> None:
+    path = tmp_path / "study.zip"
+    path.write_bytes(b"not a zip file")
+
+    with pytest.raises(InvalidBundleError):
+        bundle.load_index(path)
+
+
+def test_iter_entries(path: Path) -> None:
+    entries = bundle.load_index(path).entries
+
+    with zipfile.ZipFile(path) as zf:
+        assert [
+            (entry.name, data) for entry, data in bundle.iter_entries(path, entries)
+        ] == [(name, zf.read(name)) for name in zf.namelist()]
+
+
+def test_iter_entries_corrupt(path: Path) -> None:
+    entries = bundle.load_index(path).entries
+    data = bytearray(path.read_bytes())
+    # a byte of the first (stored) entry's contents
+    data[entries[0].offset + 100] ^= 0xFF
+    path.write_bytes(data)
+
+    with pytest.raises(InvalidBundleError):
+        list(bundle.iter_entries(path, entries[:1]))
@@ -0,0 +1,95 @@
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ambramelin.util import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(mocker: MockerFixture, tmp_path: Path) -> Path:
+    mocker.patch.object(cache, "get_response_cache_dir", return_value=tmp_path)
+    mocker.patch.object(cache, "get_env_name", return_value="envname")
+    return tmp_path
+
+
+def test_read_through() -> None:
+    fetch = MagicMock(side_effect=lambda _: cache.Entry("value", etag="etag"))
+
+    assert cache.read_through("endpoint", {"a": 1}, fetch, 60) == "value"
+    assert cache.read_through("endpoint", {"a": 1}, fetch, 60) == "value"
+    fetch.assert_called_once_with(None)
+
+    # stale entries are given to `fetch`, for revalidation
+    assert cache.read_through("endpoint", {"a": 1}, fetch, 0) == "value"
+    assert fetch.call_args.args[0].etag == "etag"
+
+    # different parameters are cached separately
+    cache.read_through("endpoint", {"a": 2}, fetch, 60)
+    assert fetch.call_count == 3
+
+
+@pytest.mark.parametrize("max_age,refresh", ((None, False), (60, True)))
+def test_read_through_uncached(max_age: float, refresh: bool) -> None:
+    cache.read_through("endpoint", {}, lambda _: cache.Entry("old"), 60)
+
+    result = cache.read_through(
+        "endpoint", {}, lambda _: cache.Entry("new"), max_age, refresh
+    )
+    assert result == "new"
+
+
+def test_eviction(mocker: MockerFixture, cache_dir: Path) -> None:
+    fetch = MagicMock(side_effect=lambda _: cache.Entry("x" * 50))
+    cache.read_through("endpoint", {"key": 0}, fetch, 60)
+    # room for two entries
+    (entry_file,) = cache_dir.glob("*.json")
+    mocker.patch.object(cache, "MAX_SIZE", entry_file.stat().st_size * 2.5)
+
+    cache.read_through("endpoint", {"key": 1}, fetch, 60)
+    # using an entry makes it the most recently used one
+    cache.read_through("endpoint", {"key": 0}, fetch, 60)
+    cache.read_through("endpoint", {"key": 2}, fetch, 60)
+
+    assert len(list(cache_dir.glob("*.json"))) == 2
+    assert fetch.call_count == 3
+    cache.read_through("endpoint", {"key": 0}, fetch, 60)
+    assert fetch.call_count == 3
+    cache.read_through("endpoint", {"key": 1}, fetch, 60)
+    assert fetch.call_count == 4
+
+
+def test_read_through_image(cache_dir: Path) -> None:
+    fetch = MagicMock(return_value=b"jpeg")
+
+    assert cache.read_through_image("endpoint", {"image_uid": "1"}, fetch) == b"jpeg"
+    assert cache.read_through_image("endpoint", {"image_uid": "1"}, fetch) == b"jpeg"
+    fetch.assert_called_once_with()
+
+    cache.read_through_image("endpoint", {"image_uid": "1"}, fetch, refresh=True)
+    cache.read_through_image("endpoint", {"image_uid": "2"}, fetch)
+    assert fetch.call_count == 3
+    assert len(list((cache_dir / "images").iterdir())) == 2
+
+
+def test_evict_images(mocker: MockerFixture, cache_dir: Path) -> None:
+    mocker.patch.object(cache, "MAX_IMAGES_SIZE", 25)
+
+    for key in range(3):
+        cache.read_through_image("endpoint", {"key": key}, lambda: b"x" * 10)
+
+    # using a rendering makes it the most recently used one
+    fetch = MagicMock()
+    cache.read_through_image("endpoint", {"key": 0}, fetch)
+    fetch.assert_not_called()
+    (cache_dir / "images" / ".partial").write_bytes(b"x" * 100)
+
+    cache.evict_images()
+
+    fetch.return_value = b"x" * 10
+    cache.read_through_image("endpoint", {"key": 0}, fetch)
+    cache.read_through_image("endpoint", {"key": 2}, fetch)
+    fetch.assert_not_called()
+    cache.read_through_image("endpoint", {"key": 1}, fetch)
+    fetch.assert_called_once_with()
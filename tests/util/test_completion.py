@@ -0,0 +1,41 @@
+from pathlib import Path
+
+from pytest_mock import MockerFixture
+
+from ambramelin.util import completion
+
+
+def test_update_cache(tmp_path: Path) -> None:
+    path = tmp_path / "completion.cache"
+
+    completion.update_cache(path, envs=["env1", "env2"], users=["user1"])
+    completion.update_cache(path, uuids=["uuid1"], fields=["uuid", "created"])
+    completion.update_cache(path, uuids=["uuid2", "uuid1"], fields=["created"])
+
+    lines = path.read_text().splitlines()
+    assert lines[:4] == [
+        "envs env1 env2",
+        "users user1",
+        "uuids uuid2 uuid1",
+        "fields created uuid",
+    ]
+    assert lines[4].startswith("conditions equals ")
+
+
+def test_update_cache_max_recent(mocker: MockerFixture, tmp_path: Path) -> None:
+    mocker.patch.object(completion, "MAX_RECENT", 2)
+    path = tmp_path / "completion.cache"
+
+    completion.update_cache(path, uuids=["uuid1", "uuid2", "uuid3"])
+
+    assert "uuids uuid1 uuid2" in path.read_text().splitlines()
+
+
+def test_update_cache_unchanged(mocker: MockerFixture, tmp_path: Path) -> None:
+    path = tmp_path / "completion.cache"
+    completion.update_cache(path, envs=["env1"], uuids=["uuid1"])
+    mock_write = mocker.patch.object(completion, "atomic_write")
+
+    completion.update_cache(path, envs=["env1"], uuids=["uuid1"])
+
+    mock_write.assert_not_called()
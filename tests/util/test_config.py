@@ -1,4 +1,6 @@
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 
@@ -7,6 +9,7 @@ import pytest
 from pytest_mock import MockerFixture
 
 from ambramelin.util import config as util_config
+from ambramelin.util import files
 from ambramelin.util.config import Config, Environment, User
 
 
@@ -50,7 +53,55 @@ def test_save_config(mocker: MockerFixture) -> None:
             assert cattr.structure(json.loads(f.read()), Config) == config
 
 
-def test_update_config(mocker: MockerFixture) -> None:
+def test_save_config_atomic(mocker: MockerFixture) -> None:
+    with TemporaryDirectory() as tmp:
+        path = Path(tmp) / "config.json"
+        path.write_text("original")
+        mocker.patch.object(util_config, "_get_config_path", return_value=path)
+        mocker.patch.object(files.os, "fsync", side_effect=OSError)
+
+        with pytest.raises(OSError):
+            util_config.save_config(Config())
+
+        # neither the original nor a temporary file is left behind
+        assert path.read_text() == "original"
+        assert list(Path(tmp).iterdir()) == [path]
+
+
+def test_save_config_completion_failure(mocker: MockerFixture, tmp_path: Path) -> None:
+    path = tmp_path / "config.json"
+    mocker.patch.object(util_config, "_get_config_path", return_value=path)
+    mocker.patch.object(
+        util_config.completion, "update_cache", side_effect=PermissionError
+    )
+
+    util_config.save_config(Config(current="env1"))
+
+    assert util_config.load_config() == Config(current="env1")
+
+
+def test_load_config_cache(mocker: MockerFixture) -> None:
+    with TemporaryDirectory() as tmp:
+        path = Path(tmp) / "config.json"
+        mocker.patch.object(util_config, "_get_config_path", return_value=path)
+        util_config.save_config(Config(current="env1"))
+        mock_structure = mocker.spy(util_config.cattr, "structure")
+
+        config = util_config.load_config()
+        config.current = "modified"
+        assert util_config.load_config() == Config(current="env1")
+        mock_structure.assert_not_called()
+
+        # e.g. another process
+        path.write_text(json.dumps(cattr.unstructure(Config(current="env2"))))
+        assert util_config.load_config() == Config(current="env2")
+        mock_structure.assert_called_once()
+
+
+def test_update_config(mocker: MockerFixture, tmp_path: Path) -> None:
+    mocker.patch.object(
+        util_config, "_get_config_path", return_value=tmp_path / "config.json"
+    )
     mocker.patch.object(util_config, "load_config", return_value=Config())
     mock_save_config = mocker.patch.object(util_config, "save_config")
 
@@ -60,6 +111,35 @@ def test_update_config(mocker: MockerFixture) -> None:
     mock_save_config.assert_called_once_with(config)
 
 
+def test_update_config_unchanged(mocker: MockerFixture, tmp_path: Path) -> None:
+    mocker.patch.object(
+        util_config, "_get_config_path", return_value=tmp_path / "config.json"
+    )
+    mocker.patch.object(util_config, "load_config", return_value=Config())
+    mock_save_config = mocker.patch.object(util_config, "save_config")
+
+    with util_config.update_config():
+        pass
+
+    mock_save_config.assert_not_called()
+
+
+def test_update_config_concurrent(mocker: MockerFixture, tmp_path: Path) -> None:
+    mocker.patch.object(
+        util_config, "_get_config_path", return_value=tmp_path / "config.json"
+    )
+
+    def add_env(name: str) -> None:
+        with util_config.update_config() as config:
+            time.sleep(0.001)  # widen the window for lost updates
+            config.envs[name] = Environment(url=name)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(add_env, (f"env{i}" for i in range(32))))
+
+    assert len(util_config.load_config().envs) == 32
+
+
 @pytest.mark.parametrize(
     "config,result",
     (
@@ -0,0 +1,116 @@
+import json
+from collections.abc import Iterator
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ambramelin.util import credentials
+from ambramelin.util.credentials import (
+    CredentialManagerError,
+    DockerCredentialHelperManager,
+    EncryptedFileManager,
+    EnvironmentManager,
+)
+
+
+class TestEncryptedFileManager:
+    @pytest.fixture
+    def manager(self, mocker: MockerFixture) -> Iterator[EncryptedFileManager]:
+        # an optional dependency (the 'encryption' extra)
+        pytest.importorskip("cryptography")
+        manager = EncryptedFileManager()
+
+        with TemporaryDirectory() as dirname:
+            mocker.patch.object(
+                manager, "_get_store_path", return_value=Path(dirname) / "creds.json"
+            )
+            mocker.patch.object(
+                manager, "_get_key_path", return_value=Path(dirname) / "creds.key"
+            )
+            yield manager
+
+    def test_success(self, manager: EncryptedFileManager) -> None:
+        assert manager.get_password("username") is None
+
+        manager.set_password("username", "password")
+        assert manager.get_password("username") == "password"
+        assert "password" not in manager._get_store_path().read_text()
+        assert manager._get_key_path().stat().st_mode & 0o777 == 0o600
+        assert manager._get_store_path().stat().st_mode & 0o777 == 0o600
+
+        # a fresh instance (i.e. process) reads the key back from the key file
+        manager._fernet = None
+        assert manager.get_password("username") == "password"
+
+        manager.del_password("username")
+        assert manager.get_password("username") is None
+
+    def test_key_from_envvar(
+        self, monkeypatch: pytest.MonkeyPatch, manager: EncryptedFileManager
+    ) -> None:
+        from cryptography.fernet import Fernet
+
+        monkeypatch.setenv("AMBRAMELIN_CREDENTIALS_KEY", Fernet.generate_key().decode())
+        manager.set_password("username", "password")
+        assert manager.get_password("username") == "password"
+        assert not manager._get_key_path().exists()
+
+    def test_failure_del_nonexistent(self, manager: EncryptedFileManager) -> None:
+        with pytest.raises(CredentialManagerError):
+            manager.del_password("username")
+
+
+class TestEnvironmentManager:
+    def test_envvar(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setenv("AMBRAMELIN_PASSWORD_USER_DOMAIN_COM", "password")
+        assert EnvironmentManager().get_password("user@domain.com") == "password"
+
+    def test_file(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        with TemporaryDirectory() as dirname:
+            path = Path(dirname) / "secret"
+            path.write_text("password\n")
+            monkeypatch.setenv("AMBRAMELIN_PASSWORD_USERNAME_FILE", str(path))
+            assert EnvironmentManager().get_password("username") == "password"
+
+    def test_missing(self) -> None:
+        assert EnvironmentManager().get_password("username") is None
+
+
+class TestDockerCredentialHelperManager:
+    def test_get_password(self, mocker: MockerFixture) -> None:
+        mock_run = mocker.patch.object(
+            credentials.subprocess,
+            "run",
+            return_value=MagicMock(
+                stdout=json.dumps(
+                    {"Username": "username", "Secret": "password"}
+                ).encode()
+            ),
+        )
+        assert DockerCredentialHelperManager("pass").get_password("username") == (
+            "password"
+        )
+        mock_run.assert_called_once_with(
+            ["docker-credential-pass", "get"],
+            input=b"ambramelin://username",
+            check=True,
+            capture_output=True,
+        )
+
+    def test_get_password_missing(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(
+            credentials.subprocess, "run", side_effect=FileNotFoundError
+        )
+        assert DockerCredentialHelperManager("pass").get_password("username") is None
+
+    def test_set_password(self, mocker: MockerFixture) -> None:
+        mock_run = mocker.patch.object(credentials.subprocess, "run")
+        DockerCredentialHelperManager("pass").set_password("username", "password")
+        assert json.loads(mock_run.call_args.kwargs["input"]) == {
+            "ServerURL": "ambramelin://username",
+            "Username": "username",
+            "Secret": "password",
+        }
@@ -0,0 +1,101 @@
+import json
+from io import BytesIO
+from pathlib import Path
+
+import pydicom
+import pytest
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+
+from ambramelin.util import deidentify
+from ambramelin.util.errors import InvalidArgumentsError, MalformedResponseError
+from tests.conftest import make_dicom
+
+
+def test_load_profile(tmp_path: Path) -> None:
+    path = tmp_path / "profile.json"
+    path.write_text(
+        json.dumps({"replace": {"PatientName": "ANON"}, "remove": ["00100030"]})
+    )
+    assert deidentify.load_profile(path) == deidentify.Profile(
+        replace={"PatientName": "ANON"}, remove=["00100030"]
+    )
+
+
+@pytest.mark.parametrize(
+    "content",
+    ("not json", '{"remove": "PatientName"}', '{"remove": ["NotAKeyword"]}'),
+)
+def test_load_profile_failure(tmp_path: Path, content: str) -> None:
+    path = tmp_path / "profile.json"
+    path.write_text(content)
+
+    with pytest.raises(InvalidArgumentsError):
+        deidentify.load_profile(path)
+
+
+def test_deidentify() -> None:
+    data = make_dicom(
+        "1.2.3", PatientName="Doe^John", PatientID="123", PatientBirthDate="19800101"
+    )
+    profile = deidentify.Profile(
+        replace={"PatientName": "ANON", "AccessionNumber": "none"},
+        remove=["PatientBirthDate"],
+    )
+
+    result = deidentify.deidentify(data, profile)
+    dataset = pydicom.dcmread(BytesIO(result))
+
+    assert dataset.PatientName == "ANON"
+    assert dataset.PatientID == "123"
+    assert "PatientBirthDate" not in dataset
+    # only tags that are present are replaced
+    assert "AccessionNumber" not in dataset
+    # the pixel data is copied through
+    assert result.endswith(b"\x00\x01" * 8)
+    assert dataset.PixelData == b"\x00\x01" * 8
+
+
+def test_deidentify_nested_and_private() -> None:
+    dataset = pydicom.dcmread(BytesIO(make_dicom("1.2.3")))
+    item = Dataset()
+    item.PatientName = "Doe^John"
+    dataset.OtherPatientIDsSequence = Sequence([item])
+    dataset.add_new(0x00091001, "LO", "private")
+    buffer = BytesIO()
+    dataset.save_as(buffer)
+
+    result = deidentify.deidentify(
+        buffer.getvalue(),
+        deidentify.Profile(replace={"PatientName": "ANON"}, remove_private=True),
+    )
+    dataset = pydicom.dcmread(BytesIO(result))
+
+    assert dataset.OtherPatientIDsSequence[0].PatientName == "ANON"
+    assert 0x00091001 not in dataset
+
+
+@pytest.mark.parametrize(
+    "profile",
+    (
+        deidentify.Profile(remove_private=True),
+        deidentify.Profile(remove=["7FE11010"]),
+    ),
+)
+def test_deidentify_after_pixel_data(profile: deidentify.Profile) -> None:
+    dataset = pydicom.dcmread(BytesIO(make_dicom("1.2.3")))
+    dataset.add_new(0x7FE10010, "LO", "creator")
+    dataset.add_new(0x7FE11010, "LO", "private")
+    buffer = BytesIO()
+    dataset.save_as(buffer)
+
+    result = deidentify.deidentify(buffer.getvalue(), profile)
+    dataset = pydicom.dcmread(BytesIO(result))
+
+    assert 0x7FE11010 not in dataset
+    assert dataset.PixelData == b"\x00\x01" * 8
+
+
+def test_deidentify_failure() -> None:
+    with pytest.raises(MalformedResponseError):
+        deidentify.deidentify(b"not a dicom file", deidentify.Profile())
@@ -0,0 +1,29 @@
+import zipfile
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from ambramelin.util import dicom
+from tests.conftest import make_dicom
+
+
+def test_read_sop_instance_uid() -> None:
+    assert dicom.read_sop_instance_uid(make_dicom("1.2.3.4")) == "1.2.3.4"
+    assert dicom.read_sop_instance_uid(b"not a dicom file") is None
+
+
+def test_iter_files() -> None:
+    with TemporaryDirectory() as dirname:
+        path = Path(dirname)
+        (path / "a").mkdir()
+        (path / "a" / "1.dcm").write_bytes(b"1")
+        (path / "2.dcm").write_bytes(b"2")
+
+        assert list(dicom.iter_files(path)) == [("2.dcm", b"2"), ("a/1.dcm", b"1")]
+        assert list(dicom.iter_files(path / "2.dcm")) == [("2.dcm", b"2")]
+
+        with zipfile.ZipFile(path / "bundle.zip", mode="w") as zf:
+            zf.writestr("SER0001/IMG0001.dcm", b"1")
+
+        assert list(dicom.iter_files(path / "bundle.zip")) == [
+            ("SER0001/IMG0001.dcm", b"1")
+        ]
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ambramelin.util import files
+
+
+def test_atomic_write(tmp_path: Path) -> None:
+    path = tmp_path / "file"
+    path.write_text("original")
+
+    with files.atomic_write(path, permissions=0o644) as f:
+        f.write("replaced")
+        # not replaced until written
+        assert path.read_text() == "original"
+
+    assert path.read_text() == "replaced"
+    assert path.stat().st_mode & 0o777 == 0o644
+    assert list(tmp_path.iterdir()) == [path]
+
+
+@pytest.mark.parametrize("failing", ("write", "replace"))
+def test_atomic_write_failure(
+    mocker: MockerFixture, tmp_path: Path, failing: str
+) -> None:
+    path = tmp_path / "file"
+    path.write_text("original")
+
+    if failing == "replace":
+        mocker.patch.object(files.os, "replace", side_effect=OSError)
+
+    with pytest.raises(OSError):
+        with files.atomic_write(path, "wb") as f:
+            f.write(b"replaced")
+
+            if failing == "write":
+                raise OSError()
+
+    # neither the original nor a temporary file is left behind
+    assert path.read_text() == "original"
+    assert list(tmp_path.iterdir()) == [path]
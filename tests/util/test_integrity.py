@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ambramelin.util import integrity
+
+
+def _write(path: Path, data: bytes) -> None:
+    with path.open("wb") as f:
+        writer = integrity.HashingWriter(f, "sha256")
+        writer.write(data[:3])
+        writer.write(data[3:])
+
+    integrity.write_manifest(path, writer.get_manifest(str(path)))
+
+
+def test_hashing_writer(tmp_path: Path) -> None:
+    path = tmp_path / "file"
+    _write(path, b"content")
+
+    manifest = integrity.read_manifest(path)
+    assert manifest is not None
+    assert manifest["digest"] == hashlib.sha256(b"content").hexdigest()
+    assert manifest["bytes"] == 7
+
+
+def test_verify(tmp_path: Path) -> None:
+    path = tmp_path / "file"
+    assert not integrity.verify(path)
+
+    path.write_bytes(b"content")
+    assert not integrity.verify(path)
+
+    _write(path, b"content")
+    assert integrity.verify(path)
+
+    path.write_bytes(b"tampered")
+    assert not integrity.verify(path)
+
+
+def test_is_unchanged(tmp_path: Path) -> None:
+    path = tmp_path / "file"
+    assert not integrity.is_unchanged(path)
+
+    _write(path, b"content")
+    assert integrity.is_unchanged(path)
+
+    # with the same size, but written since
+    mtime_ns = path.stat().st_mtime_ns + 1
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    assert not integrity.is_unchanged(path)
+
+
+def test_write_manifest_atomic(mocker: MockerFixture, tmp_path: Path) -> None:
+    path = tmp_path / "file"
+    _write(path, b"content")
+    mocker.patch.object(integrity.json, "dump", side_effect=ValueError)
+
+    with pytest.raises(ValueError):
+        integrity.write_manifest(path, {"digest": "other"})
+
+    # the previous manifest is intact
+    manifest = json.loads(integrity.get_manifest_path(path).read_text())
+    assert manifest["digest"] == hashlib.sha256(b"content").hexdigest()
@@ -0,0 +1,85 @@
+import time
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ambramelin.util import jobs
+from ambramelin.util.jobs import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path: Path) -> JobQueue:
+    return JobQueue(tmp_path / "jobs.sqlite")
+
+
+def test_add(queue: JobQueue) -> None:
+    assert queue.add("env", ["uuid1", "uuid2"], "{uuid}.zip", "dicom") == 2
+    assert queue.add("env", ["uuid2", "uuid3"], "{uuid}.zip", "dicom") == 1
+    assert queue.get_status()["pending"] == 3
+
+
+def test_claim(queue: JobQueue) -> None:
+    queue.add("env", ["uuid1", "uuid2"], "{uuid}.zip", "dicom")
+
+    task1 = queue.claim()
+    task2 = queue.claim()
+
+    assert task1 is not None and task1.uuid == "uuid1" and task1.attempts == 1
+    assert task2 is not None and task2.uuid == "uuid2"
+    assert queue.claim() is None
+    assert queue.get_status()["running"] == 2
+
+
+def test_complete_and_fail(queue: JobQueue) -> None:
+    queue.add("env", ["uuid1", "uuid2"], "{uuid}.zip", "dicom")
+
+    task = queue.claim()
+    assert task is not None
+    queue.complete(task, 100)
+
+    for attempt in range(1, 3):
+        task = queue.claim()
+        assert task is not None and task.attempts == attempt
+        queue.fail(task, 10, "error", max_attempts=2)
+
+    assert queue.claim() is None
+    assert queue.get_status() == {
+        "pending": 0,
+        "running": 0,
+        "done": 1,
+        "failed": 1,
+        "bytes": 110,
+        "failures": [{"env": "env", "uuid": "uuid2", "attempts": 2, "error": "error"}],
+    }
+
+    assert queue.retry_failed() == 1
+    task = queue.claim()
+    assert task is not None and task.uuid == "uuid2" and task.attempts == 1
+
+
+def test_recover(mocker: MockerFixture, queue: JobQueue) -> None:
+    queue.add("env", ["uuid1", "uuid2"], "{uuid}.zip", "dicom")
+    # claimed by a process that has since stopped renewing its lease (e.g. it crashed,
+    # and its PID may have been reused since)
+    mocker.patch.object(jobs.time, "time", return_value=time.time() - jobs.LEASE - 1)
+    assert JobQueue(queue.path).claim() is not None
+    mocker.stopall()
+    # claimed by this process, which is still running
+    assert queue.claim() is not None
+
+    assert queue.recover() == 1
+    assert queue.get_status()["pending"] == 1
+    assert queue.get_status()["running"] == 1
+
+
+def test_renew(mocker: MockerFixture, queue: JobQueue) -> None:
+    queue.add("env", ["uuid1"], "{uuid}.zip", "dicom")
+    mocker.patch.object(jobs.time, "time", return_value=time.time() - jobs.LEASE - 1)
+    assert queue.claim() is not None
+    mocker.stopall()
+
+    queue.renew()
+
+    assert queue.recover() == 0
+    assert queue.get_status()["running"] == 1
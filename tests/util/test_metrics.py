@@ -0,0 +1,176 @@
+import datetime
+import urllib.request
+from collections.abc import Iterator
+from contextlib import nullcontext
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from ambramelin.util import metrics
+from ambramelin.util.errors import MetricsServerError
+
+
+@pytest.fixture(autouse=True)
+def reset() -> Iterator[None]:
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def _samples() -> list[str]:
+    return [line for line in metrics.render().splitlines() if not line.startswith("#")]
+
+
+def test_render() -> None:
+    metrics.inc("ambra_downloaded_bytes", 1024)
+    metrics.inc("ambra_downloaded_bytes", 1024)
+    metrics.inc("ambra_cache_requests", endpoint="/study/get", result="hit")
+    metrics.observe(
+        "ambra_http_request_duration_seconds", 0.02, endpoint='/a"b', method="GET"
+    )
+
+    text = metrics.render()
+    assert text.endswith("# EOF\n")
+    assert "# TYPE ambra_downloaded_bytes counter" in text
+    assert "# UNIT ambra_downloaded_bytes bytes" in text
+
+    samples = _samples()
+    assert "ambra_downloaded_bytes_total 2048" in samples
+    assert 'ambra_cache_requests_total{endpoint="/study/get",result="hit"} 1' in samples
+    labels = 'endpoint="/a\\"b",method="GET"'
+    assert f'ambra_http_request_duration_seconds_bucket{{{labels},le="0.01"}} 0' in (
+        samples
+    )
+    assert f'ambra_http_request_duration_seconds_bucket{{{labels},le="0.025"}} 1' in (
+        samples
+    )
+    assert f'ambra_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in (
+        samples
+    )
+    assert f'ambra_http_request_duration_seconds_bucket{{{labels},le="1.0"}} 1' in (
+        samples
+    )
+    assert f"ambra_http_request_duration_seconds_count{{{labels}}} 1" in samples
+    assert f"ambra_http_request_duration_seconds_sum{{{labels}}} 0.02" in samples
+
+
+def test_env() -> None:
+    metrics.set_env("env1")
+    metrics.inc("ambra_downloaded_bytes", 1)
+
+    with metrics.recording_env("env2"):
+        metrics.inc("ambra_downloaded_bytes", 2)
+
+    samples = _samples()
+    assert 'ambra_downloaded_bytes_total{env="env1"} 1' in samples
+    assert 'ambra_downloaded_bytes_total{env="env2"} 2' in samples
+
+
+def test_reset() -> None:
+    metrics.inc("ambra_downloaded_bytes", 1024)
+    metrics.reset()
+    assert _samples() == []
+
+
+@pytest.mark.parametrize(
+    "url,endpoint",
+    (
+        ("https://host/api/v3/study/get", "/api/v3/study/get"),
+        (
+            "https://host/study/ns/a93208f1-84d6-47bd-90c5-0d303e561282/1.2.3/diskinfo"
+            "?sid=secret",
+            "/study/ns/{id}/{id}/diskinfo",
+        ),
+        (
+            "https://host/dicomweb/ns/studies/1.2.840.1/series/42",
+            "/dicomweb/ns/studies/{id}/series/{id}",
+        ),
+    ),
+)
+def test_get_endpoint(url: str, endpoint: str) -> None:
+    assert metrics.get_endpoint(url) == endpoint
+
+
+def test_instrument() -> None:
+    session = requests.Session()
+    metrics.instrument(session)
+    metrics.instrument(session)
+    assert session.hooks["response"] == [metrics._record_response]
+
+    response = MagicMock(
+        url="https://host/api/v3/study/get",
+        status_code=200,
+        elapsed=datetime.timedelta(seconds=0.2),
+    )
+    response.request.method = "POST"
+    response.raw.retries.history = (MagicMock(), MagicMock())
+    metrics._record_response(response)
+
+    samples = _samples()
+    assert (
+        'ambra_http_requests_total{endpoint="/api/v3/study/get",method="POST",'
+        'status="200"} 1'
+    ) in samples
+    assert 'ambra_http_retries_total{endpoint="/api/v3/study/get"} 2' in samples
+    assert (
+        'ambra_http_request_duration_seconds_count{endpoint="/api/v3/study/get"} 1'
+    ) in samples
+
+
+@pytest.mark.parametrize(
+    "error,outcome",
+    (
+        (None, "ok"),
+        (SystemExit(0), "ok"),
+        (SystemExit(1), "error"),
+        (ValueError(), "error"),
+    ),
+)
+def test_timing_command(error: BaseException, outcome: str) -> None:
+    with pytest.raises(type(error)) if error is not None else nullcontext():
+        with metrics.timing_command("study get"):
+            if error is not None:
+                raise error
+
+    labels = f'command="study get",outcome="{outcome}"'
+    assert f"ambra_command_duration_seconds_count{{{labels}}} 1" in _samples()
+
+
+def test_exporting_file(tmp_path: Path) -> None:
+    path = tmp_path / "ambra.prom"
+
+    with metrics.exporting(path, None):
+        metrics.inc("ambra_downloaded_bytes", 10)
+
+    assert "ambra_downloaded_bytes_total 10" in path.read_text().splitlines()
+    assert path.stat().st_mode & 0o777 == 0o644
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_serve() -> None:
+    server = metrics.serve(0)
+
+    try:
+        metrics.inc("ambra_downloaded_bytes", 10)
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+
+        with urllib.request.urlopen(url) as response:
+            assert response.headers["Content-Type"] == metrics.CONTENT_TYPE
+            assert "ambra_downloaded_bytes_total 10" in response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_exporting_port_in_use() -> None:
+    server = metrics.serve(0)
+
+    try:
+        with pytest.raises(MetricsServerError):
+            with metrics.exporting(None, server.server_address[1]):
+                pass
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,74 @@
+from collections.abc import Iterator
+
+import pytest
+
+from ambramelin.util import multipart
+from ambramelin.util.errors import MalformedResponseError
+
+BODY = (
+    b"preamble\r\n"
+    b"--boundary\r\n"
+    b"Content-Type: application/dicom\r\n"
+    b"Content-Location: /instances/1\r\n"
+    b"\r\n"
+    b"first\r\n--boundar\r\n"
+    b"--boundary  \r\n"
+    b"\r\n"
+    b"\r\n"
+    b"--boundary--\r\n"
+    b"epilogue"
+)
+
+
+def _chunks(data: bytes, size: int) -> Iterator[bytes]:
+    return (data[i : i + size] for i in range(0, len(data), size))
+
+
+@pytest.mark.parametrize(
+    "content_type,boundary",
+    (
+        ('multipart/related; type="application/dicom"; boundary=abc', b"abc"),
+        ('multipart/related; boundary="a b"', b"a b"),
+    ),
+)
+def test_get_boundary(content_type: str, boundary: bytes) -> None:
+    assert multipart.get_boundary(content_type) == boundary
+
+
+@pytest.mark.parametrize("content_type", ("application/dicom", "multipart/related", ""))
+def test_get_boundary_failure(content_type: str) -> None:
+    with pytest.raises(MalformedResponseError):
+        multipart.get_boundary(content_type)
+
+
+@pytest.mark.parametrize("size", (1, 3, 7, len(BODY)))
+def test_iter_parts(size: int) -> None:
+    assert list(multipart.iter_parts(_chunks(BODY, size), b"boundary")) == [
+        (
+            {
+                "content-type": "application/dicom",
+                "content-location": "/instances/1",
+            },
+            b"first\r\n--boundar",
+        ),
+        ({}, b""),
+    ]
+
+
+def test_iter_parts_no_preamble() -> None:
+    body = b"--b\r\n\r\nbody\r\n--b--"
+    assert list(multipart.iter_parts([body], b"b")) == [({}, b"body")]
+
+
+@pytest.mark.parametrize(
+    "body",
+    (
+        b"no boundary",
+        b"--b\r\n\r\ntruncated",
+        b"--b\r\nContent-Type: application/dicom",
+        b"--b",
+    ),
+)
+def test_iter_parts_failure(body: bytes) -> None:
+    with pytest.raises(MalformedResponseError):
+        list(multipart.iter_parts([body], b"b"))
@@ -0,0 +1,82 @@
+import argparse
+import threading
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ambramelin.util import ratelimit
+
+
+@pytest.mark.parametrize(
+    "value,rate",
+    (("800", 800), ("1.5k", 1536), ("2M", 2 * 1024**2), ("1g", 1024**3)),
+)
+def test_parse_rate(value: str, rate: float) -> None:
+    assert ratelimit.parse_rate(value) == rate
+
+
+@pytest.mark.parametrize("value", ("", "k", "-1", "1t", "fast"))
+def test_parse_rate_invalid(value: str) -> None:
+    with pytest.raises(argparse.ArgumentTypeError):
+        ratelimit.parse_rate(value)
+
+
+class TestRateLimiter:
+    @pytest.fixture(autouse=True)
+    def clock(self, mocker: MockerFixture) -> list[float]:
+        # a fake clock, advanced by sleeping
+        now = [0.0]
+        mocker.patch.object(ratelimit.time, "monotonic", side_effect=lambda: now[0])
+
+        def sleep(seconds: float) -> None:
+            now[0] += seconds
+
+        mocker.patch.object(ratelimit.time, "sleep", side_effect=sleep)
+        return now
+
+    def test_rate(self, clock: list[float]) -> None:
+        limiter = ratelimit.RateLimiter(ratelimit.QUANTUM, burst=ratelimit.QUANTUM)
+
+        # the burst is let through at once, after which the rate applies
+        limiter.consume(ratelimit.QUANTUM)
+        assert clock[0] == 0
+        limiter.consume(10 * ratelimit.QUANTUM)
+        assert clock[0] == pytest.approx(10)
+
+    def test_idle(self, clock: list[float]) -> None:
+        limiter = ratelimit.RateLimiter(ratelimit.QUANTUM, burst=ratelimit.QUANTUM)
+        limiter.consume(ratelimit.QUANTUM)
+        clock[0] += 100
+
+        # an idle limiter does not accumulate more than its burst
+        limiter.consume(2 * ratelimit.QUANTUM)
+        assert clock[0] == pytest.approx(101)
+
+
+def test_rate_limiter_shared(mocker: MockerFixture) -> None:
+    # waits are recorded rather than slept, so that their order is deterministic
+    mocker.patch.object(ratelimit.time, "monotonic", return_value=0.0)
+    mock_sleep = mocker.patch.object(ratelimit.time, "sleep")
+    limiter = ratelimit.RateLimiter(ratelimit.QUANTUM, burst=ratelimit.QUANTUM)
+    threads = [
+        threading.Thread(target=limiter.consume, args=(5 * ratelimit.QUANTUM,))
+        for _ in range(2)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    # the two consumers share one budget: 10 quanta, at one per second
+    assert sorted(call.args[0] for call in mock_sleep.call_args_list) == [
+        pytest.approx(seconds) for seconds in range(1, 10)
+    ]
+
+
+def test_get_limiter() -> None:
+    assert ratelimit.get_limiter("env1", 1024) is ratelimit.get_limiter("env1", 1024)
+    assert ratelimit.get_limiter("env1", 1024) is not ratelimit.get_limiter(
+        "env2", 1024
+    )
@@ -1,9 +1,12 @@
+from unittest.mock import MagicMock
+
 import pytest
+import requests
 from pytest_mock import MockerFixture
 
 from ambramelin.util import sdk
 from ambramelin.util.config import Config, Environment, User
-from ambramelin.util.errors import NoEnvironmentSelectedError
+from ambramelin.util.errors import EnvironmentNotFoundError, NoEnvironmentSelectedError
 from tests.conftest import DummyCredentialManager
 
 
@@ -37,3 +40,126 @@ class TestGetApi:
 
         with pytest.raises(NoEnvironmentSelectedError):
             sdk.get_api()
+
+    def test_success_using_env(
+        self, mocker: MockerFixture, dummy_creds_manager: DummyCredentialManager
+    ) -> None:
+        dummy_creds_manager.set_password("username", "password")
+        mocker.patch.object(
+            sdk,
+            "load_config",
+            return_value=Config(
+                current="envname",
+                envs={
+                    "envname": Environment(url="envurl", user="username"),
+                    "other": Environment(url="otherurl", user="username"),
+                },
+                users={"username": User(credentials_manager="dummy")},
+            ),
+        )
+        mock_api = mocker.patch.object(sdk, "Api")
+
+        with sdk.using_env("other"):
+            sdk.get_api()
+
+        mock_api.assert_called_once_with(
+            "otherurl", username="username", password="password"
+        )
+
+    def test_failure_env_not_found(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(sdk, "load_config", return_value=Config())
+
+        with pytest.raises(EnvironmentNotFoundError):
+            with sdk.using_env("envname"):
+                sdk.get_api()
+
+
+def test_fan_out() -> None:
+    def fn() -> str:
+        env = sdk._env.get()
+
+        if env == "bad":
+            raise NoEnvironmentSelectedError()
+
+        if env == "unreachable":
+            raise requests.ConnectionError()
+
+        return f"result-{env}"
+
+    results = {
+        env: (result, error)
+        for env, result, error in sdk.fan_out(fn, ["a", "b", "bad", "unreachable"])
+    }
+
+    assert results["a"] == ("result-a", None)
+    assert results["b"] == ("result-b", None)
+    assert results["bad"][0] is None
+    assert isinstance(results["bad"][1], NoEnvironmentSelectedError)
+    assert results["unreachable"][0] is None
+    assert isinstance(results["unreachable"][1], requests.ConnectionError)
+
+
+def test_shared_apis(
+    mocker: MockerFixture, dummy_creds_manager: DummyCredentialManager
+) -> None:
+    mocker.patch.object(
+        sdk,
+        "load_config",
+        return_value=Config(
+            current="envname",
+            envs={"envname": Environment(url="envurl", user="username")},
+            users={"username": User(credentials_manager="dummy")},
+        ),
+    )
+    mock_api = mocker.patch.object(sdk, "Api", side_effect=lambda *_, **__: MagicMock())
+
+    with sdk.shared_apis():
+        assert sdk.get_api() is sdk.get_api()
+
+    assert sdk.get_api() is not sdk.get_api()
+    assert mock_api.call_count == 3
+
+
+def test_get_api_from_agent(
+    mocker: MockerFixture, mock_creds_manager: MagicMock
+) -> None:
+    mocker.patch.object(
+        sdk,
+        "load_config",
+        return_value=Config(
+            current="envname",
+            envs={"envname": Environment(url="envurl", user="username")},
+            users={"username": User(credentials_manager="mock")},
+        ),
+    )
+    mocker.patch.object(sdk.agent, "get_password", return_value="agent-password")
+    mock_api = mocker.patch.object(sdk, "Api")
+
+    sdk.get_api()
+
+    mock_api.assert_called_once_with(
+        "envurl", username="username", password="agent-password"
+    )
+    mock_creds_manager.get_password.assert_not_called()
+
+
+def test_get_api_populates_agent(
+    mocker: MockerFixture, dummy_creds_manager: DummyCredentialManager
+) -> None:
+    dummy_creds_manager.set_password("username", "password")
+    mocker.patch.object(
+        sdk,
+        "load_config",
+        return_value=Config(
+            current="envname",
+            envs={"envname": Environment(url="envurl", user="username")},
+            users={"username": User(credentials_manager="dummy")},
+        ),
+    )
+    mocker.patch.object(sdk.agent, "get_password", return_value=None)
+    mock_set_password = mocker.patch.object(sdk.agent, "set_password")
+    mocker.patch.object(sdk, "Api")
+
+    sdk.get_api()
+
+    mock_set_password.assert_called_once_with("username", "password")
@@ -0,0 +1,63 @@
+import pytest
+
+from ambramelin.util import stats
+
+
+def test_summary() -> None:
+    summary = stats.Summary()
+    assert summary.result() == {
+        "count": 0,
+        "sum": 0,
+        "min": None,
+        "max": None,
+        "mean": None,
+    }
+
+    for value in (3, 1, 2):
+        summary.add(value)
+
+    assert summary.result() == {"count": 3, "sum": 6, "min": 1, "max": 3, "mean": 2}
+
+
+def test_histogram() -> None:
+    histogram = stats.Histogram(max_buckets=2)
+
+    for value in ("b", "a", "b", "c", "a", "d"):
+        histogram.add(value)
+
+    assert histogram.result() == {"a": 2, "b": 2, stats.Histogram.OTHER: 2}
+
+
+def test_histogram_unbounded() -> None:
+    histogram = stats.Histogram(max_buckets=None)
+
+    for value in range(2000):
+        histogram.add(value)
+
+    assert len(histogram.result()) == 2000
+    assert stats.Histogram.OTHER not in histogram.result()
+
+
+@pytest.mark.parametrize("cardinality", (0, 10, 1000, 100000))
+def test_hyperloglog(cardinality: int) -> None:
+    hll = stats.HyperLogLog()
+
+    for _ in range(2):
+        for value in range(cardinality):
+            hll.add(f"value{value}")
+
+    assert hll.result() == pytest.approx(cardinality, rel=0.03)
+
+
+def test_quantiles() -> None:
+    quantiles = stats.Quantiles()
+    assert quantiles.result() == {"p50": None, "p90": None, "p99": None}
+
+    for value in range(100000):
+        quantiles.add(value)
+
+    assert len(quantiles.sample) == quantiles.sample_size
+    result = quantiles.result()
+
+    for name, expected in (("p50", 50000), ("p90", 90000), ("p99", 99000)):
+        assert result[name] == pytest.approx(expected, rel=0.05)